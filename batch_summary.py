@@ -0,0 +1,219 @@
+"""
+批次總結命令列：走訪資料夾，平行擷取文件內容並以 Ollama 總結，每份文件輸出一行 JSONL。
+
+    python batch_summary.py 手冊資料夾 --output summaries.jsonl
+
+輸出檔已存在時會接續執行：同一路徑、內容未變（SHA-256 相同）且已成功的文件直接略過，
+因此中途當機後以相同指令重新執行即可；失敗（error）或摘要不完整（partial）的文件會重新總結。擷取結果與 LLM 結果都有持久化快取，
+內容未變動的文件重新總結時幾乎不需要時間。
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+
+from dotenv import load_dotenv
+
+from extractors import SUPPORTED_EXTENSIONS, file_extension, iter_file_segments
+from metrics import RunMetrics
+from spool import open_local_file
+from summarizer import (
+    EMPTY_SUMMARY, chunk_document, enforce_traditional, map_reduce_summary, map_token_budget,
+    remove_think_tags,
+)
+
+
+def iter_documents(root):
+    """依路徑排序逐一產生資料夾內支援格式的檔案（相對路徑, 絕對路徑）"""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if file_extension(name) in SUPPORTED_EXTENSIONS:
+                path = os.path.join(dirpath, name)
+                yield os.path.relpath(path, root), path
+
+
+def load_done(output_path):
+    """讀取既有的輸出檔，回傳已成功完成的 {相對路徑: SHA-256}；忽略當機時寫到一半的最後一行"""
+    done = {}
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get("status") in ("ok", "empty"):
+                done[record["path"]] = record["sha256"]
+    return done
+
+
+def extract_document(rel_path, path, max_tokens, source=None):
+    """在子 process 中讀取並切段單一文件，回傳段落與耗時；source 為已算好 SHA-256 的 SpooledFile 時不再重新計算"""
+    start = time.perf_counter()
+    # 檔案已在磁碟上，以路徑交給擷取器，不讀出整份 bytes
+    source = source or open_local_file(path)
+    dedupe = {}
+    chunks = list(chunk_document(iter_file_segments(rel_path, source), max_tokens, dedupe_stats=dedupe))
+    return {
+        "sha256": source.sha256,
+        "bytes": source.size,
+        "chunks": chunks,
+        "dedupe": dedupe,
+        "extract_s": time.perf_counter() - start,
+    }
+
+
+def summarize_document(model, extracted, map_concurrency):
+    """總結單一文件，回傳（摘要, 是否完整, 耗時, LLM 統計（含各模型層的耗時））"""
+    start = time.perf_counter()
+    metrics = RunMetrics()
+    summary, complete = map_reduce_summary(model, extracted["chunks"], map_concurrency, metrics=metrics)
+    stats = metrics.summary()
+    llm = {**stats["llm"], "tiers": stats["tiers"]}
+    return enforce_traditional(remove_think_tags(summary)), complete, time.perf_counter() - start, llm
+
+
+def run(args):
+    done = load_done(args.output) if args.resume else {}
+    max_tokens = map_token_budget(args.model, args.chunk_tokens)
+    documents = iter_documents(args.directory)
+
+    counts = {"ok": 0, "empty": 0, "partial": 0, "error": 0, "skipped": 0}
+    batch_start = time.perf_counter()
+    mode = "a" if args.resume else "w"
+
+    # 擷取子程序以 spawn 啟動：總結的執行緒與 Ollama 主機池的執行緒已在執行，fork 可能複製到被持有的鎖
+    with open(args.output, mode, encoding="utf-8") as out, \
+            ProcessPoolExecutor(
+                max_workers=args.extract_workers, mp_context=multiprocessing.get_context("spawn")
+            ) as extract_pool, \
+            ThreadPoolExecutor(max_workers=args.doc_workers) as summary_pool:
+
+        def write(record):
+            # 每份文件寫完立即 flush，當機時最多只遺失正在處理中的文件
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+            counts[record["status"]] += 1
+            print(f"[{record['status']}] {record['path']} ({record['timings']['total_s']:.1f}s)", file=sys.stderr)
+
+        extracting = {}  # future -> (相對路徑, 開始時間)
+        summarizing = {}  # future -> (相對路徑, 開始時間, 擷取結果)
+
+        def handle_extracted(future):
+            rel_path, started = extracting.pop(future)
+            try:
+                extracted = future.result()
+            except Exception as e:
+                write(make_record(rel_path, None, "error", started, error=f"擷取失敗：{e}"))
+                return
+            if not "".join(extracted["chunks"]).strip():
+                write(make_record(rel_path, extracted, "empty", started, summary=EMPTY_SUMMARY))
+                return
+            summary_future = summary_pool.submit(summarize_document, args.model, extracted, args.map_concurrency)
+            summarizing[summary_future] = (rel_path, started, extracted)
+
+        def handle_summarized(future):
+            rel_path, started, extracted = summarizing.pop(future)
+            try:
+                summary, complete, summarize_s, llm = future.result()
+            except Exception as e:
+                write(make_record(rel_path, extracted, "error", started, error=f"與 Ollama 溝通時發生錯誤：{e}"))
+                return
+            # 有段落或合併失敗、逾時的摘要記為 partial：續跑時不算完成，會重新總結
+            status, error = ("ok", None) if complete else ("partial", "部分段落摘要失敗或逾時，摘要不完整")
+            write(make_record(
+                rel_path, extracted, status, started, summary=summary, error=error, summarize_s=summarize_s, llm=llm
+            ))
+
+        def collect(return_when):
+            finished, _ = wait(list(extracting) + list(summarizing), return_when=return_when)
+            for future in finished:
+                if future in extracting:
+                    handle_extracted(future)
+                else:
+                    handle_summarized(future)
+
+        # 擷取與總結同時進行；等待中的工作數有上限，記憶體用量不隨文件數增加
+        max_pending = 2 * (args.extract_workers + args.doc_workers)
+        for rel_path, path in documents:
+            source = None
+            if rel_path in done:
+                # 續跑時先計算 SHA-256（只讀取檔案），內容未變動的文件不送去擷取與切段
+                try:
+                    source = open_local_file(path)
+                except OSError as e:
+                    write(make_record(rel_path, None, "error", time.perf_counter(), error=f"讀取失敗：{e}"))
+                    continue
+                if done[rel_path] == source.sha256:
+                    counts["skipped"] += 1
+                    continue
+            future = extract_pool.submit(extract_document, rel_path, path, max_tokens, source)
+            extracting[future] = (rel_path, time.perf_counter())
+            while len(extracting) + len(summarizing) >= max_pending:
+                collect(FIRST_COMPLETED)
+        while extracting or summarizing:
+            collect(FIRST_COMPLETED)
+
+    counts["total_s"] = round(time.perf_counter() - batch_start, 1)
+    print(json.dumps(counts, ensure_ascii=False), file=sys.stderr)
+    return counts
+
+
+def make_record(rel_path, extracted, status, started, summary=None, error=None, summarize_s=0.0, llm=None):
+    """組成一筆 JSONL 紀錄"""
+    extract_s = extracted["extract_s"] if extracted else 0.0
+    return {
+        "path": rel_path,
+        "sha256": extracted["sha256"] if extracted else None,
+        "status": status,
+        "summary": summary,
+        "error": error,
+        "bytes": extracted["bytes"] if extracted else None,
+        "chunks": len(extracted["chunks"]) if extracted else 0,
+        "timings": {
+            "extract_s": round(extract_s, 3),
+            "summarize_s": round(summarize_s, 3),
+            # 包含排隊等待的時間
+            "total_s": round(time.perf_counter() - started, 3),
+        },
+        # 移除的頁首頁尾 / 重複段落與估計省下的 token 數
+        "dedupe": extracted["dedupe"] if extracted else None,
+        # LLM 請求數、快取命中數、token 數與 tokens/sec
+        "llm": llm,
+        "finished_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+    }
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="批次總結資料夾內的文件，輸出 JSONL")
+    parser.add_argument("directory", help="要走訪的資料夾")
+    parser.add_argument("--output", default="summaries.jsonl", help="輸出的 JSONL 檔（預設 summaries.jsonl）")
+    parser.add_argument("--model", default=os.getenv("LLM_MODEL"), help="Ollama 模型（預設讀取 LLM_MODEL）")
+    parser.add_argument("--extract-workers", type=int, default=os.cpu_count() or 1, help="擷取文件的 process 數")
+    parser.add_argument("--doc-workers", type=int, default=2, help="同時總結的文件數")
+    parser.add_argument(
+        "--map-concurrency", type=int, default=int(os.getenv("MAP_CONCURRENCY", "4")),
+        help="每份文件同時送出的段落請求數",
+    )
+    parser.add_argument(
+        "--chunk-tokens", type=int, default=int(os.getenv("MAP_CHUNK_TOKENS", "0")),
+        help="每段的 token 上限（0 表示依模型 context 長度自動計算）",
+    )
+    parser.add_argument("--no-resume", dest="resume", action="store_false", help="覆寫輸出檔並重新總結所有文件")
+    args = parser.parse_args()
+
+    if not args.model:
+        parser.error("請以 --model 或環境變數 LLM_MODEL 指定模型")
+    counts = run(args)
+    sys.exit(1 if counts["error"] or counts["partial"] else 0)
+
+
+if __name__ == "__main__":
+    main()
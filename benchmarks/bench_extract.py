@@ -0,0 +1,285 @@
+"""
+擷取、預處理與切段的效能量測。
+
+    python benchmarks/bench_extract.py [--pages 50] [--rows 20000] [--txt-kb 2048]
+                                       [--repeat 3] [--output result.json] [--baseline old.json]
+
+產生指定大小的合成 PDF / XLSX / CSV / DOCX / PPTX / TXT 檔（不需要網路），
+對每個擷取器與每個處理階段量測：
+  - 吞吐量（MB/s，以原始檔案大小計算；以及頁 / 工作表 / 投影片數每秒）
+  - 峰值記憶體（tracemalloc，另外執行一次量測，不影響計時）
+結果以 JSON 輸出；指定 --baseline 時會列出與前一次結果的速度比。
+缺少的函式庫或 Tesseract 會讓對應項目標記為 skipped，其餘項目照常量測。
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# 使用暫存的快取目錄，量測的是實際擷取而不是快取命中
+os.environ["CACHE_DIR"] = tempfile.mkdtemp(prefix="bench-cache-")
+
+from chunking import chunk_segments  # noqa: E402
+from extractors import EXTRACTORS, Segment  # noqa: E402
+from summarizer import chunk_document, render_clean_segment  # noqa: E402
+
+CHUNK_TOKENS = 2048
+
+# ==== 合成文件 ====
+WORDS = [
+    "登入系統", "採購單", "庫存查詢", "出貨作業", "應收帳款", "會計科目", "點選", "確認",
+    "ERP", "Module", "order", "invoice", "warehouse", "approve", "2024", "1,250", "NT$",
+]
+
+
+def make_line(rng, words=12):
+    return " ".join(rng.choice(WORDS) for _ in range(words)) + "。"
+
+
+def make_txt(args, rng):
+    lines = []
+    size = 0
+    while size < args.txt_kb * 1024:
+        line = make_line(rng)
+        lines.append(line)
+        size += len(line.encode("utf-8")) + 1
+    return "\n".join(lines).encode("utf-8"), 1
+
+
+def make_csv(args, rng):
+    lines = ["item,name,qty,price,note"]
+    for i in range(args.rows):
+        lines.append(f"{i},{rng.choice(WORDS)},{rng.randint(1, 999)},{rng.random() * 1000:.2f},{make_line(rng, 4)}")
+    return "\n".join(lines).encode("utf-8"), 1
+
+
+def make_xlsx(args, rng):
+    from openpyxl import Workbook
+
+    wb = Workbook(write_only=True)
+    for sheet_no in range(args.sheets):
+        ws = wb.create_sheet(f"Sheet{sheet_no + 1}")
+        ws.append(["item", "name", "qty", "price", "note"])
+        for i in range(args.rows // args.sheets):
+            ws.append([i, rng.choice(WORDS), rng.randint(1, 999), round(rng.random() * 1000, 2), make_line(rng, 4)])
+    buffer = io.BytesIO()
+    wb.save(buffer)
+    return buffer.getvalue(), args.sheets
+
+
+def make_docx(args, rng):
+    from docx import Document
+
+    doc = Document()
+    for _ in range(args.pages * 20):
+        doc.add_paragraph(make_line(rng))
+    buffer = io.BytesIO()
+    doc.save(buffer)
+    return buffer.getvalue(), 1
+
+
+def make_pptx(args, rng):
+    from pptx import Presentation
+    from pptx.util import Inches
+
+    prs = Presentation()
+    for _ in range(args.pages):
+        slide = prs.slides.add_slide(prs.slide_layouts[5])
+        slide.shapes.title.text = rng.choice(WORDS)
+        box = slide.shapes.add_textbox(Inches(1), Inches(1.5), Inches(8), Inches(5))
+        box.text_frame.text = "\n".join(make_line(rng) for _ in range(8))
+    buffer = io.BytesIO()
+    prs.save(buffer)
+    return buffer.getvalue(), args.pages
+
+
+def make_text_image(rng, index):
+    """產生一張含英數文字的圖片（供 OCR 量測）"""
+    from PIL import Image, ImageDraw
+
+    image = Image.new("RGB", (800, 200), "white")
+    draw = ImageDraw.Draw(image)
+    for row in range(4):
+        draw.text((20, 20 + row * 40), f"Order {index}-{row} qty {rng.randint(1, 999)} approve", fill="black")
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def make_pdf(args, rng, images_per_page=0):
+    import fitz  # PyMuPDF
+
+    doc = fitz.open()
+    for page_no in range(args.pages):
+        page = doc.new_page()
+        text = "\n".join(make_line(rng) for _ in range(30))
+        page.insert_textbox(fitz.Rect(40, 40, 560, 600), text, fontname="china-t", fontsize=9)
+        for img_no in range(images_per_page):
+            rect = fitz.Rect(40, 610 + img_no * 60, 440, 660 + img_no * 60)
+            page.insert_image(rect, stream=make_text_image(rng, page_no * images_per_page + img_no))
+    return doc.tobytes(), args.pages
+
+
+def make_pdf_scanned(args, rng):
+    return make_pdf(args, rng, images_per_page=args.images_per_page)
+
+
+GENERATORS = {
+    "pdf": make_pdf,
+    "xlsx": make_xlsx,
+    "csv": make_csv,
+    "docx": make_docx,
+    "pptx": make_pptx,
+    "txt": make_txt,
+}
+
+
+# ==== 量測 ====
+def measure(fn, repeat):
+    """執行 repeat 次取最短時間，再另外執行一次量測 tracemalloc 峰值記憶體"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return best, peak
+
+
+def stage_result(stage, data_bytes, units, seconds, peak):
+    mb = data_bytes / (1024 * 1024)
+    return {
+        "stage": stage,
+        "seconds": round(seconds, 4),
+        "mb_per_s": round(mb / seconds, 2) if seconds else None,
+        "units_per_s": round(units / seconds, 1) if seconds else None,
+        "peak_mb": round(peak / (1024 * 1024), 2),
+    }
+
+
+def bench_format(ext, data, units, repeat):
+    """量測單一格式：擷取、預處理、切段，以及串起來的完整讀取流程"""
+    extract_fn = EXTRACTORS[ext]
+    source = f"bench.{ext}"
+
+    def segments():
+        for unit in extract_fn(data):
+            yield Segment(source, unit["unit"], unit["number"], "text", unit["text"])
+
+    extracted = list(segments())
+    cleaned = [render_clean_segment(segment) for segment in extracted]
+
+    stages = [
+        ("extract", lambda: list(segments())),
+        ("preprocess", lambda: [render_clean_segment(segment) for segment in extracted]),
+        ("chunk", lambda: list(chunk_segments(cleaned, CHUNK_TOKENS))),
+        # 等同 get_text_from_files + 切段：邊擷取邊預處理邊切段
+        ("pipeline", lambda: list(chunk_document(segments(), CHUNK_TOKENS))),
+    ]
+    results = []
+    for stage, fn in stages:
+        seconds, peak = measure(fn, repeat)
+        results.append(stage_result(stage, len(data), units, seconds, peak))
+    return results
+
+
+def bench_ocr(data, units, repeat):
+    """量測含圖片 PDF 的文字 + OCR 擷取（等同 get_pdf_content_with_ocr，不經過整份文件快取）"""
+    import disk_cache
+    import pdf_extract
+
+    def run():
+        # 每次使用新的快取目錄，避免單張圖片的 OCR 快取讓後續量測變成快取命中
+        disk_cache.CACHE_DIR = tempfile.mkdtemp(prefix="bench-cache-")
+        disk_cache._extract_cache = None
+        return list(pdf_extract.extract_pdf_ocr_pages(data))
+
+    seconds, peak = measure(run, repeat)
+    return [stage_result("extract_ocr", len(data), units, seconds, peak)]
+
+
+def compare(results, baseline):
+    """列出與 baseline 相比的速度比（> 1 表示變快）"""
+    old = {
+        (item["format"], stage["stage"]): stage
+        for item in baseline.get("formats", []) for stage in item.get("stages", [])
+    }
+    print(f"{'format':<12}{'stage':<14}{'old s':>10}{'new s':>10}{'speedup':>10}{'peak MB':>10}")
+    for item in results["formats"]:
+        for stage in item.get("stages", []):
+            before = old.get((item["format"], stage["stage"]))
+            if not before:
+                continue
+            speedup = before["seconds"] / stage["seconds"] if stage["seconds"] else float("inf")
+            print(
+                f"{item['format']:<12}{stage['stage']:<14}{before['seconds']:>10.4f}"
+                f"{stage['seconds']:>10.4f}{speedup:>10.2f}{stage['peak_mb']:>10.2f}"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="擷取、預處理與切段的效能量測")
+    parser.add_argument("--pages", type=int, default=50, help="PDF 頁數 / PPTX 投影片數；DOCX 為每頁 20 段")
+    parser.add_argument("--rows", type=int, default=20000, help="CSV 與 XLSX 的總列數")
+    parser.add_argument("--sheets", type=int, default=3, help="XLSX 工作表數")
+    parser.add_argument("--txt-kb", type=int, default=2048, help="TXT 檔大小（KB）")
+    parser.add_argument("--images-per-page", type=int, default=2, help="OCR 量測用 PDF 每頁的圖片數")
+    parser.add_argument("--formats", nargs="*", default=list(GENERATORS) + ["pdf-ocr"])
+    parser.add_argument("--repeat", type=int, default=3, help="每項量測的執行次數（取最短時間）")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="將結果寫入 JSON 檔")
+    parser.add_argument("--baseline", help="與先前輸出的 JSON 結果比較")
+    args = parser.parse_args()
+
+    results = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "params": {k: v for k, v in vars(args).items() if k not in ("output", "baseline")},
+        "formats": [],
+    }
+    for fmt in args.formats:
+        rng = random.Random(args.seed)
+        item = {"format": fmt}
+        try:
+            if fmt == "pdf-ocr":
+                data, units = make_pdf_scanned(args, rng)
+            else:
+                data, units = GENERATORS[fmt](args, rng)
+            item.update({"bytes": len(data), "units": units})
+            if fmt == "pdf-ocr":
+                item["stages"] = bench_ocr(data, units, args.repeat)
+            else:
+                item["stages"] = bench_format(fmt, data, units, args.repeat)
+        except Exception as e:
+            item["skipped"] = f"{type(e).__name__}: {e}"
+        results["formats"].append(item)
+        print(f"{fmt}: {'skipped (' + item['skipped'] + ')' if 'skipped' in item else 'done'}", file=sys.stderr)
+
+    text = json.dumps(results, ensure_ascii=False, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+以小型 HuggingFace 模型在 CPU 上比較 hf_pipeline 的兩種 map 模式（read-pdf.py / read-pdf-5070.py 使用）。
+
+    python benchmarks/bench_hf_pipeline.py [--model sshleifer/tiny-gpt2] [--chunks 16] [--batch-sizes 1,4,8]
+                                           [--max-new-tokens 32] [--repeat 3] [--output result.json]
+
+以合成的段落文字執行 map 階段（每段一個摘要請求）：
+  - per_chunk：逐段呼叫 pipeline
+  - batched：所有段落一次交給 pipeline，依 --batch-sizes 的每個值分批
+每種模式取 --repeat 次中最快的一次，輸出秒數、每秒段落數與相對 per_chunk 的加速倍數。
+以 do_sample=False 生成，結果可重現。未安裝 torch / transformers 或無法下載模型時整個量測標記為 skipped。
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from hf_pipeline import generate, load_text_generation  # noqa: E402
+
+MAP_PROMPT = 'Write a concise summary of the following:\n\n\n"{text}"\n\n\nCONCISE SUMMARY:'
+WORDS = "report revenue quarter growth market customer product team risk plan cost result".split()
+
+
+def make_chunks(count, seed=0):
+    """長度不一的合成段落（模擬 PDF 分段後的內容）"""
+    rng = random.Random(seed)
+    return [" ".join(rng.choice(WORDS) for _ in range(rng.randint(40, 160))) for _ in range(count)]
+
+
+def best_of(repeat, fn):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def bench(args):
+    pipe = load_text_generation(args.model, max_new_tokens=args.max_new_tokens, device="cpu", do_sample=False)
+    prompts = [MAP_PROMPT.format(text=chunk) for chunk in make_chunks(args.chunks)]
+    generate(pipe, prompts[:1], mode="per_chunk")  # 預熱
+
+    results = []
+    baseline = best_of(args.repeat, lambda: generate(pipe, prompts, mode="per_chunk"))
+    results.append({"mode": "per_chunk", "batch_size": 1, "seconds": round(baseline, 3)})
+    for batch_size in args.batch_sizes:
+        if batch_size <= 1:
+            continue
+        seconds = best_of(args.repeat, lambda: generate(pipe, prompts, batch_size=batch_size, mode="batched"))
+        results.append({"mode": "batched", "batch_size": batch_size, "seconds": round(seconds, 3)})
+    for item in results:
+        item["chunks_per_s"] = round(args.chunks / item["seconds"], 2)
+        item["speedup"] = round(baseline / item["seconds"], 2)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本機 HF pipeline 逐段與批次 map 的速度比較")
+    parser.add_argument("--model", default="sshleifer/tiny-gpt2")
+    parser.add_argument("--chunks", type=int, default=16)
+    parser.add_argument("--batch-sizes", default="1,4,8", help="逗號分隔的批次大小")
+    parser.add_argument("--max-new-tokens", type=int, default=32)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="結果 JSON 檔案路徑")
+    args = parser.parse_args()
+    args.batch_sizes = [int(size) for size in args.batch_sizes.split(",") if size.strip()]
+
+    result = {"config": vars(args)}
+    try:
+        result["map"] = bench(args)
+    except Exception as e:
+        result["skipped"] = f"{type(e).__name__}: {e}"
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+"""
+OCR 前處理設定的速度與準確度比較。
+
+    python benchmarks/bench_ocr_preprocess.py [--corpus 圖片資料夾] [--dpis 0 300 200 150]
+                                              [--binarize off otsu] [--output result.json]
+
+--corpus 資料夾內的每張圖片（png / jpg / tif）需有同名的 .gt.txt 作為正確文字，
+例如 screen01.png 與 screen01.gt.txt；圖片的原始 DPI 以 --source-dpi 指定。
+未指定 --corpus 時產生合成樣本：以 --source-dpi 模擬高解析度截圖，並包含 RGB、CMYK JPEG
+與透明背景 PNG 三種格式。
+
+每組設定（目標 DPI x 二值化）量測每張圖片的平均 OCR 時間（含正規化）與字元錯誤率（CER），
+目標 DPI 為 0 表示不縮小。以 JSON 輸出，可依部署環境在速度與準確度間選擇
+OCR_TARGET_DPI 與 OCR_BINARIZE。需要安裝 Tesseract；不需要網路。
+"""
+import argparse
+import glob
+import io
+import json
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from pdf_extract import OCR_LANG, normalize_ocr_image  # noqa: E402
+
+CJK_LINES = [
+    "登入系統後點選採購管理，開啟採購單維護畫面",
+    "輸入供應商代號 V10023 與交貨日期 2024/07/15",
+    "按下確認鍵後系統自動產生單號 PO-240715-001",
+    "庫存查詢：料號 A-3321 可用數量 1,250 件",
+]
+LATIN_LINES = [
+    "Login and open Purchase Order maintenance",
+    "Enter vendor code V10023 and delivery date 2024/07/15",
+    "Press Confirm to create order PO-240715-001",
+    "Inventory: item A-3321 available qty 1,250",
+]
+FONT_CANDIDATES = [
+    "**/NotoSansCJK*.tt[cf]", "**/NotoSansTC*.[ot]tf", "**/wqy-*.tt[cf]", "**/msjh*.tt[cf]",
+    "**/DejaVuSans.ttf", "**/LiberationSans-Regular.ttf",
+]
+
+
+# ==== 樣本 ====
+def find_font(path=None):
+    """找可用的字型，優先使用支援中文的字型；回傳 (字型路徑, 是否支援中文)"""
+    if path:
+        return path, True
+    for pattern in FONT_CANDIDATES:
+        for root in ("/usr/share/fonts", "/usr/local/share/fonts", "C:/Windows/Fonts"):
+            matches = glob.glob(os.path.join(root, pattern), recursive=True)
+            if matches:
+                return matches[0], not pattern.startswith(("**/DejaVu", "**/Liberation"))
+    return None, False
+
+
+def make_sample(lines, font_path, source_dpi, mode, seed):
+    """以 source_dpi 繪製 10pt 文字的截圖樣本，mode 為 "rgb" / "cmyk" / "rgba" """
+    from PIL import Image, ImageDraw, ImageFont
+
+    font_px = round(10 * source_dpi / 72)
+    font = ImageFont.truetype(font_path, font_px) if font_path else ImageFont.load_default()
+    rng = random.Random(seed)
+    width = round(8 * source_dpi)  # 8 英吋寬的截圖
+    line_height = round(font_px * 1.8)
+    image = Image.new("RGB", (width, line_height * (len(lines) + 2)), (245, 246, 250))
+    draw = ImageDraw.Draw(image)
+    for i, line in enumerate(lines):
+        color = tuple(rng.randint(0, 60) for _ in range(3))
+        draw.text((font_px, line_height * (i + 1)), line, fill=color, font=font)
+
+    buffer = io.BytesIO()
+    if mode == "cmyk":
+        image.convert("CMYK").save(buffer, format="JPEG", quality=90)
+    elif mode == "rgba":
+        # 背景設為透明，只保留文字
+        rgba = image.convert("RGBA")
+        rgba.putalpha(image.convert("L").point(lambda value: 0 if value > 240 else 255))
+        rgba.save(buffer, format="PNG")
+    else:
+        image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def synthetic_corpus(args):
+    font_path, cjk = find_font(args.font)
+    lines = CJK_LINES if cjk else LATIN_LINES
+    corpus = []
+    for i, mode in enumerate(["rgb", "cmyk", "rgba"] * args.samples):
+        corpus.append({
+            "name": f"synthetic-{i}-{mode}",
+            "image": make_sample(lines, font_path, args.source_dpi, mode, seed=i),
+            "truth": "\n".join(lines),
+        })
+    return corpus, (OCR_LANG if cjk else "eng")
+
+
+def load_corpus(directory):
+    corpus = []
+    for path in sorted(glob.glob(os.path.join(directory, "*"))):
+        if os.path.splitext(path)[1].lower() not in (".png", ".jpg", ".jpeg", ".tif", ".tiff"):
+            continue
+        truth_path = os.path.splitext(path)[0] + ".gt.txt"
+        if not os.path.exists(truth_path):
+            continue
+        with open(path, "rb") as f, open(truth_path, encoding="utf-8") as t:
+            corpus.append({"name": os.path.basename(path), "image": f.read(), "truth": t.read()})
+    return corpus
+
+
+# ==== 準確度 ====
+def char_error_rate(truth, text):
+    """以編輯距離計算字元錯誤率（忽略空白）"""
+    truth = "".join(truth.split())
+    text = "".join(text.split())
+    if not truth:
+        return 0.0 if not text else 1.0
+    previous = list(range(len(text) + 1))
+    for i, a in enumerate(truth, 1):
+        current = [i]
+        for j, b in enumerate(text, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (a != b)))
+        previous = current
+    return min(previous[-1] / len(truth), 1.0)
+
+
+# ==== 量測 ====
+def bench_setting(corpus, lang, source_dpi, target_dpi, binarize):
+    import pytesseract
+    from PIL import Image
+
+    scale = min(1.0, target_dpi / source_dpi) if target_dpi else 1.0
+    seconds, errors, pixels = [], [], []
+    for sample in corpus:
+        start = time.perf_counter()
+        image = normalize_ocr_image(Image.open(io.BytesIO(sample["image"])), scale, max_pixels=0, binarize=binarize)
+        text = pytesseract.image_to_string(image, lang=lang)
+        seconds.append(time.perf_counter() - start)
+        errors.append(char_error_rate(sample["truth"], text))
+        pixels.append(image.width * image.height)
+    return {
+        "target_dpi": target_dpi or source_dpi,
+        "scale": round(scale, 3),
+        "binarize": binarize,
+        "avg_seconds": round(sum(seconds) / len(seconds), 3),
+        "avg_megapixels": round(sum(pixels) / len(pixels) / 1e6, 2),
+        "avg_cer": round(sum(errors) / len(errors), 4),
+        "accuracy": round(1 - sum(errors) / len(errors), 4),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OCR 前處理設定的速度與準確度比較")
+    parser.add_argument("--corpus", help="含圖片與 .gt.txt 的樣本資料夾；未指定時產生合成樣本")
+    parser.add_argument("--source-dpi", type=int, default=400, help="樣本圖片的原始 DPI")
+    parser.add_argument("--dpis", type=int, nargs="*", default=[0, 300, 200, 150], help="要比較的目標 DPI，0 表示不縮小")
+    parser.add_argument("--binarize", nargs="*", default=["off", "otsu"])
+    parser.add_argument("--samples", type=int, default=2, help="合成樣本時每種格式的張數")
+    parser.add_argument("--font", help="合成樣本使用的字型檔")
+    parser.add_argument("--lang", help="Tesseract 語言（預設依樣本決定）")
+    parser.add_argument("--output", help="將結果寫入 JSON 檔")
+    args = parser.parse_args()
+
+    if args.corpus:
+        corpus, lang = load_corpus(args.corpus), OCR_LANG
+    else:
+        corpus, lang = synthetic_corpus(args)
+    lang = args.lang or lang
+    if not corpus:
+        parser.error("找不到樣本圖片（每張圖片需有同名的 .gt.txt）")
+
+    results = {
+        "lang": lang,
+        "source_dpi": args.source_dpi,
+        "samples": len(corpus),
+        "settings": [
+            bench_setting(corpus, lang, args.source_dpi, dpi, binarize)
+            for dpi in args.dpis for binarize in args.binarize
+        ],
+    }
+    text = json.dumps(results, ensure_ascii=False, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+以本機的模擬 Ollama 伺服器（benchmarks/fake_ollama.py）量測 ollama_pool 的負載平衡與故障轉移。
+
+    python benchmarks/bench_ollama_pool.py [--hosts 3] [--host-limit 2] [--requests 60] [--concurrency 12]
+                                           [--tokens 20] [--token-delay 0.02] [--slow-host-delay 0.05]
+                                           [--kill-after 1.0] [--output result.json]
+
+先以單一主機執行同樣的串流請求作為基準，再以 --hosts 台主機的 OllamaPool 執行：
+  - 每台主機收到的請求數與同時進行的最大請求數（不應超過 --host-limit）
+  - 總耗時、每個請求的 p50 / p95 延遲與失敗數
+第一台主機的 token 間隔為 --slow-host-delay（模擬較慢的 GPU），進行中請求較多的主機會少分到新請求。
+指定 --kill-after 時在該秒數後停止最後一台主機，之後的請求應改送其他主機而不失敗。
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fake_ollama import start_fake_server  # noqa: E402
+from ollama_pool import OllamaPool  # noqa: E402
+
+
+def percentile(values, ratio):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(int(len(values) * ratio), len(values) - 1)], 3)
+
+
+def run_workload(pool, args):
+    """以 --concurrency 個執行緒送出 --requests 個串流 chat 請求，回傳延遲與失敗數"""
+    latencies = []
+    errors = []
+
+    def one(i):
+        start = time.perf_counter()
+        try:
+            stream = pool.chat(
+                model="fake", messages=[{"role": "user", "content": f"request {i}"}], stream=True,
+            )
+            for _ in stream:
+                pass
+            latencies.append(time.perf_counter() - start)
+        except Exception as e:
+            errors.append(f"{type(e).__name__}: {e}")
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        list(executor.map(one, range(args.requests)))
+    return {
+        "total_s": round(time.perf_counter() - start, 3),
+        "p50_s": percentile(latencies, 0.5),
+        "p95_s": percentile(latencies, 0.95),
+        "completed": len(latencies),
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+    }
+
+
+def bench_single(args):
+    server = start_fake_server(tokens=args.tokens, token_delay=args.token_delay, name="single")
+    try:
+        pool = OllamaPool([(server.url, args.host_limit)], health_interval_s=0)
+        result = run_workload(pool, args)
+        result["hosts"] = [server.stats()]
+        return result
+    finally:
+        server.stop()
+
+
+def bench_pool(args):
+    servers = [
+        start_fake_server(
+            tokens=args.tokens, token_delay=args.slow_host_delay if i == 0 else args.token_delay, name=f"host{i}",
+        )
+        for i in range(args.hosts)
+    ]
+    pool = OllamaPool([(server.url, args.host_limit) for server in servers], cooldown_s=60, health_interval_s=0.5)
+    killer = None
+    if args.kill_after and args.hosts > 1:
+        killer = threading.Timer(args.kill_after, servers[-1].stop)
+        killer.start()
+    try:
+        result = run_workload(pool, args)
+    finally:
+        if killer:
+            killer.cancel()
+        for server in servers:
+            if not server.stopped:
+                server.stop()
+    result["hosts"] = [
+        {**server.stats(), "failures": stats["failures"], "healthy": stats["healthy"]}
+        for server, stats in zip(servers, pool.stats())
+    ]
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ollama 主機池負載平衡與故障轉移量測")
+    parser.add_argument("--hosts", type=int, default=3)
+    parser.add_argument("--host-limit", type=int, default=2, help="每台主機同時進行的請求數上限")
+    parser.add_argument("--requests", type=int, default=60)
+    parser.add_argument("--concurrency", type=int, default=12)
+    parser.add_argument("--tokens", type=int, default=20)
+    parser.add_argument("--token-delay", type=float, default=0.02)
+    parser.add_argument("--slow-host-delay", type=float, default=0.05, help="第一台主機的 token 間隔")
+    parser.add_argument("--kill-after", type=float, default=1.0, help="幾秒後停止最後一台主機，0 表示不停止")
+    parser.add_argument("--output", help="結果 JSON 檔案路徑")
+    args = parser.parse_args()
+
+    result = {"config": vars(args), "single_host": bench_single(args), "pool": bench_pool(args)}
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+量測各個介面腳本的啟動與 rerun 時間，並與時間預算比較。
+
+    python benchmarks/bench_startup.py [--repeat 3] [--output startup.json] [腳本 ...]
+
+cold：在全新的 Python process 中第一次執行腳本（包含所有 import 與初始化）。
+warm：同一個 process 中再次執行腳本，相當於 Streamlit 的 rerun。
+Streamlit 腳本以 bare 模式執行（沒有瀏覽器），Gradio 腳本不會呼叫 main()，只量測載入時間。
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_SCRIPTS = [
+    "read-file-summary.py",
+    "read-pdf-summary.py",
+    "read-pdf-ocr02.py",
+    "read-pdf.py",
+    "read-pdf-5070.py",
+]
+STARTUP_BUDGET_MS = int(os.getenv("STARTUP_BUDGET_MS", "3000"))
+RERUN_BUDGET_MS = int(os.getenv("RERUN_BUDGET_MS", "300"))
+
+# 在子 process 中執行：第一次為 cold，之後為 warm，以 JSON 印出各次耗時
+RUNNER = r"""
+import json, runpy, sys, time
+path, repeat = sys.argv[1], int(sys.argv[2])
+times = []
+for _ in range(repeat + 1):
+    start = time.perf_counter()
+    runpy.run_path(path, run_name="__bench__")
+    times.append((time.perf_counter() - start) * 1000)
+print("BENCH_RESULT " + json.dumps(times))
+"""
+
+
+def measure(script, repeat):
+    path = os.path.join(ROOT, script)
+    proc = subprocess.run(
+        [sys.executable, "-c", RUNNER, path, str(repeat)],
+        cwd=ROOT, capture_output=True, text=True,
+    )
+    for line in proc.stdout.splitlines():
+        if line.startswith("BENCH_RESULT "):
+            times = json.loads(line[len("BENCH_RESULT "):])
+            warm = sorted(times[1:])
+            return {
+                "script": script,
+                "cold_ms": round(times[0], 1),
+                "warm_ms": round(warm[len(warm) // 2], 1) if warm else None,
+                "cold_within_budget": times[0] <= STARTUP_BUDGET_MS,
+                "warm_within_budget": bool(warm) and warm[len(warm) // 2] <= RERUN_BUDGET_MS,
+            }
+    error = (proc.stderr.strip().splitlines() or ["unknown error"])[-1]
+    return {"script": script, "error": error}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="量測介面腳本的啟動與 rerun 時間")
+    parser.add_argument("scripts", nargs="*", default=DEFAULT_SCRIPTS)
+    parser.add_argument("--repeat", type=int, default=3, help="warm rerun 的次數（取中位數）")
+    parser.add_argument("--output", help="將結果寫入 JSON 檔")
+    args = parser.parse_args()
+
+    results = {
+        "startup_budget_ms": STARTUP_BUDGET_MS,
+        "rerun_budget_ms": RERUN_BUDGET_MS,
+        "scripts": [measure(script, args.repeat) for script in args.scripts],
+    }
+    text = json.dumps(results, ensure_ascii=False, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+
+    over_budget = [
+        r for r in results["scripts"]
+        if "error" in r or not (r["cold_within_budget"] and r["warm_within_budget"])
+    ]
+    sys.exit(1 if over_budget else 0)
+
+
+if __name__ == "__main__":
+    main()
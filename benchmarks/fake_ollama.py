@@ -0,0 +1,207 @@
+"""
+模擬 Ollama HTTP API 的本機伺服器，用來在沒有 GPU 的環境驗證 ollama_pool 的負載平衡與故障轉移。
+
+    python benchmarks/fake_ollama.py [--port 11500] [--tokens 20] [--token-delay 0.02] [--prompt-delay 0]
+
+支援 /api/chat 與 /api/generate（預設以 NDJSON 逐 token 串流，"stream": false 時一次回傳）、
+/api/show、/api/embed、/api/ps、/api/version；另外 GET /fake/stats 回傳收到的請求數、
+同時進行的最大請求數與被用戶端中途關閉的串流數。
+在其他程式中可用 start_fake_server() 啟動（背景執行緒），fail 設為 True 時回應 503，
+stop() 後連線會被拒絕（已建立的連線直接斷線），模擬主機故障。
+"""
+import argparse
+import hashlib
+import json
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CONTEXT_LENGTH = 8192
+EMBED_DIM = 16
+
+
+class FakeOllamaServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port=0, tokens=20, token_delay=0.02, name="fake", prompt_delay=0.0):
+        super().__init__(("127.0.0.1", port), FakeOllamaHandler)
+        self.tokens = tokens
+        self.token_delay = token_delay
+        self.prompt_delay = prompt_delay
+        self.name = name
+        self.fail = False
+        self.stopped = False
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.active = 0
+        self.max_active = 0
+        self.aborted = 0
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def stats(self):
+        with self.lock:
+            return {
+                "name": self.name, "requests": self.requests, "max_active": self.max_active, "aborted": self.aborted,
+            }
+
+    def stop(self):
+        # 已建立的 keep-alive 連線也不再回應，與主機當機相同
+        self.stopped = True
+        self.shutdown()
+        self.server_close()
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _refused(self):
+        """stop() 之後收到的請求（包含 keep-alive 連線上的）不回應，直接斷線"""
+        if self.server.stopped:
+            self.close_connection = True
+            return True
+        return False
+
+    def do_GET(self):
+        if self._refused():
+            return
+        if self.path == "/api/ps":
+            self._send_json({"models": []})
+        elif self.path == "/api/version":
+            self._send_json({"version": "0.0.0-fake"})
+        elif self.path == "/fake/stats":
+            self._send_json(self.server.stats())
+        else:
+            self._send_json({"error": "not found"}, 404)
+
+    def do_POST(self):
+        if self._refused():
+            return
+        server = self.server
+        request = self._read_json()
+        if server.fail:
+            self._send_json({"error": "server unavailable"}, 503)
+            return
+        if self.path == "/api/show":
+            self._send_json({"model_info": {"fake.context_length": CONTEXT_LENGTH}})
+        elif self.path == "/api/embed":
+            inputs = request.get("input") or []
+            inputs = [inputs] if isinstance(inputs, str) else inputs
+            self._send_json({"model": request.get("model"), "embeddings": [self._embed(text) for text in inputs]})
+        elif self.path in ("/api/chat", "/api/generate"):
+            with server.lock:
+                server.requests += 1
+                server.active += 1
+                server.max_active = max(server.max_active, server.active)
+            try:
+                self._generate(request, chat=self.path == "/api/chat")
+            finally:
+                with server.lock:
+                    server.active -= 1
+        else:
+            self._send_json({"error": "not found"}, 404)
+
+    @staticmethod
+    def _embed(text):
+        digest = hashlib.sha256(text.encode()).digest()
+        return [byte / 255 for byte in digest[:EMBED_DIM]]
+
+    def _part(self, request, content, chat, done, **stats):
+        part = {"model": request.get("model"), "created_at": _now(), "done": done, **stats}
+        if chat:
+            part["message"] = {"role": "assistant", "content": content}
+        else:
+            part["response"] = content
+        return part
+
+    def _generate(self, request, chat):
+        server = self.server
+        limit = (request.get("options") or {}).get("num_predict") or server.tokens
+        count = min(server.tokens, limit) if limit > 0 else server.tokens
+        if not chat and not request.get("prompt"):
+            count = 0  # 空 prompt 只載入模型
+        words = [f"{server.name}-{i} " for i in range(count)]
+        start = time.perf_counter()
+        # 評估 prompt 期間（與 Ollama 相同）不送出任何內容，連回應標頭都還沒有
+        time.sleep(server.prompt_delay)
+        stats = {
+            "done_reason": "stop", "load_duration": 0, "prompt_eval_count": 10, "prompt_eval_duration": 1_000_000,
+        }
+        if request.get("stream") is False:
+            time.sleep(server.token_delay * count)
+            elapsed = int((time.perf_counter() - start) * 1e9)
+            self._send_json(self._part(
+                request, "".join(words), chat, True, **stats, eval_count=count, eval_duration=elapsed,
+                total_duration=elapsed,
+            ))
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for word in words:
+                time.sleep(server.token_delay)
+                self._write_chunk(self._part(request, word, chat, False))
+            elapsed = int((time.perf_counter() - start) * 1e9)
+            self._write_chunk(self._part(
+                request, "", chat, True, **stats, eval_count=count, eval_duration=elapsed, total_duration=elapsed,
+            ))
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # 用戶端關閉串流（取消或超過時間上限），停止「生成」
+            with server.lock:
+                server.aborted += 1
+            self.close_connection = True
+
+    def _write_chunk(self, part):
+        line = json.dumps(part).encode() + b"\n"
+        self.wfile.write(f"{len(line):x}\r\n".encode() + line + b"\r\n")
+        self.wfile.flush()
+
+
+def start_fake_server(port=0, tokens=20, token_delay=0.02, name="fake", prompt_delay=0.0):
+    """在背景執行緒啟動模擬伺服器，回傳 FakeOllamaServer（.url 為位址，.stop() 關閉）"""
+    server = FakeOllamaServer(port, tokens, token_delay, name, prompt_delay)
+    threading.Thread(target=server.serve_forever, name=f"fake-ollama-{name}", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="模擬 Ollama API 的本機伺服器")
+    parser.add_argument("--port", type=int, default=11500)
+    parser.add_argument("--tokens", type=int, default=20, help="每次回應的 token 數")
+    parser.add_argument("--token-delay", type=float, default=0.02, help="每個 token 間隔秒數")
+    parser.add_argument("--prompt-delay", type=float, default=0.0, help="開始輸出前的秒數（模擬評估 prompt）")
+    parser.add_argument("--name", default="fake")
+    args = parser.parse_args()
+    server = FakeOllamaServer(args.port, args.tokens, args.token_delay, args.name, args.prompt_delay)
+    print(f"模擬 Ollama 伺服器：{server.url}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+import hashlib
+import os
+import re
+from functools import lru_cache
+
+from chunking import estimate_tokens
+
+# ==== 重複內容移除 ====
+# 操作手冊每頁都有相同的頁首、頁尾、版權宣告與導覽路徑，不同章節也常整段重複。
+# 這些內容在切段前先移除，之後的每一次 LLM 請求都能少評估這些 token：
+#   remove_repeated_lines   每份文件出現在多數頁面前後幾行的行（頁首 / 頁尾；有文字的行數字視為相同，例如頁碼）
+#   drop_near_duplicates    SimHash 判斷為近似重複的段落（已出現過的段落不再送出）
+#   dedupe_chunks           切段後近似重複的段落區塊
+# stats 為 dict 時累加移除的行數、段落數、區塊數與估計省下的 token 數。
+
+DEDUPE = os.getenv("DEDUPE", "on") != "off"
+# 移除規則改變時遞增，讓逐檔摘要的快取失效
+DEDUPE_VERSION = "3"
+# 以每份文件的前幾頁判斷哪些行是頁首 / 頁尾
+BOILERPLATE_SAMPLE_PAGES = int(os.getenv("BOILERPLATE_SAMPLE_PAGES", "20"))
+# 出現在至少這個比例（且至少 BOILERPLATE_MIN_PAGES 頁）的行視為頁首 / 頁尾
+BOILERPLATE_RATIO = float(os.getenv("BOILERPLATE_RATIO", "0.5"))
+BOILERPLATE_MIN_PAGES = int(os.getenv("BOILERPLATE_MIN_PAGES", "3"))
+# 頁首 / 頁尾只在每頁前後各這麼多個非空白行中尋找，頁面中間的表格數值、步驟編號不會被當成頁首頁尾
+BOILERPLATE_EDGE_LINES = int(os.getenv("BOILERPLATE_EDGE_LINES", "3"))
+# 段落至少要有這麼多字才比對近似重複（太短的行如「確認」在手冊中本來就會重複出現）
+DEDUPE_MIN_CHARS = int(os.getenv("DEDUPE_MIN_CHARS", "40"))
+# SimHash 相差的位元數不超過這個值視為近似重複
+SIMHASH_DISTANCE = int(os.getenv("SIMHASH_DISTANCE", "3"))
+
+DIGITS = re.compile(r'\d+')
+LETTERS = re.compile(r'[^\W\d_]')
+SPACES = re.compile(r'\s+')
+# 只移除有頁首 / 頁尾的逐頁內容
+PAGED_UNITS = ("page", "slide")
+# 近似重複只比對文字段落；試算表的資料列彼此相似是正常的，不能移除
+PROSE_UNITS = ("page", "slide", "document")
+
+
+def _count(stats, key, amount=1):
+    if stats is not None:
+        stats[key] = stats.get(key, 0) + amount
+
+
+# ==== 頁首 / 頁尾 ====
+def normalize_line(line):
+    """
+    比對用的行內容：去除空白，數字視為相同（「第 3 頁 / 共 50 頁」每頁都算同一行）。
+    沒有文字、只有數字的行（表格數值、數量、步驟編號）回傳空字串，不會被當成頁首頁尾。
+    """
+    line = SPACES.sub('', line)
+    return DIGITS.sub('#', line) if LETTERS.search(line) else ""
+
+
+def edge_indexes(lines):
+    """頁首 / 頁尾可能出現的位置：前後各 BOILERPLATE_EDGE_LINES 個非空白行"""
+    filled = [i for i, line in enumerate(lines) if line.strip()]
+    return set(filled[:BOILERPLATE_EDGE_LINES] + filled[-BOILERPLATE_EDGE_LINES:])
+
+
+def find_repeated_lines(page_texts):
+    """回傳出現在多數頁面前後幾行的行（正規化後），頁數不足時回傳空集合"""
+    pages = len(page_texts)
+    threshold = max(BOILERPLATE_MIN_PAGES, BOILERPLATE_RATIO * pages)
+    if pages < BOILERPLATE_MIN_PAGES:
+        return set()
+    counts = {}
+    for text in page_texts:
+        lines = text.splitlines()
+        for key in {normalize_line(lines[i]) for i in edge_indexes(lines)}:
+            if key:
+                counts[key] = counts.get(key, 0) + 1
+    return {key for key, count in counts.items() if count >= threshold}
+
+
+def strip_lines(segment, repeated, stats):
+    """移除段落前後幾行中屬於 repeated 的行"""
+    if not repeated:
+        return segment
+    lines = segment.content.splitlines()
+    edges = edge_indexes(lines)
+    kept = []
+    for i, line in enumerate(lines):
+        if i in edges and normalize_line(line) in repeated:
+            _count(stats, "boilerplate_lines")
+            _count(stats, "tokens_saved", estimate_tokens(line))
+        else:
+            kept.append(line)
+    return segment._replace(content="\n".join(kept))
+
+
+def remove_repeated_lines(segments, stats=None):
+    """
+    逐段移除每份文件的頁首 / 頁尾。每份文件先暫存前 BOILERPLATE_SAMPLE_PAGES 頁判斷重複的行，
+    之後的頁面直接套用，因此仍是串流處理，只有每份文件開頭會延遲幾頁。
+    """
+    source = None
+    buffer = []
+    repeated = None
+
+    def flush():
+        nonlocal repeated
+        repeated = find_repeated_lines([s.content for s in buffer if s.kind == "text" and s.unit in PAGED_UNITS])
+        for buffered in buffer:
+            yield strip_lines(buffered, repeated, stats) if buffered.kind == "text" else buffered
+        buffer.clear()
+
+    for segment in segments:
+        if segment.source != source:
+            yield from flush()
+            source, repeated = segment.source, None
+        if segment.unit not in PAGED_UNITS:
+            yield from flush()
+            yield segment
+        elif repeated is None:
+            buffer.append(segment)
+            if sum(1 for s in buffer if s.kind == "text") >= BOILERPLATE_SAMPLE_PAGES:
+                yield from flush()
+        else:
+            yield strip_lines(segment, repeated, stats) if segment.kind == "text" else segment
+    yield from flush()
+
+
+# ==== SimHash 近似重複 ====
+@lru_cache(maxsize=1 << 16)
+def _gram_bits(gram):
+    """字元 n-gram 的 64 位元雜湊（二進位字串）；使用固定的 blake2b，不同 process 與重新啟動後結果相同"""
+    return format(int.from_bytes(hashlib.blake2b(gram.encode(), digest_size=8).digest(), "big"), '064b')
+
+
+def simhash(text, width=3):
+    """以字元 width-gram 計算 64 位元 SimHash（同時適用中文與英文）"""
+    text = SPACES.sub('', text)
+    # 移除結果會影響段落內容與持久化快取，雜湊需跨 process 穩定；逐位元計數交給 zip / tuple.count 在 C 層處理
+    bits = [_gram_bits(text[i:i + width]) for i in range(max(len(text) - width + 1, 1))]
+    half = len(bits) / 2
+    return int("".join('1' if column.count('1') > half else '0' for column in zip(*bits)), 2)
+
+
+class SimHashIndex:
+    """
+    近似重複查詢：指紋切成 SIMHASH_DISTANCE + 1 段，相差不超過 SIMHASH_DISTANCE 位元的兩個指紋
+    至少有一段完全相同，因此只需比較同一段相同的候選。
+    """
+
+    def __init__(self, distance=SIMHASH_DISTANCE):
+        self.distance = distance
+        self.bands = distance + 1
+        self.band_bits = 64 // self.bands
+        self.buckets = {}
+
+    def _keys(self, fingerprint):
+        mask = (1 << self.band_bits) - 1
+        return [(band, (fingerprint >> (band * self.band_bits)) & mask) for band in range(self.bands)]
+
+    def add_if_new(self, fingerprint):
+        """指紋與已加入的某個指紋近似時回傳 False，否則加入並回傳 True"""
+        keys = self._keys(fingerprint)
+        for key in keys:
+            for other in self.buckets.get(key, ()):
+                if bin(fingerprint ^ other).count("1") <= self.distance:
+                    return False
+        for key in keys:
+            self.buckets.setdefault(key, []).append(fingerprint)
+        return True
+
+
+def drop_near_duplicates(segments, stats=None):
+    """移除與先前段落近似重複的行 / 段落（跨頁、跨檔案）；太短的行不比對"""
+    index = SimHashIndex()
+    for segment in segments:
+        if segment.kind != "text" or segment.unit not in PROSE_UNITS:
+            yield segment
+            continue
+        kept = []
+        changed = False
+        for line in segment.content.splitlines():
+            if len(SPACES.sub('', line)) >= DEDUPE_MIN_CHARS and not index.add_if_new(simhash(line)):
+                _count(stats, "duplicate_paragraphs")
+                _count(stats, "tokens_saved", estimate_tokens(line))
+                changed = True
+            else:
+                kept.append(line)
+        yield segment._replace(content="\n".join(kept)) if changed else segment
+
+
+def dedupe_chunks(chunks, stats=None):
+    """切段後再移除近似重複的段落區塊"""
+    index = SimHashIndex()
+    for chunk in chunks:
+        if len(chunk) >= DEDUPE_MIN_CHARS and not index.add_if_new(simhash(chunk)):
+            _count(stats, "duplicate_chunks")
+            _count(stats, "tokens_saved", estimate_tokens(chunk))
+            continue
+        yield chunk
+
+
+def clean_segments(segments, stats=None):
+    """切段前的重複內容移除；DEDUPE=off 時原樣傳回"""
+    if not DEDUPE:
+        return segments
+    return drop_near_duplicates(remove_repeated_lines(segments, stats), stats)
+
+
+def dedupe_stats_text(stats):
+    """將累計的 stats 整理成一行說明"""
+    return (
+        f"移除頁首頁尾 {stats.get('boilerplate_lines', 0)} 行、近似重複段落 {stats.get('duplicate_paragraphs', 0)} 段、"
+        f"重複區塊 {stats.get('duplicate_chunks', 0)} 段，約省下 {stats.get('tokens_saved', 0):,} tokens"
+    )
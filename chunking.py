@@ -0,0 +1,121 @@
+import math
+import os
+import re
+
+from ollama_pool import get_ollama_pool
+
+# ==== 以模型 token 計算的切段 ====
+# 段落大小依模型的 context 長度換算成 token 預算，而不是固定字數：
+# 超過 num_ctx 的內容會被 Ollama 默默截掉，過小的段落則浪費 context。
+
+# 未設定 LLM_NUM_CTX 且無法從 Ollama 取得模型資訊時使用的 context 長度（Ollama 預設值）
+DEFAULT_NUM_CTX = 4096
+# 從模型資訊取得的 context 長度上限，避免 KV cache 佔用過多記憶體
+MAX_NUM_CTX = int(os.getenv("LLM_MAX_CTX", "32768"))
+# 預留給模型輸出的 token 數
+OUTPUT_TOKENS = int(os.getenv("LLM_OUTPUT_TOKENS", "2048"))
+# token 數為估計值，保留一成的安全餘量
+SAFETY_RATIO = 0.9
+
+# 中日韓文字與全形符號大約一字一個 token，其他文字大約四個字元一個 token
+CJK = re.compile(r'[\u2e80-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef]')
+# 句子：以句號或換行結尾
+SENTENCE = re.compile(r'[^。\n]+[。\n]?|[。\n]')
+
+# 已成功從 Ollama 取得的 context 長度；取得失敗時不記錄，Ollama 啟動後下一次呼叫會重新查詢
+_context_lengths = {}
+
+
+def estimate_tokens(text):
+    """估計文字的 token 數"""
+    other = len(CJK.sub('', text))
+    return (len(text) - other) + math.ceil(other / 4)
+
+
+def get_context_length(model):
+    """
+    取得模型使用的 context 長度：優先使用 LLM_NUM_CTX，
+    否則讀取 Ollama 模型資訊中的 *.context_length（上限 LLM_MAX_CTX）。
+    無法連線 Ollama 時暫時使用 DEFAULT_NUM_CTX，但不快取，避免程式啟動時 Ollama 尚未就緒就一直使用預設值。
+    呼叫 Ollama 時應以 options={'num_ctx': ...} 帶入同一個值，Ollama 才不會用預設值截斷。
+    """
+    env_ctx = os.getenv("LLM_NUM_CTX")
+    if env_ctx:
+        return int(env_ctx)
+    if model in _context_lengths:
+        return _context_lengths[model]
+    try:
+        info = get_ollama_pool().show(model).get('modelinfo') or {}
+    except Exception as e:
+        print(f"無法取得模型 {model} 的 context 長度，暫時使用預設值 {DEFAULT_NUM_CTX}：{e}")
+        return DEFAULT_NUM_CTX
+    length = DEFAULT_NUM_CTX
+    for key, value in info.items():
+        if key.endswith('.context_length'):
+            length = min(int(value), MAX_NUM_CTX)
+            break
+    _context_lengths[model] = length
+    return length
+
+
+def input_token_budget(model, prompt_tokens=512, output_tokens=OUTPUT_TOKENS):
+    """扣除 prompt 範本與輸出保留量後，單次請求可放入的文件內容 token 數"""
+    available = get_context_length(model) - prompt_tokens - output_tokens
+    return max(int(available * SAFETY_RATIO), 256)
+
+
+def _split_oversized(text, max_tokens):
+    """將超過預算的文字依句號 / 換行切開；單一句子仍過長時依估計字數硬切"""
+    for match in SENTENCE.finditer(text):
+        sentence = match.group()
+        tokens = estimate_tokens(sentence)
+        if tokens <= max_tokens:
+            yield sentence, tokens
+            continue
+        # 依平均每個 token 的字數換算切點
+        step = max(1, int(len(sentence) * max_tokens / tokens))
+        for start in range(0, len(sentence), step):
+            piece = sentence[start:start + step]
+            yield piece, estimate_tokens(piece)
+
+
+def chunk_segments(segments, max_tokens, render=str):
+    """
+    單次線性掃描，將逐段產生的內容（頁 / 工作表 / 投影片）組成不超過 max_tokens 的段落。
+    優先在頁、工作表、投影片的邊界切開；單一段落本身超過預算時，才在句號或換行處切開。
+    render(segment) 將每個段落轉成文字。
+    """
+    parts = []
+    used = 0
+    for segment in segments:
+        text = render(segment)
+        if not text:
+            continue
+        tokens = estimate_tokens(text)
+        if used + tokens <= max_tokens:
+            parts.append(text)
+            used += tokens
+            continue
+
+        # 目前的段落放不下：先送出累積的內容，讓這一頁完整地從新段落開始
+        if parts:
+            yield "".join(parts)
+            parts, used = [], 0
+        if tokens <= max_tokens:
+            parts.append(text)
+            used = tokens
+            continue
+
+        for piece, piece_tokens in _split_oversized(text, max_tokens):
+            if used + piece_tokens > max_tokens and parts:
+                yield "".join(parts)
+                parts, used = [], 0
+            parts.append(piece)
+            used += piece_tokens
+    if parts:
+        yield "".join(parts)
+
+
+def chunk_text(text, max_tokens):
+    """將單一長字串切成不超過 max_tokens 的段落"""
+    return chunk_segments([text], max_tokens)
@@ -0,0 +1,182 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+# ==== 持久化快取（SQLite） ====
+# 多個 Streamlit worker process 共用同一個資料庫檔案：
+# SQLite 的 WAL 模式允許同時讀取，寫入由資料庫鎖序列化，因此不需要額外的檔案鎖。
+
+CACHE_DIR = os.getenv("CACHE_DIR", ".cache")
+
+
+def sha256_bytes(data):
+    """計算檔案內容的 SHA-256"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def content_sha256(data):
+    """檔案內容的 SHA-256；data 為 SpooledFile 時直接使用寫入暫存檔時算好的值"""
+    sha256 = getattr(data, "sha256", None)
+    return sha256 if sha256 is not None else sha256_bytes(data)
+
+
+class DiskCache:
+    """以 SQLite 實作、依大小做 LRU 淘汰的 key-value 快取"""
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS entries (
+                       key TEXT PRIMARY KEY,
+                       value TEXT NOT NULL,
+                       size INTEGER NOT NULL,
+                       last_access REAL NOT NULL
+                   )"""
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON entries(last_access)")
+
+    def _connect(self):
+        # 每次操作都開新連線，讓同一個物件可以安全地在多執行緒間共用
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA busy_timeout=30000")
+        return _ClosingConnection(conn)
+
+    def get(self, key):
+        """取得快取內容並更新最近使用時間，不存在時回傳 None"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT value FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE entries SET last_access = ? WHERE key = ?", (time.time(), key))
+            return row[0]
+
+    def set(self, key, value):
+        """寫入快取，超過容量時淘汰最久未使用的項目"""
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(
+                    "INSERT OR REPLACE INTO entries (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+                    (key, value, size, time.time()),
+                )
+                self._evict(conn)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    def delete(self, key):
+        """刪除快取項目（不存在時不做任何事）"""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def _evict(self, conn):
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in conn.execute("SELECT key, size FROM entries ORDER BY last_access").fetchall():
+            conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def get_json(self, key):
+        value = self.get(key)
+        return None if value is None else json.loads(value)
+
+    def set_json(self, key, obj):
+        self.set(key, json.dumps(obj, ensure_ascii=False))
+
+
+class _ClosingConnection:
+    """離開 with 區塊時關閉連線（sqlite3 內建的 context manager 只會 commit）"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self.conn
+
+    def __exit__(self, *exc):
+        self.conn.close()
+
+
+# ==== 檔案擷取結果快取 ====
+_extract_cache = None
+
+
+def get_extract_cache():
+    """取得共用的擷取結果快取（每個 process 建立一次）"""
+    global _extract_cache
+    if _extract_cache is None:
+        max_mb = int(os.getenv("EXTRACT_CACHE_MAX_MB", "1024"))
+        _extract_cache = DiskCache(os.path.join(CACHE_DIR, "extract.sqlite3"), max_mb * 1024 * 1024)
+    return _extract_cache
+
+
+# ==== LLM 結果快取 ====
+_summary_cache = None
+
+
+def get_summary_cache():
+    """取得共用的 LLM 結果快取（每個 process 建立一次）"""
+    global _summary_cache
+    if _summary_cache is None:
+        max_mb = int(os.getenv("SUMMARY_CACHE_MAX_MB", "256"))
+        _summary_cache = DiskCache(os.path.join(CACHE_DIR, "summary.sqlite3"), max_mb * 1024 * 1024)
+    return _summary_cache
+
+
+def _unit_size(unit):
+    return sum(len(str(value)) for value in unit.values())
+
+
+def cached_iter(data, extractor, version, iter_fn):
+    """
+    以「檔案內容 SHA-256 + 擷取器名稱 + 版本」為 key 快取擷取結果，data 為 bytes 或 SpooledFile。
+    iter_fn(data) 需逐項產生可 JSON 序列化的逐頁/逐工作表/逐投影片內容；
+    快取命中時直接讀出，未命中時邊擷取邊產生，完整擷取後才寫入快取。
+    呼叫端只讀取前段就停止時（例如單次總結只讀到放得進一次請求的長度），已讀取的部分另存在 key + ":partial"；
+    之後讀取同樣長度以內時直接從快取產生，需要更多內容時才重新擷取（略過已產生的部分），讀得更遠時更新。
+    擷取邏輯改變時請調升 version，舊的結果就不會再被使用。
+    結果超過快取容量時不保留已產生的內容（也不寫入快取），記憶體用量不隨檔案大小增加。
+    """
+    cache = get_extract_cache()
+    key = f"{extractor}:{version}:{content_sha256(data)}"
+    units = cache.get_json(key)
+    if units is not None:
+        yield from units
+        return
+    partial_key = f"{key}:partial"
+    cached = cache.get_json(partial_key) or []
+    yield from cached
+    units = list(cached)
+    size = sum(_unit_size(unit) for unit in units)
+    try:
+        for index, unit in enumerate(iter_fn(data)):
+            if index < len(cached):
+                continue
+            if units is not None:
+                units.append(unit)
+                size += _unit_size(unit)
+                if size > cache.max_bytes:
+                    units = None
+            yield unit
+    except GeneratorExit:
+        # 呼叫端停止讀取（generator 被關閉）：保存已讀取的部分
+        if units is not None and len(units) > len(cached):
+            cache.set_json(partial_key, units)
+        raise
+    if units is not None:
+        cache.set_json(key, units)
+        if cached:
+            cache.delete(partial_key)
@@ -0,0 +1,236 @@
+import os
+from collections import namedtuple
+
+from disk_cache import cached_iter
+from pdf_extract import PAGE_IMAGE, extract_pdf_text_pages, get_pdf_ocr_pages
+from spool import as_file, read_text
+
+# ==== 檔案擷取：逐段產生內容 ====
+# 所有讀取器都改為產生 Segment，下游（預覽、切段、總結）邊讀邊處理，
+# 不需要先把整批上傳檔案組成一個大字串。
+
+# source: 檔名；unit: "page" / "sheet" / "slide" / "document" / "rows"（試算表的後續批次）；
+# number: 頁碼、工作表名稱或投影片編號；"rows" 為「工作表名稱:起始列」（CSV 只有起始列）；kind: "text" / "ocr"；
+# content: 內容；image: OCR 來源圖片在該頁的序號
+Segment = namedtuple("Segment", ["source", "unit", "number", "kind", "content", "image"], defaults=[None])
+
+# 擷取邏輯或輸出格式改變時請調升版本號，讓磁碟快取中的舊結果失效
+EXTRACTOR_VERSION = "4"
+
+
+def file_extension(name):
+    return name.split(".")[-1].lower()
+
+
+# ==== 擷取器註冊 ====
+# 副檔名 -> 擷取函式。各格式的函式庫（PyMuPDF、pandas、python-docx、python-pptx）
+# 在擷取函式內才 import（PyMuPDF 在 pdf_extract 中），只有上傳了該格式的檔案時才會載入。
+EXTRACTORS = {}
+
+
+def register_extractor(*extensions):
+    """註冊擷取器：擷取函式接收檔案 bytes 或 SpooledFile（見 spool.py），逐一產生 {"unit", "number", "text"}"""
+    def decorator(extract_fn):
+        for ext in extensions:
+            EXTRACTORS[ext] = extract_fn
+        return extract_fn
+    return decorator
+
+
+@register_extractor("pdf")
+def extract_pdf(data):
+    for page in extract_pdf_text_pages(data):
+        yield {"unit": "page", "number": page["page"], "text": page["text"]}
+
+
+# ==== 試算表 / CSV 串流讀取 ====
+# 大型匯出檔（數十萬列）逐批讀取：CSV 以 pandas chunksize、XLSX 以 openpyxl read_only 模式，
+# 每批以向量化字串運算轉成文字，略過整欄皆空的欄位與空白列；
+# 單一檔案產生的文字超過 SPREADSHEET_MAX_MB 時停止讀取，記憶體用量有上限。
+SPREADSHEET_BATCH_ROWS = int(os.getenv("SPREADSHEET_BATCH_ROWS", "10000"))
+SPREADSHEET_MAX_BYTES = int(os.getenv("SPREADSHEET_MAX_MB", "64")) * 1024 * 1024
+
+
+def serialize_rows(df):
+    """將一批資料（所有欄位皆為字串）每列以空白相連、各列以換行相連；略過整欄皆空的欄位與空白列"""
+    filled = df.ne('')
+    df = df.loc[filled.any(axis=1), filled.any(axis=0)]
+    if df.empty:
+        return ""
+    columns = [df[column] for column in df.columns]
+    lines = columns[0].str.cat(columns[1:], sep=' ') if len(columns) > 1 else columns[0]
+    return lines.str.cat(sep="\n")
+
+
+def iter_batch_units(batches, unit, number):
+    """
+    將逐批產生的 DataFrame 轉成擷取結果：第一批為 unit（如 "sheet"，顯示標題），之後的批次為 "rows"，
+    number 記錄這一批在原檔案中的起始列（第 1 列為欄位名稱），引用出處時可指出位置；
+    產生的文字超過 SPREADSHEET_MAX_BYTES 時加上截斷說明並停止讀取。
+    """
+    total = 0
+    first = True
+    start_row = 2
+
+    def rows_number():
+        return f"{number}:{start_row}" if unit == "sheet" else str(start_row)
+
+    for df in batches:
+        text = serialize_rows(df)
+        if text:
+            total += len(text.encode("utf-8"))
+            yield {"unit": unit if first else "rows", "number": number if first else rows_number(), "text": text}
+            first = False
+        start_row += len(df)
+        if total > SPREADSHEET_MAX_BYTES:
+            yield {
+                "unit": "rows", "number": rows_number(),
+                "text": f"[內容超過 {SPREADSHEET_MAX_BYTES // (1024 * 1024)} MB 上限，其餘資料未讀取]",
+            }
+            return
+    if first:
+        # 空的工作表仍保留標題，與整張讀取時的輸出一致
+        yield {"unit": unit, "number": number, "text": ""}
+
+
+def iter_xlsx_batches(sheet):
+    """以 openpyxl read_only 模式逐批讀取工作表；第一列為欄位名稱，不輸出"""
+    import pandas as pd
+
+    rows = sheet.iter_rows(values_only=True)
+    if next(rows, None) is None:
+        return
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= SPREADSHEET_BATCH_ROWS:
+            yield pd.DataFrame(batch, dtype=object).fillna('').astype(str)
+            batch = []
+    if batch:
+        yield pd.DataFrame(batch, dtype=object).fillna('').astype(str)
+
+
+@register_extractor("xlsx")
+def extract_xlsx(data):
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(as_file(data), read_only=True, data_only=True)
+    try:
+        for sheet in workbook.worksheets:
+            yield from iter_batch_units(iter_xlsx_batches(sheet), "sheet", str(sheet.title))
+    finally:
+        workbook.close()
+
+
+@register_extractor("xls")
+def extract_xls(data):
+    # 舊版 .xls 無法串流讀取，逐張工作表讀入後分批轉換
+    import pandas as pd
+
+    excel_file = pd.ExcelFile(as_file(data))
+    for sheet_name in excel_file.sheet_names:
+        sheet_df = excel_file.parse(sheet_name, dtype=str, keep_default_na=False)
+        batches = (
+            sheet_df.iloc[start:start + SPREADSHEET_BATCH_ROWS]
+            for start in range(0, len(sheet_df), SPREADSHEET_BATCH_ROWS)
+        )
+        yield from iter_batch_units(batches, "sheet", str(sheet_name))
+
+
+@register_extractor("csv")
+def extract_csv(data):
+    import pandas as pd
+
+    batches = pd.read_csv(as_file(data), dtype=str, keep_default_na=False, chunksize=SPREADSHEET_BATCH_ROWS)
+    yield from iter_batch_units(batches, "document", 1)
+
+
+@register_extractor("docx")
+def extract_docx(data):
+    from docx import Document
+
+    doc = Document(as_file(data))
+    yield {"unit": "document", "number": 1, "text": "\n".join([p.text for p in doc.paragraphs])}
+
+
+@register_extractor("pptx")
+def extract_pptx(data):
+    from pptx import Presentation
+
+    prs = Presentation(as_file(data))
+    for i, slide in enumerate(prs.slides):
+        slide_text = []
+        for shape in slide.shapes:
+            if hasattr(shape, "text"):
+                slide_text.append(shape.text)
+        yield {"unit": "slide", "number": i + 1, "text": "\n".join(slide_text)}
+
+
+@register_extractor("txt")
+def extract_txt(data):
+    yield {"unit": "document", "number": 1, "text": read_text(data)}
+
+
+SUPPORTED_EXTENSIONS = list(EXTRACTORS)
+
+
+def iter_file_segments(source, data):
+    """逐段產生單一檔案的內容（依檔案內容快取，重複上傳時不會再解析檔案）"""
+    ext = file_extension(source)
+    units = cached_iter(data, f"file-{ext}", EXTRACTOR_VERSION, EXTRACTORS[ext])
+    for unit in units:
+        yield Segment(source, unit["unit"], unit["number"], "text", unit["text"])
+
+
+def iter_pdf_ocr_segments(source, data, stats=None, metrics=None, pages=None):
+    """
+    逐段產生 PDF 的頁面文字與圖片 OCR 結果。
+    stats 為 dict 時會累加 "ocr_calls"（實際 OCR 次數）、"ocr_avoided"（去重省下的次數）、
+    "ocr_skipped"（略過的小圖數）與 "kinds"（各頁面分類的頁數），並在 "plans" 記錄每頁是否 OCR 的原因；
+    metrics 為 RunMetrics 時記錄 OCR 耗時；pages 為頁碼範圍（見 pdf_extract.parse_page_range）。
+    """
+    for page in get_pdf_ocr_pages(data, metrics, pages):
+        if stats is not None:
+            for key in ("ocr_calls", "ocr_avoided", "ocr_skipped"):
+                stats[key] = stats.get(key, 0) + page[key]
+            kinds = stats.setdefault("kinds", {})
+            kinds[page["kind"]] = kinds.get(page["kind"], 0) + 1
+            stats.setdefault("plans", []).append(
+                {"檔案": source, "頁碼": page["page"], "分類": page["kind"], "原因": page["reason"]}
+            )
+        yield Segment(source, "page", page["page"], "text", page["text"])
+        for img_no, ocr_text in page["ocr"]:
+            yield Segment(source, "page", page["page"], "ocr", ocr_text, img_no)
+
+
+PAGE_KIND_LABELS = {"text": "文字", "mixed": "混合", "scanned": "掃描", "blank": "空白"}
+
+
+def ocr_stats_text(stats):
+    """將 iter_pdf_ocr_segments 累計的 stats 整理成一行說明"""
+    kinds = "、".join(
+        f"{PAGE_KIND_LABELS.get(kind, kind)} {count} 頁" for kind, count in stats.get("kinds", {}).items()
+    )
+    return (
+        f"OCR 辨識 {stats.get('ocr_calls', 0)} 張圖片，重複圖片省下 {stats.get('ocr_avoided', 0)} 次 OCR，"
+        f"略過 {stats.get('ocr_skipped', 0)} 張小圖" + (f"；頁面分類：{kinds}" if kinds else "")
+    )
+
+
+def render_segment(segment):
+    """將單一 Segment 轉成原本全文中的格式（工作表 / 投影片標題、OCR 標註）"""
+    if segment.kind == "ocr" and segment.image == PAGE_IMAGE:
+        return f"\n[掃描頁 OCR 辨識結果 (第 {segment.number} 頁)]:\n{segment.content}\n"
+    if segment.kind == "ocr":
+        return f"\n[圖片內容 OCR 辨識結果 (第 {segment.number} 頁, 圖片 {segment.image})]:\n{segment.content}\n"
+    if segment.unit == "sheet":
+        return f"\n=== Sheet: {segment.number} ===\n{segment.content}\n"
+    if segment.unit == "slide":
+        return f"\n=== Slide {segment.number} ===\n{segment.content}\n"
+    return segment.content + "\n"
+
+
+def render_segments(segments):
+    """逐段產生全文片段"""
+    for segment in segments:
+        yield render_segment(segment)
@@ -0,0 +1,151 @@
+import os
+
+# ==== 本機 HuggingFace 模型（Gradio 離線版共用） ====
+# read-pdf.py / read-pdf-5070.py 以 transformers 的 text-generation pipeline 在本機總結 PDF：
+#   HF_DEVICE       "auto"（有 CUDA 且已安裝 bitsandbytes 時用 GPU 4-bit，否則 CPU）、"cuda" 或 "cpu"
+#   HF_NUM_THREADS  CPU 模式的執行緒數，0 表示使用 torch 預設值
+#   HF_BATCH_SIZE   map 階段每批送進 pipeline 的段落數
+#   HF_MAP_MODE     "batched"（所有段落一次交給 pipeline，依 HF_BATCH_SIZE 分批）或 "per_chunk"（逐段呼叫）
+#   HF_TOKEN_MAX    合併摘要時一次可放入的 token 數，超過時先分組合併
+# torch / transformers 在 load_text_generation() 內才 import，介面啟動不必等待。
+# 兩種 map 模式的速度可用 benchmarks/bench_hf_pipeline.py 以小模型比較。
+
+HF_DEVICE = os.getenv("HF_DEVICE", "auto")
+HF_NUM_THREADS = int(os.getenv("HF_NUM_THREADS", "0"))
+HF_BATCH_SIZE = int(os.getenv("HF_BATCH_SIZE", "4"))
+HF_MAP_MODE = os.getenv("HF_MAP_MODE", "batched")
+HF_TOKEN_MAX = int(os.getenv("HF_TOKEN_MAX", "3000"))
+
+
+def resolve_device(device=HF_DEVICE):
+    """auto 時有 CUDA 且可使用 bitsandbytes 才回傳 "cuda"，否則回傳 "cpu" """
+    if device != "auto":
+        return device
+    import torch
+
+    if not torch.cuda.is_available():
+        return "cpu"
+    try:
+        import bitsandbytes  # noqa: F401
+    except ImportError:
+        return "cpu"
+    return "cuda"
+
+
+def load_text_generation(model_id, max_new_tokens, device=None, **generate_kwargs):
+    """
+    載入 text-generation pipeline。GPU 模式以 bitsandbytes 4-bit 量化減少 VRAM；
+    CPU 模式不使用 bitsandbytes，以 float32 載入。generate_kwargs 為取樣參數（do_sample、temperature 等）。
+    """
+    import torch
+    from transformers import AutoModelForCausalLM, AutoTokenizer, pipeline
+
+    device = resolve_device(device or HF_DEVICE)
+    tokenizer = AutoTokenizer.from_pretrained(model_id, trust_remote_code=True)
+    # 批次生成時需要 padding；decoder-only 模型從左側補齊，生成的內容才會接在各自的 prompt 後面
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    tokenizer.padding_side = "left"
+
+    if device == "cpu":
+        if HF_NUM_THREADS:
+            torch.set_num_threads(HF_NUM_THREADS)
+        model = AutoModelForCausalLM.from_pretrained(
+            model_id, torch_dtype=torch.float32, low_cpu_mem_usage=True, trust_remote_code=True,
+        )
+    else:
+        from transformers import BitsAndBytesConfig
+
+        quantization_config = BitsAndBytesConfig(
+            load_in_4bit=True,
+            bnb_4bit_quant_type="nf4",
+            bnb_4bit_compute_dtype=torch.bfloat16,
+            bnb_4bit_use_double_quant=True,
+        )
+        model = AutoModelForCausalLM.from_pretrained(
+            model_id, device_map="auto", quantization_config=quantization_config, trust_remote_code=True,
+        )
+    if model.generation_config.pad_token_id is None:
+        model.generation_config.pad_token_id = tokenizer.pad_token_id
+
+    return pipeline(
+        "text-generation",
+        model=model,
+        tokenizer=tokenizer,
+        max_new_tokens=max_new_tokens,
+        return_full_text=False,
+        **generate_kwargs,
+    )
+
+
+def generate(pipe, prompts, batch_size=None, mode=None):
+    """
+    以 pipeline 生成每個 prompt 的結果，依原順序回傳。
+    batched 模式先依長度排序再分批，同一批的 padding 較少；per_chunk 模式逐一呼叫。
+    """
+    batch_size = batch_size or HF_BATCH_SIZE
+    mode = mode or HF_MAP_MODE
+    if not prompts:
+        return []
+    if mode == "per_chunk" or batch_size <= 1 or len(prompts) == 1:
+        outputs = [pipe(prompt) for prompt in prompts]
+    else:
+        order = sorted(range(len(prompts)), key=lambda i: len(prompts[i]))
+        sorted_outputs = pipe([prompts[i] for i in order], batch_size=batch_size)
+        outputs = [None] * len(prompts)
+        for i, output in zip(order, sorted_outputs):
+            outputs[i] = output
+    return [output[0]["generated_text"].strip() for output in outputs]
+
+
+def _group_by_tokens(texts, tokenizer, token_max):
+    """依 token 數把摘要分組，每組不超過 token_max（單一摘要超過時自成一組）"""
+    groups, group, group_tokens = [], [], 0
+    for text in texts:
+        tokens = len(tokenizer.encode(text, add_special_tokens=False))
+        if group and group_tokens + tokens > token_max:
+            groups.append(group)
+            group, group_tokens = [], 0
+        group.append(text)
+        group_tokens += tokens
+    if group:
+        groups.append(group)
+    return groups
+
+
+def _truncate_tokens(text, tokenizer, token_max):
+    """截短到不超過 token_max 個 token"""
+    ids = tokenizer.encode(text, add_special_tokens=False)
+    if len(ids) <= token_max:
+        return text
+    return tokenizer.decode(ids[:token_max], skip_special_tokens=True)
+
+
+def map_reduce_summarize(pipe, texts, map_prompt, combine_prompt, batch_size=None, mode=None, token_max=None):
+    """
+    map-reduce 總結：所有段落的 map 請求一次交給 generate() 批次處理，
+    各段摘要總長超過 token_max 時先分組合併（同樣批次處理），最後合併成一份；只有一段時直接摘要。
+    map_prompt / combine_prompt 為含 {text} 的字串範本。
+    """
+    texts = [text for text in texts if text.strip()]
+    if not texts:
+        return ""
+    if len(texts) == 1:
+        return generate(pipe, [combine_prompt.format(text=texts[0])], batch_size, mode)[0]
+    token_max = token_max or HF_TOKEN_MAX
+    tokenizer = pipe.tokenizer
+    summaries = generate(pipe, [map_prompt.format(text=text) for text in texts], batch_size, mode)
+    while len(summaries) > 1:
+        groups = _group_by_tokens(summaries, tokenizer, token_max)
+        if len(groups) == 1:
+            break
+        if len(groups) == len(summaries):
+            # 任兩份摘要都放不進同一組（各自接近或超過 token_max）：截短到 token_max 的一半，下一輪即可兩兩合併
+            summaries = [_truncate_tokens(summary, tokenizer, token_max // 2) for summary in summaries]
+            continue
+        summaries = generate(
+            pipe, [combine_prompt.format(text="\n\n".join(group)) for group in groups], batch_size, mode
+        )
+    # 只剩一份摘要時它本身也可能超過 token_max
+    text = _truncate_tokens("\n\n".join(summaries), tokenizer, token_max)
+    return generate(pipe, [combine_prompt.format(text=text)], batch_size, mode)[0]
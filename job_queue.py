@@ -0,0 +1,321 @@
+import heapq
+import itertools
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import deque
+
+# ==== 共用工作佇列 ====
+# 同一個 Streamlit process 內所有使用者的 LLM 工作都經過這個佇列，而不是各自直接呼叫 Ollama：
+#   - 固定數量的 worker（JOB_WORKERS）執行工作，同時送往 Ollama 的工作數有上限，不會一起逾時
+#   - 依優先順序（數字小者優先）、再依送出順序執行；每位使用者同時最多 JOB_MAX_PER_USER 個工作，
+#     一個人連續送出不會佔滿佇列
+#   - 排隊的工作數達到 JOB_MAX_QUEUE 時直接拒絕（QueueFull），而不是讓所有人一起變慢
+#   - 排隊中的工作可直接取消；執行中的工作在下一次回報進度或輸出時中止（JobCancelled）
+#   - 等待中的 script 被 rerun 中斷時工作隨之取消，結果沒有人顯示的工作不會繼續佔用 Ollama
+# 工作函式在 worker 執行緒執行，不能呼叫 Streamlit；輸出與進度透過 Job 交給 script thread 顯示。
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_MAX_QUEUE = int(os.getenv("JOB_MAX_QUEUE", "20"))
+JOB_MAX_PER_USER = int(os.getenv("JOB_MAX_PER_USER", "1"))
+# 按下取消後最多等待幾秒讓執行中的請求關閉，以便回報省下的生成時間
+CANCEL_WAIT_S = 5
+
+PRIORITY_HIGH = 0    # 互動問答等短工作
+PRIORITY_NORMAL = 1  # 一般總結
+PRIORITY_LOW = 2     # 批次或背景工作
+
+
+class QueueFull(Exception):
+    """佇列已滿或使用者已有進行中的工作"""
+
+
+class JobCancelled(BaseException):
+    """
+    工作已被取消。與 asyncio.CancelledError 相同繼承 BaseException，
+    不會被總結流程中「except Exception: 回傳錯誤訊息」的處理吞掉。
+    """
+
+
+class Job:
+    """單一工作；status 為 queued / running / done / failed / cancelled"""
+
+    def __init__(self, fn, args, kwargs, priority, owner):
+        self.id = uuid.uuid4().hex[:12]
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.priority = priority
+        self.owner = owner
+        self.status = "queued"
+        self.result = None
+        self.error = None
+        self.seq = 0
+        self.progress = None  # (完成數, 總數)
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._cancel = threading.Event()
+        self._done = threading.Event()
+        self._output = queue.Queue()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def check_cancelled(self):
+        """在工作函式中呼叫；工作已被取消時拋出 JobCancelled"""
+        if self._cancel.is_set():
+            raise JobCancelled()
+
+    def emit(self, text):
+        """串流輸出（作為 on_token 使用），由 script thread 以 drain() 取出"""
+        self.check_cancelled()
+        self._output.put(text)
+
+    def report(self, done, total):
+        """回報進度（作為 chunk_progress 使用）"""
+        self.check_cancelled()
+        self.progress = (done, total)
+
+    def drain(self):
+        """取出目前累積的串流輸出"""
+        parts = []
+        while True:
+            try:
+                parts.append(self._output.get_nowait())
+            except queue.Empty:
+                return "".join(parts)
+
+    def wait(self, timeout=None):
+        """等待工作結束，結束時回傳 True"""
+        return self._done.wait(timeout)
+
+
+class JobScheduler:
+    """固定 worker 數、有上限的優先佇列"""
+
+    def __init__(self, workers=JOB_WORKERS, max_queue=JOB_MAX_QUEUE, max_per_owner=JOB_MAX_PER_USER):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.max_per_owner = max_per_owner
+        self._heap = []
+        self._seq = itertools.count()
+        self._jobs = {}  # 排隊中與執行中的工作
+        self._durations = deque(maxlen=20)  # 最近工作的執行秒數，用來估計等待時間
+        self._cond = threading.Condition()
+        for i in range(workers):
+            threading.Thread(target=self._worker, name=f"job-worker-{i}", daemon=True).start()
+
+    def submit(self, fn, *args, priority=PRIORITY_NORMAL, owner=None, **kwargs):
+        """
+        送出工作，回傳 Job；worker 以 fn(job, *args, **kwargs) 執行。
+        佇列已滿或 owner 已有進行中的工作時拋出 QueueFull。
+        """
+        job = Job(fn, args, kwargs, priority, owner)
+        with self._cond:
+            active = [j for j in self._jobs.values() if not j.cancelled]
+            if owner is not None and sum(j.owner == owner for j in active) >= self.max_per_owner:
+                raise QueueFull("您已有一個進行中的工作，請等待完成或取消後再送出")
+            if sum(j.status == "queued" for j in active) >= self.max_queue:
+                raise QueueFull(f"目前排隊的工作已達上限（{self.max_queue} 個），請稍後再試")
+            job.seq = next(self._seq)
+            self._jobs[job.id] = job
+            heapq.heappush(self._heap, (priority, job.seq, job))
+            self._cond.notify()
+        return job
+
+    def cancel(self, job_id):
+        """取消工作；排隊中的工作立即移除，執行中的工作在下一次回報時中止。工作已結束或已取消時回傳 False"""
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None or job.cancelled:
+                return False
+            job._cancel.set()
+            if job.status == "queued":
+                # 佇列中的項目在 worker 取出時略過
+                self._finish(job, "cancelled")
+            return True
+
+    def position(self, job):
+        """排在這個工作前面的工作數（0 表示下一個執行）"""
+        with self._cond:
+            if job.status != "queued":
+                return 0
+            return sum(
+                1 for other in self._jobs.values()
+                if other.status == "queued" and (other.priority, other.seq) < (job.priority, job.seq)
+            )
+
+    def estimated_wait(self, job):
+        """依最近工作的平均執行時間估計還需等待的秒數；沒有紀錄時回傳 None"""
+        with self._cond:
+            durations = list(self._durations)
+        if not durations:
+            return None
+        rounds = self.position(job) // self.workers + 1
+        return rounds * sum(durations) / len(durations)
+
+    def stats(self):
+        with self._cond:
+            statuses = [job.status for job in self._jobs.values()]
+        return {"workers": self.workers, "queued": statuses.count("queued"), "running": statuses.count("running")}
+
+    def _finish(self, job, status):
+        # 呼叫端需持有 self._cond
+        job.status = status
+        job.finished_at = time.time()
+        self._jobs.pop(job.id, None)
+        job._done.set()
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while True:
+                    while not self._heap:
+                        self._cond.wait()
+                    _, _, job = heapq.heappop(self._heap)
+                    if job.status == "queued":
+                        break
+                job.status = "running"
+                job.started_at = time.time()
+
+            status = "done"
+            try:
+                job.result = job.fn(job, *job.args, **job.kwargs)
+            except JobCancelled:
+                status = "cancelled"
+            except Exception as e:
+                job.error = e
+                status = "failed"
+            with self._cond:
+                if status != "cancelled":
+                    self._durations.append(time.time() - job.started_at)
+                self._finish(job, status)
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """取得 process 內共用的工作佇列（所有 Streamlit session 共用）"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = JobScheduler()
+    return _scheduler
+
+
+# ==== Streamlit 介面 ====
+def submit_job(fn, *args, priority=PRIORITY_NORMAL, **kwargs):
+    """
+    以目前的 Streamlit session 為 owner 送出工作，回傳 Job；佇列已滿時顯示警告並回傳 None。
+    同一個 session 先前被中斷（rerun）而遺留的工作會先取消。
+    """
+    import streamlit as st
+
+    scheduler = get_scheduler()
+    previous = st.session_state.pop("job_id", None)
+    if previous:
+        scheduler.cancel(previous)
+    owner = st.session_state.setdefault("job_owner", uuid.uuid4().hex)
+    try:
+        job = scheduler.submit(fn, *args, priority=priority, owner=owner, **kwargs)
+    except QueueFull as e:
+        st.warning(f"系統忙碌中：{e}")
+        return None
+    st.session_state["job_id"] = job.id
+    return job
+
+
+def cancel_job(job):
+    """取消工作；排隊中的工作立即移除，執行中的工作在下一次回報時中止"""
+    get_scheduler().cancel(job.id)
+
+
+def _cancel_job(job, metrics=None):
+    """取消按鈕的回呼：取消工作並等待請求關閉，把省下的生成時間留給下一次執行顯示"""
+    import streamlit as st
+
+    get_scheduler().cancel(job.id)
+    job.wait(CANCEL_WAIT_S)
+    message = "工作已取消"
+    if metrics:
+        llm = metrics.log()["llm"]
+        if llm["stopped_calls"]:
+            message += f"，中止 {llm['stopped_calls']} 個生成中的請求，估計省下 {llm['reclaimed_s']:.1f} 秒生成時間"
+    st.session_state["job_notice"] = message
+
+
+def show_job_notice():
+    """
+    每次執行開始時呼叫：取消上一次執行遺留、已沒有人等待的工作，並顯示上一次取消工作的結果
+    （取消按鈕會觸發 rerun，結果在下一次執行時顯示）。
+    """
+    import streamlit as st
+
+    # 等待中的執行被 rerun（例如變更任何元件）中斷時，工作的結果不會再顯示，不讓它繼續佔用 Ollama
+    job_id = st.session_state.pop("job_id", None)
+    if job_id and get_scheduler().cancel(job_id):
+        st.session_state.setdefault("job_notice", "畫面重新整理，先前進行中的工作已取消")
+    message = st.session_state.pop("job_notice", None)
+    if message:
+        st.info(message)
+
+
+def wait_for_job(job, on_token=None, on_progress=None, metrics=None, poll_s=0.1):
+    """
+    在 script thread 等待工作結束：排隊時顯示位置與預估等待時間並提供取消按鈕，
+    串流輸出交給 on_token、進度交給 on_progress(完成數, 總數)。回傳結束後的 job。
+    metrics 為這個工作的 RunMetrics 時，取消後會記錄並顯示中止請求所省下的生成時間。
+    """
+    import streamlit as st
+
+    scheduler = get_scheduler()
+    status = st.empty()
+    cancel = st.empty()
+    # 按下取消會觸發 rerun，回呼在下一次執行開始前取消工作
+    cancel.button("取消", key=f"cancel-{job.id}", on_click=_cancel_job, args=(job, metrics))
+    shown = None
+    progress = None
+
+    def flush():
+        nonlocal progress
+        text = job.drain()
+        if text and on_token:
+            on_token(text)
+        if on_progress and job.progress and job.progress != progress:
+            progress = job.progress
+            on_progress(*progress)
+
+    try:
+        while not job.wait(poll_s):
+            if job.status == "queued":
+                wait_s = scheduler.estimated_wait(job)
+                message = f"排隊中：前面還有 {scheduler.position(job)} 個工作"
+                if wait_s:
+                    message += f"，預估約 {wait_s:.0f} 秒後開始"
+                if message != shown:
+                    status.info(message)
+                    shown = message
+            else:
+                # 每次輪詢都呼叫一次 Streamlit：rerun 與取消按鈕的回呼只在 script thread 呼叫 st.* 時處理，
+                # prompt 評估中或非串流模式沒有輸出可顯示，不更新畫面的話取消要等到工作結束才生效
+                started = job.started_at or time.time()
+                shown = f"執行中：已 {time.time() - started:.0f} 秒"
+                status.caption(shown)
+            flush()
+        flush()
+    except BaseException:
+        # script 被中斷（rerun 或關閉頁面）後沒有人會顯示結果，直接取消工作
+        scheduler.cancel(job.id)
+        raise
+    status.empty()
+    cancel.empty()
+    st.session_state.pop("job_id", None)
+    if job.status == "cancelled":
+        st.warning("工作已取消")
+    return job
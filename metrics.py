@@ -0,0 +1,232 @@
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# ==== 效能指標 ====
+# 每次總結建立一個 RunMetrics，記錄各階段耗時（擷取、OCR、預處理）與每次 LLM 請求的
+# Ollama 統計（prompt_eval_count / prompt_eval_duration / eval_count / eval_duration）。
+# 結束時以一行 JSON 寫入 log（logger "doc_summary.metrics"），並可在介面上顯示。
+# METRICS_LOG 指定檔案路徑時寫入該檔，否則輸出到 stderr。
+
+logger = logging.getLogger("doc_summary.metrics")
+
+
+def _configure_logger():
+    if logger.handlers:
+        return
+    path = os.getenv("METRICS_LOG")
+    handler = logging.FileHandler(path, encoding="utf-8") if path else logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+
+def _seconds(nanoseconds):
+    return (nanoseconds or 0) / 1e9
+
+
+class RunMetrics:
+    """單次執行的指標；可在多個執行緒中同時記錄"""
+
+    def __init__(self, **context):
+        self.run_id = uuid.uuid4().hex[:12]
+        self.context = context
+        self.started = time.perf_counter()
+        self.totals = {}  # 階段名稱 -> 累計秒數
+        self.counts = {}  # 階段名稱 -> 次數
+        self.llm_calls = []
+        self.first_token_s = None  # 從開始執行到串流輸出第一個 token 的時間（使用者實際等待的時間）
+        self._lock = threading.Lock()
+
+    def add_time(self, name, seconds, count=1):
+        """累加某個階段的耗時"""
+        with self._lock:
+            self.totals[name] = self.totals.get(name, 0.0) + seconds
+            self.counts[name] = self.counts.get(name, 0) + count
+
+    @contextmanager
+    def span(self, name):
+        """以 with 區塊量測一段程式的耗時"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def timed_iter(self, iterable, name):
+        """包裝產生器，只把取得下一項所花的時間計入 name（不含下游處理的時間）"""
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add_time(name, time.perf_counter() - start, count=0)
+                return
+            self.add_time(name, time.perf_counter() - start)
+            yield item
+
+    def timed(self, fn, name):
+        """包裝函式，每次呼叫的耗時計入 name"""
+        def wrapper(*args, **kwargs):
+            with self.span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+
+    def record_llm(self, stage, model, stats, wall_s, ttft_s=None, cached=False, stopped=None, reclaimed_s=None,
+                   tier=None):
+        """
+        記錄一次 LLM 請求。stats 為 Ollama 回應的最後一個物件（含 *_count / *_duration，單位為奈秒）；
+        ttft_s 為串流時實際量到的第一個 token 時間，未串流時以載入 + prompt 評估時間估計。
+        stopped 為中止原因（"cancelled" / "deadline"），reclaimed_s 為估計因中止而省下的生成時間。
+        tier 為模型層（"map" / "reduce"），彙總時依層統計耗時。
+        """
+        now = time.perf_counter()
+        # 串流請求的第一個 token 就是使用者看到輸出的時間點
+        first_token_s = now - wall_s + ttft_s - self.started if ttft_s is not None else None
+        call = {"stage": stage, "model": model, "cached": cached, "wall_s": round(wall_s, 3)}
+        if tier:
+            call["tier"] = tier
+            # 請求開始時間（相對於這次執行開始），用來計算各層從第一個請求到最後一個請求的區間
+            call["start_s"] = round(now - wall_s - self.started, 3)
+        if stats is not None and not cached:
+            prompt_tokens = stats.get("prompt_eval_count") or 0
+            prompt_s = _seconds(stats.get("prompt_eval_duration"))
+            eval_tokens = stats.get("eval_count") or 0
+            eval_s = _seconds(stats.get("eval_duration"))
+            if ttft_s is None:
+                ttft_s = _seconds(stats.get("load_duration")) + prompt_s
+            call.update({
+                "prompt_tokens": prompt_tokens,
+                "prompt_eval_s": round(prompt_s, 3),
+                "prompt_tokens_per_s": round(prompt_tokens / prompt_s, 1) if prompt_s else None,
+                "eval_tokens": eval_tokens,
+                "eval_s": round(eval_s, 3),
+                "eval_tokens_per_s": round(eval_tokens / eval_s, 1) if eval_s else None,
+                "load_s": round(_seconds(stats.get("load_duration")), 3),
+            })
+        if ttft_s is not None:
+            call["ttft_s"] = round(ttft_s, 3)
+        if stopped:
+            call["stopped"] = stopped
+            call["reclaimed_s"] = round(reclaimed_s, 3) if reclaimed_s is not None else None
+        with self._lock:
+            self.llm_calls.append(call)
+            if first_token_s is not None and (self.first_token_s is None or first_token_s < self.first_token_s):
+                self.first_token_s = first_token_s
+
+    def summary(self):
+        """彙總成可 JSON 序列化的 dict"""
+        with self._lock:
+            calls = list(self.llm_calls)
+            stages = {
+                name: {"seconds": round(seconds, 3), "count": self.counts.get(name, 0)}
+                for name, seconds in self.totals.items()
+            }
+        generated = [call for call in calls if not call["cached"]]
+        prompt_tokens = sum(call.get("prompt_tokens", 0) for call in generated)
+        prompt_s = sum(call.get("prompt_eval_s", 0) for call in generated)
+        eval_tokens = sum(call.get("eval_tokens", 0) for call in generated)
+        eval_s = sum(call.get("eval_s", 0) for call in generated)
+        ttfts = [call["ttft_s"] for call in generated if "ttft_s" in call]
+        stopped = [call for call in calls if call.get("stopped")]
+        return {
+            "run_id": self.run_id,
+            **self.context,
+            "total_s": round(time.perf_counter() - self.started, 3),
+            "stages": stages,
+            "llm": {
+                "calls": len(calls),
+                "cached_calls": len(calls) - len(generated),
+                "prompt_tokens": prompt_tokens,
+                "prompt_tokens_per_s": round(prompt_tokens / prompt_s, 1) if prompt_s else None,
+                "eval_tokens": eval_tokens,
+                "eval_tokens_per_s": round(eval_tokens / eval_s, 1) if eval_s else None,
+                "avg_ttft_s": round(sum(ttfts) / len(ttfts), 3) if ttfts else None,
+                # 從開始執行到畫面出現第一個串流 token 的時間
+                "time_to_first_token_s": round(self.first_token_s, 3) if self.first_token_s is not None else None,
+                # 被取消或超過時間上限而中止的請求數，與估計省下的生成時間
+                "stopped_calls": len(stopped),
+                "reclaimed_s": round(sum(call["reclaimed_s"] or 0 for call in stopped), 3),
+            },
+            "tiers": _tier_summary(calls),
+            "llm_calls": calls,
+        }
+
+    def log(self):
+        """以一行 JSON 寫入 log，回傳彙總結果"""
+        _configure_logger()
+        summary = self.summary()
+        logger.info(json.dumps({"event": "summary_run", **summary}, ensure_ascii=False))
+        return summary
+
+
+def _tier_summary(calls):
+    """
+    依模型層彙總：wall_s 為各請求耗時的合計（平行請求會重疊計算），
+    span_s 為該層第一個請求開始到最後一個請求結束的時間。
+    """
+    tiers = {}
+    for call in calls:
+        if "tier" not in call:
+            continue
+        tier = tiers.setdefault(call["tier"], {"models": [], "calls": [], "start": None, "end": None})
+        if call["model"] not in tier["models"]:
+            tier["models"].append(call["model"])
+        tier["calls"].append(call)
+        end = call["start_s"] + call["wall_s"]
+        tier["start"] = call["start_s"] if tier["start"] is None else min(tier["start"], call["start_s"])
+        tier["end"] = end if tier["end"] is None else max(tier["end"], end)
+    summary = {}
+    for name, tier in tiers.items():
+        generated = [call for call in tier["calls"] if not call["cached"]]
+        eval_tokens = sum(call.get("eval_tokens", 0) for call in generated)
+        eval_s = sum(call.get("eval_s", 0) for call in generated)
+        summary[name] = {
+            "models": tier["models"],
+            "calls": len(tier["calls"]),
+            "cached_calls": len(tier["calls"]) - len(generated),
+            "wall_s": round(sum(call["wall_s"] for call in tier["calls"]), 3),
+            "span_s": round(tier["end"] - tier["start"], 3),
+            "eval_tokens_per_s": round(eval_tokens / eval_s, 1) if eval_s else None,
+        }
+    return summary
+
+
+def show_metrics_panel(metrics, summary=None):
+    """在 Streamlit 介面顯示可收合的效能指標面板"""
+    import streamlit as st
+
+    summary = summary or metrics.summary()
+    llm = summary["llm"]
+    with st.expander(f"效能指標（總耗時 {summary['total_s']:.1f} 秒）", expanded=False):
+        rows = [
+            {"階段": name, "耗時（秒）": stage["seconds"], "次數": stage["count"]}
+            for name, stage in summary["stages"].items()
+        ]
+        if rows:
+            st.table(rows)
+        if summary["tiers"]:
+            st.table([
+                {
+                    "模型層": name, "模型": "、".join(tier["models"]), "請求數": tier["calls"],
+                    "快取": tier["cached_calls"], "請求耗時合計（秒）": tier["wall_s"], "區間（秒）": tier["span_s"],
+                    "生成速度（tok/s）": tier["eval_tokens_per_s"] or "-",
+                }
+                for name, tier in summary["tiers"].items()
+            ])
+        if llm["stopped_calls"]:
+            st.caption(f"中止 {llm['stopped_calls']} 個生成中的請求，估計省下 {llm['reclaimed_s']:.1f} 秒生成時間")
+        cols = st.columns(4)
+        cols[0].metric("LLM 請求", f"{llm['calls']}", f"快取 {llm['cached_calls']}", delta_color="off")
+        ttft = llm["time_to_first_token_s"]
+        cols[1].metric("第一個 token", f"{ttft:.2f} s" if ttft is not None else "-")
+        cols[2].metric("Prompt 評估", f"{llm['prompt_tokens_per_s'] or '-'} tok/s")
+        cols[3].metric("生成速度", f"{llm['eval_tokens_per_s'] or '-'} tok/s")
+        if summary["llm_calls"]:
+            st.dataframe(summary["llm_calls"], use_container_width=True)
@@ -0,0 +1,271 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+from chunking import OUTPUT_TOKENS, get_context_length
+from disk_cache import get_summary_cache
+from ollama_pool import StreamAbort, StreamAborted, get_ollama_pool
+
+# ==== Ollama 模型常駐管理 ====
+# keep_alive 決定模型在最後一次請求後留在記憶體多久（"30m"、"1h"、"-1" 表示永久、"0" 表示立即卸載）。
+# OLLAMA_KEEP_ALIVE 為預設值，OLLAMA_KEEP_ALIVE_MODELS 可依模型覆寫，例如：
+#   OLLAMA_KEEP_ALIVE_MODELS=qwen3:8b=1h,gemma3:12b=-1
+
+DEFAULT_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+
+
+def _parse_keep_alive_models(value):
+    policies = {}
+    for item in value.split(","):
+        model, sep, keep_alive = item.strip().rpartition("=")
+        if sep and model:
+            policies[model.strip()] = keep_alive.strip()
+    return policies
+
+
+KEEP_ALIVE_MODELS = _parse_keep_alive_models(os.getenv("OLLAMA_KEEP_ALIVE_MODELS", ""))
+
+
+def keep_alive_for(model):
+    """取得模型的 keep_alive 設定；純數字視為秒數"""
+    keep_alive = KEEP_ALIVE_MODELS.get(model, DEFAULT_KEEP_ALIVE)
+    try:
+        return int(keep_alive)
+    except ValueError:
+        return keep_alive
+
+
+# ==== 啟動預熱 ====
+# 每個 process 只預熱一次；狀態放在模組層級，Streamlit 每次 rerun 都會共用
+_warm_up_lock = threading.Lock()
+_warm_up_state = {}  # model -> "loading" / "ready" / "failed: ..."
+
+
+def _warm_up(model):
+    try:
+        # 空的 prompt 只會載入模型；num_ctx 必須和實際請求一致，否則第一次請求時 Ollama 會重新載入。
+        # 請求會分散到各台主機，每台主機都要載入
+        results = get_ollama_pool().broadcast(
+            "generate",
+            model=model,
+            prompt="",
+            keep_alive=keep_alive_for(model),
+            options={'num_ctx': get_context_length(model)},
+        )
+        errors = [f"{host}: {result}" for host, result in results.items() if isinstance(result, Exception)]
+        if results and len(errors) == len(results):
+            raise RuntimeError("; ".join(errors))
+        _warm_up_state[model] = "ready"
+    except Exception as e:
+        _warm_up_state[model] = f"failed: {e}"
+
+
+def start_warm_up(model):
+    """在背景執行緒載入模型，不阻塞畫面；同一個模型只會預熱一次"""
+    if not model:
+        return
+    with _warm_up_lock:
+        if model in _warm_up_state:
+            return
+        _warm_up_state[model] = "loading"
+    threading.Thread(target=_warm_up, args=(model,), name=f"warm-up-{model}", daemon=True).start()
+
+
+# ==== 模型狀態 ====
+# 介面每次 rerun 都會顯示模型狀態；/api/ps 的結果在 MODEL_STATUS_TTL_S 秒內共用，
+# 任何元件操作都不必等待查詢各主機（主機無法連線時每台最多等 OLLAMA_HEALTH_TIMEOUT_S 秒）
+MODEL_STATUS_TTL_S = float(os.getenv("MODEL_STATUS_TTL_S", "10"))
+_ps_lock = threading.Lock()
+_ps_cache = None  # (查詢時間, 已載入的模型或例外)
+
+
+def _running_models(refresh=False):
+    """已載入的模型（快取 MODEL_STATUS_TTL_S 秒）；無法連線時拋出查詢時的例外"""
+    global _ps_cache
+    with _ps_lock:
+        if refresh or _ps_cache is None or time.monotonic() - _ps_cache[0] > MODEL_STATUS_TTL_S:
+            try:
+                result = get_ollama_pool().ps().get('models') or []
+            except Exception as e:
+                result = e
+            _ps_cache = (time.monotonic(), result)
+        result = _ps_cache[1]
+    if isinstance(result, Exception):
+        raise result
+    return result
+
+
+def model_status(model, refresh=False):
+    """
+    回傳模型狀態：
+    "resident"（已載入記憶體）、"loading"（預熱中）、"not_loaded"（未載入）、
+    "unreachable"（無法連線 Ollama）、"unconfigured"（未設定模型），以及說明文字。
+    refresh 為 True 時重新查詢，不使用快取的結果。
+    """
+    if not model:
+        return "unconfigured", "尚未設定模型，請在 .env 設定 LLM_MODEL"
+    try:
+        running = _running_models(refresh)
+    except Exception as e:
+        return "unreachable", f"無法連線 Ollama：{e}"
+
+    # 未指定 tag 的模型名稱在 Ollama 中以 :latest 顯示
+    names = {model, model if ":" in model else f"{model}:latest"}
+    for info in running:
+        if names & {info.get('model'), info.get('name')}:
+            return "resident", f"已載入，保留至 {info.get('expires_at')}"
+
+    state = _warm_up_state.get(model)
+    if state == "loading":
+        return "loading", "預熱中，正在載入模型..."
+    if state and state.startswith("failed"):
+        return "not_loaded", f"預熱失敗：{state[len('failed: '):]}"
+    return "not_loaded", "尚未載入，第一次總結需要等待模型載入"
+
+
+# ==== LLM 結果快取 ====
+def summary_cache_key(model, prompt_version, options, messages):
+    """以（模型、prompt 範本版本、options、內容雜湊）作為快取 key"""
+    options_hash = hashlib.sha256(json.dumps(options or {}, sort_keys=True).encode()).hexdigest()[:16]
+    content_hash = hashlib.sha256(json.dumps(messages, ensure_ascii=False).encode("utf-8")).hexdigest()
+    return f"chat:{model}:{prompt_version}:{options_hash}:{content_hash}"
+
+
+# ==== 生成上限與中止 ====
+# 每次請求最多生成 OUTPUT_TOKENS（LLM_OUTPUT_TOKENS）個 token（num_predict），與切段時保留的輸出預算一致；
+# LLM_DEADLINE_S 為每次請求的時間上限（秒，0 表示不限制），超過時中止並回傳已生成的部分。
+# 請求一律以串流方式送出，中止時關閉串流（HTTP 連線），Ollama 會立即停止生成、釋放給其他請求。
+# Ollama 評估 prompt 時不會送出任何內容，因此另有監看執行緒每 WATCH_INTERVAL_S 秒檢查取消與時間上限，
+# 必要時從外部關閉連線（ollama_pool.StreamAbort），不必等到第一個 token。
+LLM_DEADLINE_S = float(os.getenv("LLM_DEADLINE_S", "0"))
+WATCH_INTERVAL_S = 0.2
+
+
+def reclaimed_seconds(tokens, eval_s, num_predict):
+    """
+    估計中止生成省下的時間：以目前的生成速度，生成到 num_predict 上限還需要的秒數（上限估計）。
+    尚未生成任何 token 時無法估計，回傳 None。
+    """
+    if not tokens or eval_s <= 0:
+        return None
+    return max(num_predict - tokens, 0) * eval_s / tokens
+
+
+def _watch_stream(abort, finished, cancel, deadline, watched):
+    """監看執行緒：請求結束前被取消或超過時間上限時中止串流，並在 watched["stopped"] 記錄原因"""
+    while not finished.wait(WATCH_INTERVAL_S):
+        if deadline is not None and time.perf_counter() > deadline:
+            watched["stopped"] = "deadline"
+        elif cancel:
+            try:
+                cancel()
+                continue
+            except BaseException:
+                watched["stopped"] = "cancelled"
+        else:
+            continue
+        abort.abort()
+        return
+
+
+def cached_chat(model, messages, options=None, prompt_version="1", on_token=None, keep_alive=None,
+                metrics=None, stage="chat", cancel=None, deadline_s=LLM_DEADLINE_S, tier=None, status=None):
+    """
+    透過 Ollama 主機池（ollama_pool）呼叫 chat 並把回覆存入持久化快取；相同的模型、prompt 範本版本、options 與內容
+    再次請求時直接回傳快取結果。有 on_token 時每收到一段新內容就呼叫 on_token(新內容)，
+    快取命中時則一次送出完整結果。修改 prompt 範本時請調升 prompt_version。
+    options 未指定 num_predict 時以 OUTPUT_TOKENS 為上限。
+    cancel 為可呼叫物件，每收到一段內容、以及等待期間每 WATCH_INTERVAL_S 秒各呼叫一次，
+    拋出例外即中止請求（例如 Job.check_cancelled）；超過 deadline_s 秒時中止並回傳已生成的部分（不寫入快取）。
+    兩者在 Ollama 評估 prompt、尚未輸出任何內容時同樣有效。
+    status 為 dict 時，中止而回傳部分內容的請求在 status["stopped"] 記錄原因，呼叫端可據此不保存結果。
+    metrics 為 RunMetrics 時記錄這次請求的耗時與 Ollama 統計，stage / tier 為記錄時使用的階段與模型層名稱。
+    """
+    start = time.perf_counter()
+    options = {'num_predict': OUTPUT_TOKENS, **(options or {})}
+    cache = get_summary_cache()
+    key = summary_cache_key(model, prompt_version, options, messages)
+    content = cache.get(key)
+    if content is not None:
+        if on_token:
+            on_token(content)
+        if metrics:
+            wall_s = time.perf_counter() - start
+            metrics.record_llm(stage, model, None, wall_s, wall_s if on_token else None, cached=True, tier=tier)
+        return content
+
+    kwargs = {'model': model, 'messages': messages, 'options': options}
+    if keep_alive is not None:
+        kwargs['keep_alive'] = keep_alive
+
+    # 一律使用串流，才能在生成途中中止；只傳遞新增的內容，累積的全文在結束時才組合
+    if cancel:
+        cancel()
+    ttft_s = None
+    pieces = []
+    response = None
+    stopped = None
+    abort = StreamAbort()
+    finished = threading.Event()
+    watched = {}
+    if cancel or deadline_s:
+        deadline = start + deadline_s if deadline_s else None
+        threading.Thread(
+            target=_watch_stream, args=(abort, finished, cancel, deadline, watched), name="chat-watch", daemon=True
+        ).start()
+    stream = get_ollama_pool().chat(stream=True, abort=abort, **kwargs)
+    try:
+        for chunk in stream:
+            if 'message' in chunk:
+                if ttft_s is None and chunk['message']['content']:
+                    ttft_s = time.perf_counter() - start
+                pieces.append(chunk['message']['content'])
+                if on_token:
+                    on_token(chunk['message']['content'])
+            # 最後一個物件（done=True）帶有 token 數與耗時統計
+            response = chunk
+            if cancel:
+                cancel()
+            if deadline_s and not chunk.get('done') and time.perf_counter() - start > deadline_s:
+                stopped = "deadline"
+                break
+    except StreamAborted:
+        # 監看執行緒已中止請求：超過時間上限時回傳已生成的部分，取消時由 cancel() 拋出取消的例外
+        stopped = watched.get("stopped", "cancelled")
+        if stopped == "cancelled":
+            if cancel:
+                cancel()
+            raise
+    except Exception:
+        # 連線或伺服器錯誤，不算中止
+        raise
+    except BaseException:
+        # 取消（或 Streamlit rerun 中斷 script）
+        stopped = "cancelled"
+        raise
+    finally:
+        finished.set()
+        # 關閉串流即中斷 HTTP 連線，Ollama 停止這次生成
+        close = getattr(stream, "close", None)
+        if close:
+            close()
+        if metrics:
+            wall_s = time.perf_counter() - start
+            reclaimed_s = None
+            if stopped:
+                tokens = sum(1 for piece in pieces if piece)
+                reclaimed_s = reclaimed_seconds(tokens, wall_s - (ttft_s or wall_s), options['num_predict'])
+                response = None
+            metrics.record_llm(
+                stage, model, response, wall_s, ttft_s if on_token else None, stopped=stopped, reclaimed_s=reclaimed_s,
+                tier=tier,
+            )
+
+    content = "".join(pieces)
+    if stopped is None:
+        cache.set(key, content)
+    elif status is not None:
+        status["stopped"] = stopped
+    return content
@@ -0,0 +1,343 @@
+import os
+import socket
+import threading
+import time
+
+import httpx
+import ollama
+
+# ==== Ollama 主機池 ====
+# 所有 Ollama 請求（chat / generate / show / embed / ps）都經過同一個 OllamaPool，而不是模組層級的 ollama.*：
+#   - OLLAMA_HOSTS 列出多台 Ollama 主機（逗號分隔），每台主機一個 ollama.Client，
+#     底層的 httpx 連線池在所有執行緒之間共用，不必每次請求重新建立連線
+#   - 每台主機同時進行的請求數上限為 OLLAMA_HOST_CONCURRENCY，可在主機後加上 =N 個別指定，例如
+#     OLLAMA_HOSTS=http://gpu1:11434=4,http://gpu2:11434=2；所有主機都滿載時請求在這裡等待
+#   - 新請求送往進行中請求數最少的主機（least outstanding requests），相同時選處理過較少請求的主機
+#   - 連線失敗或伺服器錯誤（5xx）的主機暫停使用 OLLAMA_HOST_COOLDOWN_S 秒，請求改送其他主機；
+#     串流已開始輸出時無法改送，直接拋出錯誤
+#   - 背景執行緒每 OLLAMA_HEALTH_INTERVAL_S 秒以 /api/ps 檢查各主機，恢復的主機重新加入
+#   - 超過 OLLAMA_READ_TIMEOUT_S 秒沒有收到任何資料的主機視為停滯，與連線失敗相同處理
+#   - 串流請求可帶入 StreamAbort，由其他執行緒中止（取消、時間上限）；Ollama 評估 prompt 時不會送出任何內容，
+#     讀取會一直阻塞，因此串流請求各自使用新的連線，中止時直接關閉這條連線的 socket
+# 未設定 OLLAMA_HOSTS 時使用 OLLAMA_HOST（與 ollama 套件預設相同），只有一台主機時行為與直接呼叫相同。
+# 可用 benchmarks/fake_ollama.py 啟動模擬 /api/chat 串流的本機伺服器，以 benchmarks/bench_ollama_pool.py 驗證。
+
+DEFAULT_HOST = "http://127.0.0.1:11434"
+OLLAMA_HOST_CONCURRENCY = int(os.getenv("OLLAMA_HOST_CONCURRENCY", "4"))
+OLLAMA_HOST_COOLDOWN_S = float(os.getenv("OLLAMA_HOST_COOLDOWN_S", "30"))
+OLLAMA_HEALTH_INTERVAL_S = float(os.getenv("OLLAMA_HEALTH_INTERVAL_S", "10"))
+OLLAMA_HEALTH_TIMEOUT_S = float(os.getenv("OLLAMA_HEALTH_TIMEOUT_S", "3"))
+OLLAMA_CONNECT_TIMEOUT_S = float(os.getenv("OLLAMA_CONNECT_TIMEOUT_S", "10"))
+# 0 表示不限制（長 prompt 在慢的主機上評估很久時可調高）
+OLLAMA_READ_TIMEOUT_S = float(os.getenv("OLLAMA_READ_TIMEOUT_S", "300"))
+
+# 視為主機故障、可以改送其他主機的錯誤（ollama 套件在非串流請求時把 httpx.ConnectError 轉成 ConnectionError）
+HOST_ERRORS = (ConnectionError, httpx.TransportError)
+
+
+class NoHostAvailable(ConnectionError):
+    """所有 Ollama 主機都無法使用"""
+
+
+class StreamAborted(Exception):
+    """串流請求被 StreamAbort.abort() 中止（不是主機故障，不改送其他主機）"""
+
+
+# 目前執行緒正在送出的串流請求所使用的 StreamAbort，由 httpx 的 request hook 取用
+_local = threading.local()
+
+
+class StreamAbort:
+    """
+    從其他執行緒中止串流請求：abort() 關閉（shutdown）請求所使用的 socket，
+    阻塞中的讀取立即結束，Ollama 偵測到連線中斷後停止評估 prompt 或生成。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._socket = None
+        self.aborted = False
+
+    def abort(self):
+        with self._lock:
+            self.aborted = True
+            self._shutdown()
+
+    def trace(self, event, info):
+        """httpcore 的 trace 回呼：建立連線後記錄 socket；已中止時立即關閉"""
+        if event == "connection.connect_tcp.complete":
+            with self._lock:
+                self._socket = info["return_value"].get_extra_info("socket")
+                if self.aborted:
+                    self._shutdown()
+
+    def _shutdown(self):
+        # 呼叫端需持有 self._lock
+        if self._socket is not None:
+            try:
+                self._socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+def _attach_abort(request):
+    """httpx request hook：把目前執行緒的 StreamAbort 掛到這個請求上"""
+    abort = getattr(_local, "abort", None)
+    if abort is not None:
+        request.extensions["trace"] = abort.trace
+
+
+def _timeout(read_s):
+    return httpx.Timeout(OLLAMA_CONNECT_TIMEOUT_S, read=read_s or None, write=read_s or None, pool=None)
+
+
+def parse_hosts(value, default_limit=OLLAMA_HOST_CONCURRENCY):
+    """解析「host[=上限],host[=上限]」，回傳 [(host, 上限)]"""
+    hosts = []
+    for item in value.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        host, sep, limit = item.rpartition("=")
+        if sep and limit.strip().isdigit():
+            hosts.append((host.strip(), int(limit)))
+        else:
+            hosts.append((item, default_limit))
+    return hosts
+
+
+def is_host_error(error):
+    """是否為主機層級的錯誤（連線失敗、逾時、5xx），而不是請求本身的錯誤（如模型不存在）"""
+    if isinstance(error, HOST_ERRORS):
+        return True
+    return isinstance(error, ollama.ResponseError) and error.status_code >= 500
+
+
+class Backend:
+    """單一 Ollama 主機與它的狀態；計數由 OllamaPool 在持有鎖時更新"""
+
+    def __init__(self, host, limit):
+        self.host = host
+        self.limit = limit
+        self.client = ollama.Client(host=host, timeout=_timeout(OLLAMA_READ_TIMEOUT_S))
+        # 串流請求不重用連線：每個請求都會建立自己的連線，StreamAbort 才能取得並關閉它的 socket
+        self.stream_client = ollama.Client(
+            host=host,
+            timeout=_timeout(OLLAMA_READ_TIMEOUT_S),
+            limits=httpx.Limits(max_keepalive_connections=0),
+            event_hooks={"request": [_attach_abort]},
+        )
+        self.health_client = ollama.Client(host=host, timeout=OLLAMA_HEALTH_TIMEOUT_S)
+        self.inflight = 0
+        self.served = 0
+        self.failures = 0
+        self.down_until = 0.0
+        self.last_error = None
+
+    @property
+    def healthy(self):
+        return time.monotonic() >= self.down_until
+
+
+class OllamaPool:
+    """多台 Ollama 主機的共用 client，介面與 ollama 模組相同（chat / generate / show / embed / ps）"""
+
+    def __init__(self, hosts, cooldown_s=OLLAMA_HOST_COOLDOWN_S, health_interval_s=OLLAMA_HEALTH_INTERVAL_S):
+        if not hosts:
+            raise ValueError("至少需要一台 Ollama 主機")
+        self.backends = [Backend(host, limit) for host, limit in hosts]
+        self.cooldown_s = cooldown_s
+        self._cond = threading.Condition()
+        if health_interval_s and len(self.backends) > 1:
+            threading.Thread(
+                target=self._health_loop, args=(health_interval_s,), name="ollama-health", daemon=True
+            ).start()
+
+    # ---- 主機選擇 ----
+    def acquire(self, exclude=(), abort=None):
+        """
+        取得一台主機的請求名額：在健康且未滿載的主機中選進行中請求最少的一台，全部滿載時等待。
+        健康的主機都已排除時，嘗試冷卻中的主機；沒有任何主機可用時拋出 NoHostAvailable。
+        等待中 abort 被中止時拋出 StreamAborted。
+        """
+        with self._cond:
+            while True:
+                if abort is not None and abort.aborted:
+                    raise StreamAborted("請求已中止")
+                candidates = [b for b in self.backends if b not in exclude]
+                if not candidates:
+                    raise NoHostAvailable("所有 Ollama 主機都無法連線")
+                healthy = [b for b in candidates if b.healthy] or candidates
+                free = [b for b in healthy if b.inflight < b.limit]
+                if free:
+                    backend = min(free, key=lambda b: (b.inflight, b.served))
+                    backend.inflight += 1
+                    backend.served += 1
+                    return backend
+                self._cond.wait(0.1 if abort is not None else None)
+
+    def release(self, backend, error=None):
+        """歸還名額；error 為主機層級的錯誤時暫停使用這台主機"""
+        with self._cond:
+            backend.inflight -= 1
+            if error is not None and is_host_error(error):
+                self._mark_down(backend, error)
+            self._cond.notify_all()
+
+    def _mark_down(self, backend, error):
+        # 呼叫端需持有 self._cond
+        backend.failures += 1
+        backend.last_error = str(error)
+        backend.down_until = time.monotonic() + self.cooldown_s
+
+    def _health_loop(self, interval_s):
+        while True:
+            time.sleep(interval_s)
+            for backend in self.backends:
+                try:
+                    backend.health_client.ps()
+                    error = None
+                except Exception as e:
+                    error = e
+                with self._cond:
+                    if error is None:
+                        if not backend.healthy:
+                            backend.down_until = 0.0
+                            self._cond.notify_all()
+                    elif is_host_error(error):
+                        self._mark_down(backend, error)
+
+    # ---- 請求 ----
+    def call(self, method, **kwargs):
+        """以 ollama.Client 的 method 送出非串流請求；主機故障時改送其他主機"""
+        tried = []
+        while True:
+            backend = self.acquire(tried)
+            error = None
+            try:
+                return getattr(backend.client, method)(**kwargs)
+            except Exception as e:
+                error = e
+                if not is_host_error(e) or len(tried) + 1 >= len(self.backends):
+                    raise
+            finally:
+                self.release(backend, error)
+            tried.append(backend)
+
+    def _stream(self, method, kwargs, abort=None):
+        """
+        串流請求：名額在串流結束或被關閉時才歸還；還沒收到任何內容前主機故障時改送其他主機。
+        abort 為 StreamAbort 時可由其他執行緒中止（包含還在評估 prompt、尚未收到任何內容時），中止後拋出 StreamAborted。
+        """
+        tried = []
+        while True:
+            backend = self.acquire(tried, abort)
+            error = None
+            started = False
+            stream = None
+            try:
+                client = backend.client if abort is None else backend.stream_client
+                stream = getattr(client, method)(**kwargs)
+                # 請求在第一次讀取時才送出，request hook 在這個執行緒取用 _local.abort
+                _local.abort = abort
+                try:
+                    for chunk in stream:
+                        _local.abort = None
+                        started = True
+                        yield chunk
+                finally:
+                    _local.abort = None
+                return
+            except Exception as e:
+                if abort is not None and abort.aborted:
+                    # 中止造成的連線中斷，不是主機故障
+                    raise StreamAborted("請求已中止") from e
+                error = e
+                if started or not is_host_error(e) or len(tried) + 1 >= len(self.backends):
+                    raise
+            finally:
+                # 關閉串流即中斷 HTTP 連線，Ollama 停止這次生成
+                close = getattr(stream, "close", None)
+                if close:
+                    close()
+                self.release(backend, error)
+            tried.append(backend)
+
+    def chat(self, stream=False, abort=None, **kwargs):
+        if stream:
+            return self._stream("chat", {**kwargs, "stream": True}, abort)
+        return self.call("chat", **kwargs)
+
+    def generate(self, stream=False, abort=None, **kwargs):
+        if stream:
+            return self._stream("generate", {**kwargs, "stream": True}, abort)
+        return self.call("generate", **kwargs)
+
+    def show(self, model):
+        return self.call("show", model=model)
+
+    def embed(self, **kwargs):
+        return self.call("embed", **kwargs)
+
+    def ps(self):
+        """
+        合併所有可連線主機上已載入的模型；全部無法連線時拋出最後一個錯誤。
+        冷卻中的主機不查詢（全部都在冷卻時才逐一嘗試），無法連線的主機暫停使用，不必每次等待逾時。
+        """
+        models = []
+        error = None
+        reachable = False
+        with self._cond:
+            backends = [b for b in self.backends if b.healthy] or list(self.backends)
+        for backend in backends:
+            try:
+                models.extend(backend.health_client.ps().get("models") or [])
+                reachable = True
+            except Exception as e:
+                error = e
+                if is_host_error(e):
+                    with self._cond:
+                        self._mark_down(backend, e)
+        if not reachable:
+            raise error
+        return {"models": models}
+
+    def broadcast(self, method, **kwargs):
+        """對每台健康的主機各送一次請求（例如預熱模型），回傳 {host: 結果或例外}"""
+        results = {}
+        for backend in self.backends:
+            if not backend.healthy:
+                continue
+            try:
+                results[backend.host] = getattr(backend.client, method)(**kwargs)
+            except Exception as e:
+                results[backend.host] = e
+                if is_host_error(e):
+                    with self._cond:
+                        self._mark_down(backend, e)
+        return results
+
+    def stats(self):
+        """各主機目前的狀態"""
+        with self._cond:
+            return [
+                {
+                    "host": b.host, "healthy": b.healthy, "inflight": b.inflight, "limit": b.limit,
+                    "served": b.served, "failures": b.failures, "last_error": b.last_error,
+                }
+                for b in self.backends
+            ]
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_ollama_pool():
+    """取得 process 內共用的 Ollama 主機池；第一次使用時才讀取 OLLAMA_HOSTS（各程式在 import 之後才 load_dotenv）"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            hosts = parse_hosts(os.getenv("OLLAMA_HOSTS") or os.getenv("OLLAMA_HOST") or DEFAULT_HOST)
+            _pool = OllamaPool(hosts)
+    return _pool
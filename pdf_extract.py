@@ -0,0 +1,463 @@
+import hashlib
+import io
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+from disk_cache import cached_iter, get_extract_cache
+
+# ==== PDF 擷取（文字 / 圖片 OCR） ====
+# 各 Streamlit 程式共用的 PDF 擷取邏輯，逐頁產生結果，並依檔案內容快取在磁碟上。
+# 擷取邏輯或輸出格式改變時，請調升對應的版本號。
+
+PDF_OCR_VERSION = "3"
+# 單張圖片 OCR 結果的快取版本，與全文輸出格式無關
+OCR_IMAGE_VERSION = "1"
+OCR_LANG = 'chi_tra+eng'
+# 重複圖片的處理方式："suppress" 只保留第一次出現的辨識結果，"reuse" 每次出現都附上
+OCR_DEDUPE = os.getenv("OCR_DEDUPE", "suppress")
+# 平行 OCR 的 process 數量，設為 1 則在目前的程序中依序辨識
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", str(os.cpu_count() or 1)))
+# OCR 子程序的啟動方式。Streamlit process 中同時有伺服器、工作佇列與健康檢查等執行緒，
+# fork 只複製呼叫的執行緒，其他執行緒持有的鎖在子程序中永遠不會釋放，因此預設使用 spawn（也可設為 forkserver）
+OCR_START_METHOD = os.getenv("OCR_START_METHOD", "spawn")
+# 每批送往 OCR process pool 的圖片總大小上限
+OCR_BATCH_BYTES = int(os.getenv("OCR_BATCH_MB", "128")) * 1024 * 1024
+# 每批最多累積的頁數，批次越小，第一批結果越快出現
+OCR_BATCH_PAGES = int(os.getenv("OCR_BATCH_PAGES", "16"))
+
+# ==== OCR 規劃 ====
+# OCR_PLANNER 為 "auto" 時依頁面內容決定是否 OCR（見 plan_page_ocr），"all" 則辨識每一張圖片。
+OCR_PLANNER = os.getenv("OCR_PLANNER", "auto")
+# 文字層至少有這麼多字才視為可用
+OCR_MIN_TEXT_CHARS = int(os.getenv("OCR_MIN_TEXT_CHARS", "50"))
+# 小於這個像素數（寬 x 高）或在頁面上佔不到 OCR_MIN_IMAGE_COVERAGE 的圖片視為圖示，不辨識
+OCR_MIN_IMAGE_PIXELS = int(os.getenv("OCR_MIN_IMAGE_PIXELS", str(100 * 100)))
+OCR_MIN_IMAGE_COVERAGE = float(os.getenv("OCR_MIN_IMAGE_COVERAGE", "0.01"))
+# 有文字層的頁面，大圖合計覆蓋超過這個比例才辨識圖片（混合頁）
+OCR_MIXED_COVERAGE = float(os.getenv("OCR_MIXED_COVERAGE", "0.1"))
+# 沒有文字層的頁面，圖片覆蓋超過這個比例視為掃描頁，整頁渲染後辨識
+OCR_SCANNED_COVERAGE = float(os.getenv("OCR_SCANNED_COVERAGE", "0.5"))
+# 沒有文字層也沒有大圖的頁面，向量繪製的元素（線段、曲線、矩形）至少這麼多個才視為以外框繪製的文字，
+# 整頁渲染後辨識；頁首橫線、表格框線只有少數幾個元素，這類標題頁、分隔頁不做 OCR
+OCR_MIN_VECTOR_ITEMS = int(os.getenv("OCR_MIN_VECTOR_ITEMS", "200"))
+# 掃描頁渲染的解析度
+OCR_DPI = int(os.getenv("OCR_DPI", "200"))
+# OCR 結果中代表「整頁渲染」的圖片序號
+PAGE_IMAGE = 0
+
+# ==== OCR 前的圖片正規化 ====
+# Tesseract 的耗時與像素數成正比，送出前先轉灰階（CMYK、透明背景、調色盤都統一處理）並縮小解析度。
+# 內嵌圖片依它在頁面上的顯示大小換算實際 DPI，超過 OCR_TARGET_DPI 時縮小到該 DPI
+# （10pt 文字在 300 DPI 約 40 像素高，已足夠辨識）；無法換算時以 OCR_MAX_PIXELS 為上限。
+# OCR_BINARIZE 為 "otsu" 時再以 Otsu 門檻二值化。
+# 各設定的速度與準確度可用 benchmarks/bench_ocr_preprocess.py 比較。
+OCR_TARGET_DPI = int(os.getenv("OCR_TARGET_DPI", "300"))
+OCR_MAX_PIXELS = int(os.getenv("OCR_MAX_PIXELS", str(12 * 1000 * 1000)))
+OCR_BINARIZE = os.getenv("OCR_BINARIZE", "off")
+
+# ==== 文件生命週期 ====
+# 上傳檔案落地後（見 spool.py）以路徑開啟，PyMuPDF 依需要從檔案讀取頁面，不會把整份檔案複製到記憶體；
+# 文件在擷取結束（或下游提前停止讀取）時明確關閉。
+# MuPDF 會快取解碼過的圖片與字型，每處理 PDF_STORE_SHRINK_PAGES 頁清空一次，
+# 大型掃描手冊的記憶體用量不會隨頁數增加。
+PDF_STORE_SHRINK_PAGES = int(os.getenv("PDF_STORE_SHRINK_PAGES", "16"))
+
+
+@contextmanager
+def open_pdf(data):
+    """開啟 PDF（SpooledFile 以路徑開啟，bytes 以 stream 開啟），離開 with 區塊時關閉"""
+    import fitz  # PyMuPDF
+
+    path = getattr(data, "path", None)
+    pdf_document = fitz.open(path) if path else fitz.open(stream=data, filetype="pdf")
+    try:
+        yield pdf_document
+    finally:
+        pdf_document.close()
+
+
+def parse_page_range(text):
+    """
+    解析頁碼範圍（1 起算），例如「1-20, 35, 40-」回傳 [(1, 20), (35, 35), (40, None)]，
+    None 表示到最後一頁；空白表示全部頁面，回傳 None。格式錯誤時拋出 ValueError。
+    """
+    ranges = []
+    for part in (text or "").replace("，", ",").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        start, sep, end = (value.strip() for value in part.partition("-"))
+        try:
+            start = int(start) if start else 1
+            end = (int(end) if end else None) if sep else start
+        except ValueError:
+            raise ValueError(f"無法解析頁碼範圍「{part}」") from None
+        if start < 1 or (end is not None and end < start):
+            raise ValueError(f"頁碼範圍「{part}」不正確")
+        ranges.append((start, end))
+    return ranges or None
+
+
+def page_range_key(pages):
+    """頁碼範圍的快取 key 片段"""
+    if not pages:
+        return "all"
+    return ",".join(f"{start}-{end or ''}" for start, end in pages)
+
+
+def iter_pdf_pages(pdf_document, pages=None):
+    """依序載入 pages 範圍內的頁面，產生 (頁面索引, page)；定期清空 MuPDF 的解碼快取"""
+    import fitz  # PyMuPDF
+
+    page_count = len(pdf_document)
+    if pages:
+        page_nums = sorted({
+            page_num for start, end in pages for page_num in range(start - 1, min(end or page_count, page_count))
+        })
+    else:
+        page_nums = range(page_count)
+    for count, page_num in enumerate(page_nums, 1):
+        yield page_num, pdf_document.load_page(page_num)
+        if PDF_STORE_SHRINK_PAGES and count % PDF_STORE_SHRINK_PAGES == 0:
+            fitz.TOOLS.store_shrink(100)
+
+
+def extract_pdf_text_pages(data, pages=None):
+    """逐頁提取 PDF 文字，依序產生 {"page": 頁碼, "text": 文字}；pages 為頁碼範圍（見 parse_page_range）"""
+    with open_pdf(data) as pdf_document:
+        for page_num, page in iter_pdf_pages(pdf_document, pages):
+            yield {"page": page_num + 1, "text": page.get_text()}
+
+
+def image_pixel_hash(pil_image):
+    """以解碼後的像素計算雜湊，重新編碼過的同一張圖片也會得到相同結果"""
+    digest = hashlib.sha256(f"{pil_image.mode}:{pil_image.size}".encode())
+    digest.update(pil_image.tobytes())
+    return digest.hexdigest()
+
+
+def otsu_threshold(histogram):
+    """由灰階直方圖計算 Otsu 門檻"""
+    total = sum(histogram)
+    weighted_sum = sum(i * count for i, count in enumerate(histogram))
+    background = background_sum = 0
+    best_threshold, best_variance = 127, -1.0
+    for i, count in enumerate(histogram):
+        background += count
+        if background == 0:
+            continue
+        foreground = total - background
+        if foreground == 0:
+            break
+        background_sum += i * count
+        mean_background = background_sum / background
+        mean_foreground = (weighted_sum - background_sum) / foreground
+        variance = background * foreground * (mean_background - mean_foreground) ** 2
+        if variance > best_variance:
+            best_threshold, best_variance = i, variance
+    return best_threshold
+
+
+def normalize_ocr_image(pil_image, scale=1.0, max_pixels=None, binarize=None):
+    """
+    OCR 前的正規化：轉灰階（透明背景先疊在白底上）、依 scale 縮小（不放大），
+    縮小後仍超過 max_pixels 時再縮小，binarize 為 "otsu" 時二值化。
+    max_pixels / binarize 未指定時使用 OCR_MAX_PIXELS / OCR_BINARIZE。
+    """
+    from PIL import Image
+
+    max_pixels = OCR_MAX_PIXELS if max_pixels is None else max_pixels
+    binarize = OCR_BINARIZE if binarize is None else binarize
+
+    if pil_image.mode in ("RGBA", "LA", "PA") or (pil_image.mode == "P" and "transparency" in pil_image.info):
+        rgba = pil_image.convert("RGBA")
+        pil_image = Image.alpha_composite(Image.new("RGBA", rgba.size, "white"), rgba)
+    gray = pil_image.convert("L")
+
+    width, height = gray.size
+    scale = min(scale, 1.0)
+    if max_pixels and width * height * scale * scale > max_pixels:
+        scale = (max_pixels / (width * height)) ** 0.5
+    if scale < 1.0:
+        gray = gray.resize((max(1, round(width * scale)), max(1, round(height * scale))), Image.LANCZOS)
+
+    if binarize == "otsu":
+        threshold = otsu_threshold(gray.histogram())
+        gray = gray.point([255 if value > threshold else 0 for value in range(256)])
+    return gray
+
+
+def normalize_settings():
+    """會影響 OCR 結果的正規化參數，作為 OCR 結果快取 key 的一部分"""
+    return f"{OCR_TARGET_DPI}-{OCR_MAX_PIXELS}-{OCR_BINARIZE}"
+
+
+def ocr_cache_key(pixel_hash):
+    return f"ocr-image:{OCR_IMAGE_VERSION}:{OCR_LANG}:{normalize_settings()}:{pixel_hash}"
+
+
+def ocr_scale(width, display_rects):
+    """依圖片在頁面上的顯示寬度（點，1/72 英吋）換算實際 DPI，回傳縮小到 OCR_TARGET_DPI 的比例"""
+    display_width = max((rect.width for rect in display_rects), default=0)
+    if not display_width or not OCR_TARGET_DPI:
+        return 1.0
+    effective_dpi = width * 72 / display_width
+    return min(1.0, OCR_TARGET_DPI / effective_dpi)
+
+
+def ocr_image_bytes(image_bytes, lang, tesseract_cmd=None, scale=1.0):
+    """正規化後對單張圖片進行 OCR；定義在模組層級，才能交給 process pool 執行"""
+    import pytesseract
+    from PIL import Image
+
+    # 子程序不會繼承主程式對 tesseract_cmd 的設定，需要重新指定
+    if tesseract_cmd:
+        pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
+    pil_image = normalize_ocr_image(Image.open(io.BytesIO(image_bytes)), scale)
+    return pytesseract.image_to_string(pil_image, lang=lang)
+
+
+_ocr_pool = None
+
+
+def get_ocr_pool():
+    """取得共用的 OCR process pool（每個 process 建立一次，避免重複啟動子程序）"""
+    global _ocr_pool
+    if _ocr_pool is None:
+        _ocr_pool = ProcessPoolExecutor(
+            max_workers=OCR_WORKERS, mp_context=multiprocessing.get_context(OCR_START_METHOD)
+        )
+    return _ocr_pool
+
+
+def run_ocr_jobs(jobs):
+    """
+    執行 OCR 工作，jobs 為 {像素雜湊: (圖片 bytes, 縮小比例)}，回傳 {像素雜湊: OCR 文字}。
+    OCR_WORKERS 大於 1 時交給 process pool 平行處理，否則在目前的程序中依序執行。
+    """
+    import pytesseract
+
+    tesseract_cmd = pytesseract.pytesseract.tesseract_cmd
+    keys = list(jobs)
+    if OCR_WORKERS > 1 and len(keys) > 1:
+        texts = get_ocr_pool().map(
+            ocr_image_bytes,
+            [jobs[key][0] for key in keys],
+            [OCR_LANG] * len(keys),
+            [tesseract_cmd] * len(keys),
+            [jobs[key][1] for key in keys],
+        )
+    else:
+        texts = (ocr_image_bytes(jobs[key][0], OCR_LANG, scale=jobs[key][1]) for key in keys)
+    return dict(zip(keys, texts))
+
+
+def plan_settings():
+    """會影響 OCR 輸出的規劃參數，作為快取版本的一部分"""
+    if OCR_PLANNER != "auto":
+        return OCR_PLANNER
+    return (
+        f"auto-{OCR_MIN_TEXT_CHARS}-{OCR_MIN_IMAGE_PIXELS}-{OCR_MIN_IMAGE_COVERAGE}"
+        f"-{OCR_MIXED_COVERAGE}-{OCR_SCANNED_COVERAGE}-{OCR_MIN_VECTOR_ITEMS}-{OCR_DPI}"
+    )
+
+
+def plan_page_ocr(page, text):
+    """
+    依頁面的文字層與圖片判斷是否需要 OCR，回傳
+    {"kind": 頁面分類, "reason": 說明, "render": 是否整頁渲染後辨識,
+     "images": [(圖片序號, xref, 縮小比例), ...] 要辨識的圖片, "skipped_images": 略過的小圖數}
+
+    頁面分類：
+      "text"    文字層完整，圖片只是圖示或裝飾，不需要 OCR
+      "mixed"   有文字層也有大圖（如系統畫面截圖），只辨識大圖
+      "scanned" 沒有可用的文字層，內容是整頁圖片或大量向量繪製（以外框繪製的文字），整頁渲染後辨識
+      "blank"   空白頁
+    只讀取圖片的尺寸與位置，不會解碼圖片。
+    """
+    text_chars = len(text.strip())
+    page_area = abs(page.rect)
+    images = []
+    skipped = 0
+    coverage = 0.0
+    for img_index, img in enumerate(page.get_images(full=True)):
+        xref, width, height = img[0], img[2], img[3]
+        rects = page.get_image_rects(xref)
+        if OCR_PLANNER != "auto":
+            images.append((img_index, xref, ocr_scale(width, rects)))
+            continue
+        shown = sum(abs(rect & page.rect) for rect in rects)
+        shown = shown / page_area if page_area else 0.0
+        if width * height < OCR_MIN_IMAGE_PIXELS or shown < OCR_MIN_IMAGE_COVERAGE:
+            skipped += 1
+            continue
+        coverage += shown
+        images.append((img_index, xref, ocr_scale(width, rects)))
+    coverage = min(coverage, 1.0)
+
+    def plan(kind, reason, render=False, images=()):
+        return {"kind": kind, "reason": reason, "render": render, "images": list(images), "skipped_images": skipped}
+
+    if OCR_PLANNER != "auto":
+        return plan("mixed" if images else "text", "OCR_PLANNER=all：辨識所有圖片", images=images)
+
+    skipped_note = f"，略過 {skipped} 張小圖" if skipped else ""
+    if text_chars >= OCR_MIN_TEXT_CHARS:
+        if images and coverage >= OCR_MIXED_COVERAGE:
+            return plan(
+                "mixed", f"文字層 {text_chars} 字，{len(images)} 張大圖覆蓋 {coverage:.0%} 頁面{skipped_note}",
+                images=images,
+            )
+        return plan("text", f"文字層完整（{text_chars} 字），圖片覆蓋 {coverage:.0%} 頁面，不需 OCR{skipped_note}")
+
+    if coverage >= OCR_SCANNED_COVERAGE:
+        return plan("scanned", f"文字層只有 {text_chars} 字，圖片覆蓋 {coverage:.0%} 頁面，以 {OCR_DPI} DPI 整頁辨識", render=True)
+    if images:
+        return plan("mixed", f"文字層只有 {text_chars} 字，辨識 {len(images)} 張圖片{skipped_note}", images=images)
+    vector_items = sum(len(path["items"]) for path in page.get_drawings())
+    if vector_items >= OCR_MIN_VECTOR_ITEMS:
+        return plan(
+            "scanned", f"文字層只有 {text_chars} 字，內容為向量繪製（{vector_items} 個繪圖元素），以 {OCR_DPI} DPI 整頁辨識",
+            render=True,
+        )
+    if text_chars == 0 and not skipped:
+        return plan("blank", "空白頁")
+    return plan("text", f"文字層只有 {text_chars} 字，沒有需要辨識的圖片{skipped_note}")
+
+
+def pixmap_hash(pixmap):
+    """以渲染結果的像素計算雜湊"""
+    digest = hashlib.sha256(f"pixmap:{pixmap.n}:{pixmap.width}x{pixmap.height}".encode())
+    digest.update(pixmap.samples)
+    return digest.hexdigest()
+
+
+def extract_pdf_ocr_pages(data, metrics=None, pages=None):
+    """
+    逐頁提取 PDF 文字與圖片 OCR 結果，依序產生
+    {"page": 頁碼, "text": 文字, "ocr": [[圖片序號, OCR 文字], ...],
+     "ocr_calls": 實際 OCR 次數, "ocr_avoided": 省下的 OCR 次數, "ocr_skipped": 略過的小圖數,
+     "kind": 頁面分類, "reason": 是否 OCR 的原因}
+
+    每頁先由 plan_page_ocr 判斷：文字層完整的頁面不做 OCR，混合頁只辨識大圖，
+    掃描頁（或向量繪製的文字）以 OCR_DPI 整頁渲染後辨識，結果的圖片序號為 PAGE_IMAGE。
+
+    每張圖片先以 xref、再以像素雜湊去重：同一文件內重複的圖片（如每頁的 logo、頁首橫幅）
+    只 OCR 一次，跨文件則透過磁碟快取重用 OCR 結果。
+    OCR_DEDUPE 為 "suppress" 時，重複圖片的辨識結果只在第一次出現時輸出。
+
+    頁面文字與待辨識的圖片 bytes 在主程序提取，每累積一批（OCR_BATCH_PAGES 頁或
+    OCR_BATCH_MB 的圖片）就交給 OCR process pool，再依頁碼與圖片順序產生該批頁面，
+    輸出與逐張辨識相同，下游不需要等整份文件處理完。
+    metrics 為 RunMetrics 時把 Tesseract 辨識耗時計入 "ocr"；pages 為頁碼範圍時只處理這些頁面。
+    """
+    from PIL import Image
+
+    ocr_cache = get_extract_cache()
+    xref_hashes = {}    # xref -> 像素雜湊
+    hash_texts = {}     # 像素雜湊 -> OCR 文字（已知的結果）
+    ocr_jobs = {}       # 像素雜湊 -> (待 OCR 的圖片 bytes, 縮小比例)
+    ocr_job_bytes = 0
+    pending_pages = []  # 等待 OCR 結果的頁面
+    emitted = set()     # 本文件已輸出過的像素雜湊
+
+    def flush_pending_pages():
+        """進行 OCR（指定繁體中文和英文語言）、寫入跨文件快取，並依序產生等待中的頁面"""
+        nonlocal ocr_job_bytes
+        if metrics and ocr_jobs:
+            with metrics.span("ocr"):
+                ocr_texts = run_ocr_jobs(ocr_jobs)
+        else:
+            ocr_texts = run_ocr_jobs(ocr_jobs)
+        for pixel_hash, ocr_text in ocr_texts.items():
+            ocr_cache.set(ocr_cache_key(pixel_hash), ocr_text)
+            hash_texts[pixel_hash] = ocr_text
+        ocr_jobs.clear()
+        ocr_job_bytes = 0
+
+        for page in pending_pages:
+            ocr_results = []
+            for img_no, pixel_hash in page.pop("images"):
+                if OCR_DEDUPE == "suppress" and pixel_hash in emitted:
+                    continue
+                emitted.add(pixel_hash)
+                ocr_text = hash_texts[pixel_hash]
+                if ocr_text.strip():
+                    ocr_results.append([img_no, ocr_text])
+            page["ocr"] = ocr_results
+            yield page
+        pending_pages.clear()
+
+    def queue_ocr(pixel_hash, image_bytes, scale=1.0):
+        """排入 OCR 工作；已有結果（本文件或跨文件快取）時不需辨識，回傳是否實際排入"""
+        nonlocal ocr_job_bytes
+        if pixel_hash in hash_texts or pixel_hash in ocr_jobs:
+            return False
+        cached_text = ocr_cache.get(ocr_cache_key(pixel_hash))
+        if cached_text is not None:
+            hash_texts[pixel_hash] = cached_text
+            return False
+        ocr_jobs[pixel_hash] = (image_bytes, scale)
+        ocr_job_bytes += len(image_bytes)
+        return True
+
+    with open_pdf(data) as pdf_document:
+        for page_num, page in iter_pdf_pages(pdf_document, pages):
+            text = page.get_text()
+            plan = plan_page_ocr(page, text)
+
+            # 收集頁面上每張要辨識的圖片對應的像素雜湊，未辨識過的圖片排入 OCR 工作
+            page_images = []
+            ocr_calls = 0
+            ocr_avoided = 0
+            if plan["render"]:
+                pixmap = page.get_pixmap(dpi=OCR_DPI)
+                pixel_hash = pixmap_hash(pixmap)
+                if queue_ocr(pixel_hash, pixmap.tobytes("png")):
+                    ocr_calls += 1
+                else:
+                    ocr_avoided += 1
+                page_images.append((PAGE_IMAGE, pixel_hash))
+            for img_index, xref, scale in plan["images"]:
+                pixel_hash = xref_hashes.get(xref)
+                if pixel_hash is None:
+                    image_bytes = pdf_document.extract_image(xref)["image"]
+
+                    # 將圖片資料轉換為 PIL Image
+                    pil_image = Image.open(io.BytesIO(image_bytes))
+                    pixel_hash = image_pixel_hash(pil_image)
+                    xref_hashes[xref] = pixel_hash
+                    if queue_ocr(pixel_hash, image_bytes, scale):
+                        ocr_calls += 1
+                    else:
+                        ocr_avoided += 1
+                else:
+                    ocr_avoided += 1
+                page_images.append((img_index + 1, pixel_hash))
+
+            pending_pages.append({
+                "page": page_num + 1,
+                "text": text,
+                "images": page_images,
+                "ocr_calls": ocr_calls,
+                "ocr_avoided": ocr_avoided,
+                "ocr_skipped": plan["skipped_images"],
+                "kind": plan["kind"],
+                "reason": plan["reason"],
+            })
+
+            if not ocr_jobs or len(pending_pages) >= OCR_BATCH_PAGES or ocr_job_bytes > OCR_BATCH_BYTES:
+                yield from flush_pending_pages()
+
+    yield from flush_pending_pages()
+
+
+def get_pdf_ocr_pages(data, metrics=None, pages=None):
+    """逐頁提取 PDF 文字與圖片 OCR 結果（有快取，重複上傳不會再跑 Tesseract）"""
+    return cached_iter(
+        data, "pdf-ocr",
+        f"{PDF_OCR_VERSION}:{OCR_LANG}:{OCR_DEDUPE}:{plan_settings()}:{normalize_settings()}:{page_range_key(pages)}",
+        lambda data: extract_pdf_ocr_pages(data, metrics, pages),
+    )
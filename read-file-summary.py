@@ -1,230 +1,230 @@
+import time
+# 記錄每次執行（包含 rerun）的開始時間，用來量測介面繪製耗時
+SCRIPT_START = time.perf_counter()
+
 import streamlit as st
-import ollama
-import fitz  # PyMuPDF
-from opencc import OpenCC
-import re
 import os
-import pandas as pd
-from docx import Document
 from dotenv import load_dotenv
-from pptx import Presentation
-import threading
 import queue
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import chain
+from boilerplate import clean_segments, dedupe_stats_text
+from disk_cache import get_summary_cache
+from extractors import SUPPORTED_EXTENSIONS, file_extension, iter_file_segments
+from job_queue import PRIORITY_HIGH, cancel_job, show_job_notice, submit_job, wait_for_job
+from metrics import RunMetrics, show_metrics_panel
+from ollama_backend import keep_alive_for, model_status, start_warm_up
+from ollama_pool import get_ollama_pool
+from stream_render import StreamRenderer
+from retrieval import RETRIEVAL_TOP_K, get_index, passage_label
+from spool import spool_upload, upload_sha256
+from summarizer import (
+    EMPTY_SUMMARY, answer_question, build_summary_prompt, chat_with_ollama, chunk_document, combine_file_summaries,
+    enforce_traditional, file_summary_key, map_reduce_summary, map_token_budget, remove_think_tags,
+    render_clean_segment, summary_token_budget, tier_models,
+)
 
 # ==== 環境設定 ====
-load_dotenv()
-LLM_MODEL = os.getenv("LLM_MODEL")
-print(f"使用的 LLM 模型: {LLM_MODEL}")
-
-# ==== 工具函式 ====
-def remove_think_tags(text):
-    """移除各種思考標籤和不必要的內容"""
-    # 移除思考標籤
-    text = re.sub(r'<think>.*?</think>', '', text, flags=re.DOTALL)
-    text = re.sub(r'<thinking>.*?</thinking>', '', text, flags=re.DOTALL)
-    # 移除單獨的開始或結束標籤
-    text = re.sub(r'</?think>', '', text, flags=re.IGNORECASE)
-    text = re.sub(r'</?thinking>', '', text, flags=re.IGNORECASE)
-    
-    # 移除破損的標籤（如 </think> 沒有對應的 <think>）
-    text = re.sub(r'</?\s*think\s*>', '', text, flags=re.IGNORECASE)
-    text = re.sub(r'</?\s*thinking\s*>', '', text, flags=re.IGNORECASE)
-    # 移除多餘空白
-    text = re.sub(r'\n\s*\n', '\n\n', text)
-    return text.strip()
-
-# 初始化簡體轉繁體
-cc = OpenCC('s2t')
-def enforce_traditional(text):
-    return cc.convert(text)
-
-# ==== 文字預處理 ====
-def preprocess_text(text, max_length=50000):
-    """預處理文字，移除多餘空白和截斷過長內容"""
-    # 移除多餘的空白和換行
-    text = re.sub(r'\s+', ' ', text)
-    text = re.sub(r'\n+', '\n', text)
-    
-    # 如果文字過長，截斷但保持完整句子
-    if len(text) > max_length:
-        text = text[:max_length]
-        last_period = text.rfind('。')
-        if last_period > max_length * 0.8:  # 如果句號位置合理
-            text = text[:last_period + 1]
-    
-    return text.strip()
+@st.cache_resource
+def load_settings():
+    """讀取 .env 並回傳使用的模型；每個 process 只執行一次，rerun 時不會重新讀取"""
+    load_dotenv()
+    llm_model = os.getenv("LLM_MODEL")
+    print(f"使用的 LLM 模型: {llm_model}")
+    return llm_model
+
+LLM_MODEL = load_settings()
+# 分段平行總結：同時送往 Ollama 的請求數（伺服器端需設定 OLLAMA_NUM_PARALLEL 才能真正平行）
+MAP_CONCURRENCY = int(os.getenv("MAP_CONCURRENCY", "4"))
+# 每段的 token 上限；未設定時依模型 context 長度自動計算
+MAP_CHUNK_TOKENS = int(os.getenv("MAP_CHUNK_TOKENS", "0"))
+# 介面繪製（不含總結）的時間預算，超過時在終端機提出警告
+RERUN_BUDGET_MS = int(os.getenv("RERUN_BUDGET_MS", "300"))
+
+# 啟動時在背景預先載入模型（設定分層時 map / reduce 兩個模型都載入），第一次總結不必等待模型載入
+for tier_llm in tier_models(LLM_MODEL):
+    start_warm_up(tier_llm)
 
 # ==== 讀取檔案文字 ====
-def get_text_from_files(files):
-    full_text = ""
-    
+def iter_uploaded_segments(files, metrics=None):
+    """
+    逐段產生所有上傳檔案的內容，單一檔案失敗不影響其他檔案；metrics 記錄擷取耗時。
+    每個檔案先寫入暫存檔再以路徑擷取，讀完（或下游停止讀取）後刪除。
+    """
     for file in files:
         st.write(f"正在處理檔案：{file.name}")
-        ext = file.name.split(".")[-1].lower()
+        if file_extension(file.name) not in SUPPORTED_EXTENSIONS:
+            st.warning(f"不支援的檔案格式：{file.name}")
+            continue
         
         try:
-            if ext == "pdf":
-                pdf_document = fitz.open(stream=file.read(), filetype="pdf")
-                for page_num in range(len(pdf_document)):
-                    page = pdf_document.load_page(page_num)
-                    full_text += page.get_text() + "\n"
-            
-            elif ext in ["xlsx", "xls"]:
-                excel_data = pd.read_excel(file, sheet_name=None)
-                for sheet_name, sheet_df in excel_data.items():
-                    full_text += f"\n=== Sheet: {sheet_name} ===\n"
-                    sheet_df = sheet_df.fillna('')
-                    sheet_text = sheet_df.astype(str).apply(lambda row: ' '.join(row), axis=1).str.cat(sep="\n")
-                    full_text += sheet_text + "\n"
-            
-            elif ext == "csv":
-                csv_data = pd.read_csv(file)
-                csv_text = csv_data.astype(str).apply(lambda row: ' '.join(row), axis=1).str.cat(sep="\n")
-                full_text += csv_text + "\n"
-            
-            elif ext == "docx":
-                doc = Document(file)
-                doc_text = "\n".join([p.text for p in doc.paragraphs])
-                full_text += doc_text + "\n"
-            elif ext == "pptx":
-                prs = Presentation(file)
-                for i, slide in enumerate(prs.slides):
-                    slide_text = []
-                    for shape in slide.shapes:
-                        if hasattr(shape, "text"):
-                            slide_text.append(shape.text)
-                    full_text += f"\n=== Slide {i+1} ===\n" + "\n".join(slide_text) + "\n"
-            elif ext == "txt":
-                text_content = file.read().decode("utf-8", errors="ignore")
-                full_text += text_content + "\n"
-            else:
-                st.warning(f"不支援的檔案格式：{file.name}")
+            with spool_upload(file) as spooled:
+                segments = iter_file_segments(file.name, spooled)
+                yield from metrics.timed_iter(segments, "extract") if metrics else segments
         except Exception as e:
             st.error(f"處理檔案 {file.name} 時發生錯誤：{e}")
-    
-    return preprocess_text(full_text)
-
-# ==== 分段處理大文檔 ====
-def split_text_into_chunks(text, chunk_size=20000, overlap=2000):
-    """將長文本分割成重疊的段落"""
-    if len(text) <= chunk_size:
-        return [text]
-    
-    chunks = []
-    start = 0
-    
-    while start < len(text):
-        end = start + chunk_size
-        if end > len(text):
-            end = len(text)
-        
-        # 尋找適當的分割點（句號或段落）
-        if end < len(text):
-            split_point = text.rfind('。', start, end)
-            if split_point == -1:
-                split_point = text.rfind('\n', start, end)
-            if split_point != -1:
-                end = split_point + 1
-        
-        chunks.append(text[start:end])
-        start = end - overlap if end < len(text) else end
-    
-    return chunks
 
-# ==== 優化的 Ollama 調用 ====
-def get_ollama_summary_optimized(text):
-    if not text or not text.strip():
-        return "沒有可總結的文字。"
-
-    # 更簡潔的 prompt
-    system_prompt = """你是文件摘要專家，請用繁體中文輸出系統操作流程重點。不要使用任何思考過程標籤，直接給出最終答案。"""
-
-    user_prompt = f"""
-請閱讀我提供的文件（公司ERP系統操作手冊），並依據以下所有規則，將內容整理成一份簡潔、有條理的系統操作流程摘要。
+def iter_document_chunks(files, max_tokens, metrics=None, dedupe_stats=None):
+    """邊讀取檔案邊切出不超過 max_tokens 的段落（已移除頁首頁尾與重複內容）"""
+    return chunk_document(iter_uploaded_segments(files, metrics), max_tokens, metrics, dedupe_stats)
 
-### 輸出規則 ###
-1. **核心目標：**
-   - 僅專注於「系統操作流程」。
+def get_text_from_files(files, max_tokens=None):
+    """讀取檔案內容；指定 max_tokens 時只讀到放得進一次請求的長度為止"""
+    if max_tokens is None:
+        return "".join(render_clean_segment(segment) for segment in clean_segments(iter_uploaded_segments(files)))
+    return next(iter_document_chunks(files, max_tokens), "")
 
-2. **格式要求：**
-   - 採用「條列式」呈現。
-   - 每頁摘要 10 到 15 個關鍵重點。
+# ==== 優化的 Ollama 調用 ====
+def get_ollama_summary_optimized(text, metrics=None, cancel=None):
+    if not text or not text.strip():
+        return EMPTY_SUMMARY
 
-3. **內容要求：**
-   - 保留關鍵專有名詞與重要數字。
-   - 避免重複內容。
-   - 忽略與操作流程無關的所有細節與背景資訊。
+    try:
+        return chat_with_ollama(LLM_MODEL, build_summary_prompt(text), metrics=metrics, cancel=cancel)
+    except Exception as e:
+        return f"與 Ollama 溝通時發生錯誤：{e}"
 
-內容：
-{text[:100000]}
-"""
+# ==== 流式處理函數 ====
+def stream_ollama_summary(text, on_token=None, metrics=None, cancel=None):
+    """流式生成摘要，每收到一段新內容就呼叫 on_token(新內容)；cancel 拋出例外時中止生成"""
+    if not text or not text.strip():
+        return EMPTY_SUMMARY
 
     try:
-        # 添加優化參數
-        response = ollama.chat(
-            model=LLM_MODEL,
-            messages=[
-                {'role': 'system', 'content': system_prompt},
-                {'role': 'user', 'content': user_prompt}
-            ],
-            options={
-                'temperature': 0.3,  # 降低隨機性提升速度
-            }
+        return chat_with_ollama(
+            LLM_MODEL, build_summary_prompt(text), on_token or (lambda _: None), metrics, cancel=cancel
         )
-        return response['message']['content']
     except Exception as e:
         return f"與 Ollama 溝通時發生錯誤：{e}"
 
-# ==== 流式處理函數 ====
-def stream_ollama_summary(text, progress_callback=None):
-    """流式生成摘要，實時顯示結果"""
-    if not text or not text.strip():
-        return "沒有可總結的文字。"
+# ==== 分段平行總結（map-reduce） ====
+def summarize_in_parallel(chunks, max_workers=MAP_CONCURRENCY, chunk_progress=None, on_token=None, metrics=None,
+                          cancel=None):
+    """分段平行總結；錯誤以訊息呈現而不中斷介面"""
+    try:
+        summary, _ = map_reduce_summary(LLM_MODEL, chunks, max_workers, chunk_progress, on_token, metrics, cancel)
+        return summary
+    except Exception as e:
+        return f"與 Ollama 溝通時發生錯誤：{e}"
 
-    system_prompt = """你是文件摘要專家，請用繁體中文輸出系統操作流程重點。不要使用任何思考過程標籤，直接給出最終答案。"""
-    user_prompt = f"""
-請閱讀我提供的文件（公司ERP系統操作手冊），並依據以下所有規則，將內容整理成一份簡潔、有條理的系統操作流程摘要。
+# ==== 逐檔總結 ====
+def collect_file_work(files):
+    """
+    在 script thread 查詢各檔案已有的摘要，回傳（{上傳序號: 摘要}, [(上傳序號, 檔案, key)]）；
+    其餘檔案在工作送出後才逐一擷取。以上傳序號而非檔名區分檔案，不同資料夾的同名檔案不會互相覆蓋。
+    每個檔案的摘要依內容 SHA-256 存在 session_state 與持久化快取，增減或修改一個檔案時，
+    其他檔案不需要重新擷取或總結。
+    """
+    budget = map_token_budget(LLM_MODEL, MAP_CHUNK_TOKENS)
+    session = st.session_state.setdefault("file_summaries", {})
+    cache = get_summary_cache()
+    summaries = {}
+    pending = []
+    for i, file in enumerate(files):
+        if file_extension(file.name) not in SUPPORTED_EXTENSIONS:
+            st.warning(f"不支援的檔案格式：{file.name}")
+            continue
+        key = file_summary_key(LLM_MODEL, upload_sha256(file), budget)
+        summary = session.get(key) or cache.get(key)
+        if summary is not None:
+            summaries[i] = session[key] = summary
+            continue
+        pending.append((i, file, key))
+    return summaries, pending
 
-### 輸出規則 ###
-1. **核心目標：**
-   - 僅專注於「系統操作流程」。
+def feed_channel(channel, chunks, job):
+    """
+    在 script thread 把段落逐一放入有上限的 channel，最後放入 None；channel 已滿時等待工作佇列取用。
+    工作已取消或已結束（失敗）時停止讀取並回傳 False。
+    """
+    for chunk in chain(chunks, [None]):
+        while True:
+            if job.cancelled or job.wait(0):
+                return False
+            try:
+                channel.put(chunk, timeout=0.1)
+                break
+            except queue.Full:
+                continue
+    return True
 
-2. **格式要求：**
-   - 採用「條列式」呈現。
-   - 每頁摘要 10 到 15 個關鍵重點。
+def iter_channel(channel, job):
+    """在工作佇列中逐一取出 channel 的段落直到 None；每取出一段及等待時檢查工作是否已取消"""
+    while True:
+        try:
+            chunk = channel.get(timeout=0.1)
+        except queue.Empty:
+            job.check_cancelled()
+            continue
+        job.check_cancelled()
+        if chunk is None:
+            return
+        yield chunk
 
-3. **內容要求：**
-   - 保留關鍵專有名詞與重要數字。
-   - 避免重複內容。
-   - 忽略與操作流程無關的所有細節與背景資訊。
+def summarize_file_work(work, max_workers=MAP_CONCURRENCY, file_progress=None, metrics=None, cancel=None):
+    """
+    平行總結未快取的檔案並寫入持久化快取；work 為 [(上傳序號, key, 段落)]，回傳 {上傳序號: (key, 摘要)}。
+    不呼叫 Streamlit，可在工作佇列中執行。
+    檔案之間平行，單一檔案內的段落也平行，總請求數維持在 max_workers 左右。
+    有段落失敗或逾時而摘要不完整的檔案不寫入快取、key 為 None，下次上傳時重新總結。
+    """
+    cache = get_summary_cache()
+    results = {}
+    if not work:
+        return results
+    file_workers = min(max_workers, len(work))
+    chunk_workers = max(1, max_workers // file_workers)
+    with ThreadPoolExecutor(max_workers=file_workers) as executor:
+        futures = {
+            executor.submit(
+                map_reduce_summary, LLM_MODEL, chunks, chunk_workers, metrics=metrics, cancel=cancel
+            ): (index, key)
+            for index, key, chunks in work
+        }
+        for future in as_completed(futures):
+            index, key = futures[future]
+            try:
+                summary, complete = future.result()
+                summary = enforce_traditional(remove_think_tags(summary))
+            except Exception as e:
+                results[index] = (None, f"[總結失敗：{e}]")
+            else:
+                results[index] = (key if complete else None, summary)
+                if complete and summary != EMPTY_SUMMARY:
+                    cache.set(key, summary)
+            if file_progress:
+                file_progress(len(results), len(work))
+    return results
 
-內容：
-{text[:100000]}
-"""
+def combine_summaries(file_summaries, max_workers=MAP_CONCURRENCY, on_token=None, metrics=None, cancel=None):
+    """合併各檔案摘要；錯誤以訊息呈現而不中斷介面"""
+    usable = [(name, summary) for name, summary in file_summaries if summary != EMPTY_SUMMARY]
+    try:
+        return combine_file_summaries(LLM_MODEL, usable, max_workers, on_token, metrics, cancel)
+    except Exception as e:
+        return f"與 Ollama 溝通時發生錯誤：{e}"
 
+# ==== 問答（只送出檢索到的段落） ====
+def index_uploaded_files(files):
+    """將上傳的檔案加入本地索引（已索引過的內容直接略過），回傳成功的 doc_id"""
+    index = get_index()
+    doc_ids = []
+    for file in files:
+        if file_extension(file.name) not in SUPPORTED_EXTENSIONS:
+            continue
+        try:
+            with spool_upload(file) as spooled:
+                doc_ids.append(index.add_document(file.name, spooled))
+        except Exception as e:
+            st.error(f"建立索引 {file.name} 時發生錯誤：{e}")
+    return doc_ids
+
+def ask_question(question, passages, on_token=None, metrics=None, cancel=None):
+    """依檢索到的段落回答問題；錯誤以訊息呈現而不中斷介面"""
     try:
-        # 使用流式API
-        stream = ollama.chat(
-            model=LLM_MODEL,
-            messages=[
-                {'role': 'system', 'content': system_prompt},
-                {'role': 'user', 'content': user_prompt}
-            ],
-            stream=True,
-            options={
-                'temperature': 0.3,
-            }
+        return answer_question(
+            LLM_MODEL, question, [(passage_label(p), p["text"]) for p in passages], on_token, metrics, cancel
         )
-        
-        full_response = ""
-        for chunk in stream:
-            if 'message' in chunk:
-                content = chunk['message']['content']
-                full_response += content
-                if progress_callback:
-                    progress_callback(full_response)
-        
-        return full_response
     except Exception as e:
         return f"與 Ollama 溝通時發生錯誤：{e}"
 
@@ -232,9 +232,35 @@ def stream_ollama_summary(text, progress_callback=None):
 st.set_page_config(page_title="LLM 文件總結器", layout="wide")
 st.header("使用 LLM 進行重點整理 (PDF / Excel / CSV / Word / PPTX / TXT)")
 st.info("此程式會讀取上傳檔案的內容，然後交由 LLM 生成。")
+show_job_notice()
+
+# 模型狀態
+with st.sidebar:
+    st.subheader("模型狀態")
+    # 按下「重新整理狀態」的那次執行重新查詢，其餘 rerun 使用快取的狀態
+    refresh_status = st.session_state.get("refresh_model_status", False)
+    for tier_llm in tier_models(LLM_MODEL):
+        status, status_text = model_status(tier_llm, refresh_status)
+        status_box = {"resident": st.success, "loading": st.info}.get(status, st.warning)
+        status_box(f"{tier_llm}：{status_text}")
+        st.caption(f"keep_alive：{keep_alive_for(tier_llm)}")
+    # 設定多台 Ollama 主機（OLLAMA_HOSTS）時顯示各主機的狀態與進行中的請求數
+    hosts = get_ollama_pool().stats()
+    if len(hosts) > 1:
+        st.caption("Ollama 主機：")
+        for host in hosts:
+            state = "正常" if host["healthy"] else "暫停使用"
+            st.caption(f"{host['host']}：{state}，進行中 {host['inflight']}/{host['limit']}，已處理 {host['served']}")
+    st.button("重新整理狀態", key="refresh_model_status")
 
 # 添加處理選項
+mode = st.radio("模式", ["總結全部內容", "針對問題查詢"], horizontal=True)
+use_qa = mode == "針對問題查詢"
 use_streaming = st.checkbox("使用串流模式（即時顯示結果）", value=True)
+use_per_file = not use_qa and st.checkbox("逐檔總結後合併（增減檔案時只重新總結有變動的檔案）", value=True)
+use_map_reduce = not use_qa and not use_per_file and st.checkbox("分段平行總結（長文件完整涵蓋，不截斷）", value=False)
+if use_per_file or use_map_reduce:
+    map_concurrency = st.slider("同時送出的段落請求數", min_value=1, max_value=16, value=MAP_CONCURRENCY)
 
 uploaded_files = st.file_uploader(
     "請上傳 PDF / Excel / CSV / Word / PPTX / TXT 檔案",
@@ -242,34 +268,218 @@ uploaded_files = st.file_uploader(
     accept_multiple_files=True
 )
 
-if uploaded_files and st.button("開始總結"):
-    with st.spinner("正在讀取檔案內容..."):
-        full_text = get_text_from_files(uploaded_files)
+if use_qa:
+    question = st.text_input("請輸入問題", placeholder="例如：如何在 ERP 中過帳採購退回？")
+    search_all = st.checkbox("搜尋所有已索引的文件（不只本次上傳的檔案）", value=not uploaded_files)
+
+# 介面繪製耗時（rerun 預算）；第一次執行包含各模組的載入時間
+render_ms = (time.perf_counter() - SCRIPT_START) * 1000
+st.sidebar.caption(f"介面繪製耗時：{render_ms:.0f} ms")
+if render_ms > RERUN_BUDGET_MS:
+    print(f"介面繪製耗時 {render_ms:.0f} ms，超過預算 {RERUN_BUDGET_MS} ms")
+
+# 總結模式的按鈕只建立一次；逐檔與其他模式共用，避免兩個相同的按鈕造成元件 ID 重複
+start_summary = not use_qa and bool(uploaded_files) and st.button("開始總結")
+
+if use_qa:
+    if st.button("提問") and question.strip():
+        metrics = RunMetrics(model=LLM_MODEL, mode="qa", streaming=use_streaming, files=len(uploaded_files or []))
+        with st.spinner("正在建立索引..."), metrics.span("index"):
+            doc_ids = index_uploaded_files(uploaded_files or [])
+        with metrics.span("retrieve"):
+            passages = get_index().search(question, RETRIEVAL_TOP_K, None if search_all else doc_ids)
+
+        with st.expander(f"檢索到的段落（{len(passages)} 段）"):
+            for passage in passages:
+                st.markdown(f"**{passage_label(passage)}**（分數 {passage['score']}）")
+                st.text(passage["text"][:1000])
+
+        st.subheader("回答")
+        placeholder = st.empty()
+        renderer = StreamRenderer(placeholder.write, enforce_traditional)
+        # 問答只送出少量段落，優先於整份文件的總結
+        job = submit_job(
+            lambda job: ask_question(question, passages, job.emit if use_streaming else None, metrics, job.check_cancelled),
+            priority=PRIORITY_HIGH,
+        )
+        if job:
+            with st.spinner("正在使用 LLM 回答問題..."):
+                wait_for_job(job, on_token=renderer.feed, metrics=metrics)
+            if job.status == "done":
+                placeholder.write(enforce_traditional(remove_think_tags(job.result)))
+                stats = get_index().stats()
+                st.caption(f"索引中共有 {stats['documents']} 份文件、{stats['chunks']} 個段落")
+                show_metrics_panel(metrics, metrics.log())
+elif start_summary and use_per_file:
+    dedupe_stats = {}
+    metrics = RunMetrics(
+        model=LLM_MODEL, mode="per_file", streaming=use_streaming, files=len(uploaded_files), dedupe=dedupe_stats
+    )
+    file_summaries, pending = collect_file_work(uploaded_files)
+    budget = map_token_budget(LLM_MODEL, MAP_CHUNK_TOKENS)
+    # 每個未快取的檔案一個有上限的 channel：script thread 逐檔擷取、切段後交出，工作佇列中的總結邊收邊處理，
+    # 記憶體中的段落數與第一段開始總結的時間不隨上傳檔案數增加
+    channels = [(i, file, key, queue.Queue(maxsize=map_concurrency)) for i, file, key in pending]
+    reused = len(file_summaries)
+    metrics.context["files_reused"] = reused
+    if reused:
+        st.caption(f"{reused} 個檔案內容未變動，直接使用先前的摘要")
+
+    def summarize_files(job):
+        """工作佇列中執行：總結未快取的檔案，再依上傳順序合併"""
+        work = [(i, key, iter_channel(channel, job)) for i, _, key, channel in channels]
+        results = summarize_file_work(work, map_concurrency, job.report, metrics, job.check_cancelled)
+        summaries = {**file_summaries, **{i: summary for i, (_, summary) in results.items()}}
+        ordered = [(file.name, summaries[i]) for i, file in enumerate(uploaded_files) if i in summaries]
+        if not any(summary != EMPTY_SUMMARY for _, summary in ordered):
+            return results, ordered, None
+        on_token = job.emit if use_streaming else None
+        return results, ordered, combine_summaries(ordered, map_concurrency, on_token, metrics, job.check_cancelled)
+
+    st.subheader("文件總結")
+    progress_bar = st.progress(reused / len(uploaded_files), text="正在逐檔總結...")
+    placeholder = st.empty()
+    renderer = StreamRenderer(placeholder.write, enforce_traditional)
+
+    def update_file_progress(done, total):
+        progress_bar.progress((reused + done) / (reused + total), text=f"已完成 {reused + done} / {reused + total} 個檔案")
+
+    job = submit_job(summarize_files)
+    if job:
+        fed = False
+        try:
+            with st.spinner("正在讀取檔案內容..."):
+                for _, file, _, channel in channels:
+                    chunks = chunk_document(iter_uploaded_segments([file], metrics), budget, metrics, dedupe_stats)
+                    if not feed_channel(channel, chunks, job):
+                        break
+            fed = True
+        finally:
+            if not fed:
+                # 讀取被中斷（rerun）時段落不完整，取消工作，不讓它等待永遠不會送來的段落
+                cancel_job(job)
+        with st.spinner("正在逐檔總結並合併..."):
+            wait_for_job(job, on_token=renderer.feed, on_progress=update_file_progress, metrics=metrics)
+        progress_bar.empty()
+        if job.status == "failed":
+            st.error(f"總結時發生錯誤：{job.error}")
+        elif job.status == "done":
+            results, ordered, summary = job.result
+            session = st.session_state.setdefault("file_summaries", {})
+            for key, file_summary in results.values():
+                if key and file_summary != EMPTY_SUMMARY:
+                    session[key] = file_summary
+            with st.expander("各檔案摘要"):
+                for name, file_summary in ordered:
+                    st.markdown(f"**{name}**")
+                    st.write(file_summary)
+            if summary is None:
+                st.warning("沒有可總結的文字，請確保檔案內容可被讀取。")
+            else:
+                placeholder.write(enforce_traditional(remove_think_tags(summary)))
+                st.success("總結完成！")
+                if dedupe_stats:
+                    st.caption(dedupe_stats_text(dedupe_stats))
+                show_metrics_panel(metrics, metrics.log())
+elif start_summary:
+    # 記錄這次總結各階段的耗時、Ollama 統計與重複內容移除結果
+    dedupe_stats = {}
+    metrics = RunMetrics(
+        model=LLM_MODEL,
+        mode="map_reduce" if use_map_reduce else "single",
+        streaming=use_streaming,
+        files=len(uploaded_files),
+        dedupe=dedupe_stats,
+    )
+    if use_map_reduce:
+        # 分段平行模式：邊讀取檔案邊切段，第一段切好就可以開始總結
+        chunks = iter_document_chunks(uploaded_files, map_token_budget(LLM_MODEL, MAP_CHUNK_TOKENS), metrics, dedupe_stats)
+        with st.spinner("正在讀取檔案內容..."):
+            first_chunk = next(chunks, "")
+        preview_text = first_chunk
+        chunks = chain([first_chunk], chunks)
+    else:
+        # 單次總結：只讀取放得進模型 context 的內容
+        chunks = iter_document_chunks(uploaded_files, summary_token_budget(LLM_MODEL), metrics, dedupe_stats)
+        with st.spinner("正在讀取檔案內容..."):
+            full_text = next(chunks, "")
+        if next(chunks, None) is not None:
+            st.info("文件超過模型單次可處理的長度，只總結前段內容；如需完整涵蓋請勾選「分段平行總結」。")
+        # 停止讀取：已擷取的部分寫入擷取快取，重複上傳時不必重新解析
+        chunks.close()
+        preview_text = full_text
 
     with st.expander("點此查看內容"):
-        st.text_area("內容", value=full_text[:5000] + "..." if len(full_text) > 5000 else full_text, height=300)
+        st.text_area("內容", value=preview_text[:5000] + "..." if len(preview_text) > 5000 else preview_text, height=300)
 
-    if full_text.strip():
+    if preview_text.strip():
         st.subheader("文件總結")
         
-        if use_streaming:
+        placeholder = st.empty()
+
+        def update_display(content):
+            processed_content = enforce_traditional(remove_think_tags(content))
+            placeholder.write(processed_content)
+
+        # 串流時以增量方式過濾思考標籤、簡轉繁，並節流畫面更新
+        renderer = StreamRenderer(placeholder.write, enforce_traditional)
+        on_token = renderer.feed if use_streaming else None
+
+        if use_map_reduce:
+            # 分段平行模式：先平行總結各段，再合併。
+            # 段落由 script thread 繼續讀取（擷取訊息需在 script thread 顯示），經由有上限的 channel 交給工作佇列中的總結，
+            # 記憶體中的段落數不隨文件長度增加
+            progress_bar = st.progress(0.0, text="正在分段總結...")
+            channel = queue.Queue(maxsize=map_concurrency)
+
+            def update_progress(done, total):
+                progress_bar.progress(done / total, text=f"已完成 {done} / {total} 段（其餘段落讀取中）")
+
+            job = submit_job(
+                lambda job: summarize_in_parallel(
+                    iter_channel(channel, job),
+                    max_workers=map_concurrency,
+                    chunk_progress=job.report,
+                    on_token=job.emit if use_streaming else None,
+                    metrics=metrics,
+                    cancel=job.check_cancelled,
+                )
+            )
+            if job:
+                fed = False
+                try:
+                    with st.spinner("正在讀取檔案內容..."):
+                        feed_channel(channel, chunks, job)
+                    fed = True
+                finally:
+                    if not fed:
+                        # 讀取被中斷（rerun）時段落不完整，取消工作，不讓它等待永遠不會送來的段落
+                        cancel_job(job)
+                with st.spinner("正在使用 LLM 分段平行總結文件..."):
+                    wait_for_job(job, on_token=on_token, on_progress=update_progress, metrics=metrics)
+            progress_bar.empty()
+        elif use_streaming:
             # 串流模式
-            placeholder = st.empty()
-            
-            def update_display(content):
-                processed_content = enforce_traditional(remove_think_tags(content))
-                placeholder.write(processed_content)
-            
-            with st.spinner("正在使用 LLM 總結文件（串流模式）..."):
-                summary = stream_ollama_summary(full_text, update_display)
+            job = submit_job(lambda job: stream_ollama_summary(full_text, job.emit, metrics, job.check_cancelled))
+            if job:
+                with st.spinner("正在使用 LLM 總結文件（串流模式）..."):
+                    wait_for_job(job, on_token=on_token, metrics=metrics)
         else:
             # 傳統模式
-            with st.spinner("正在使用 LLM 總結文件..."):
-                summary = get_ollama_summary_optimized(full_text)
-            
-            summary = enforce_traditional(remove_think_tags(summary))
-            st.write(summary)
-        
-        st.success("總結完成！")
+            job = submit_job(lambda job: get_ollama_summary_optimized(full_text, metrics, job.check_cancelled))
+            if job:
+                with st.spinner("正在使用 LLM 總結文件..."):
+                    wait_for_job(job, metrics=metrics)
+
+        if job and job.status == "done":
+            # 串流結束後對完整結果做一次完整處理
+            update_display(job.result)
+            st.success("總結完成！")
+            if dedupe_stats:
+                st.caption(dedupe_stats_text(dedupe_stats))
+            # 寫入 JSON log 並顯示可收合的效能指標面板
+            show_metrics_panel(metrics, metrics.log())
+        elif job and job.status == "failed":
+            st.error(f"總結時發生錯誤：{job.error}")
     else:
-        st.warning("沒有可總結的文字，請確保檔案內容可被讀取。")
\ No newline at end of file
+        st.warning("沒有可總結的文字，請確保檔案內容可被讀取。")
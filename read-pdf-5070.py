@@ -1,54 +1,53 @@
 import os
+import threading
+import time
 import gradio as gr
-from langchain_community.document_loaders import PyPDFLoader
-from langchain.chains.summarize import load_summarize_chain
-from langchain_huggingface import HuggingFacePipeline
-from transformers import pipeline, AutoModelForCausalLM, AutoTokenizer, BitsAndBytesConfig
-import torch
-from langchain.prompts import ChatPromptTemplate
-from langchain_core.messages import SystemMessage, HumanMessage
+
+from hf_pipeline import load_text_generation, map_reduce_summarize
+
+# 啟動時間量測的起點
+START_TIME = time.perf_counter()
 
 # --- 安裝必要的函式庫 ---
-# pip install --upgrade langchain langchain-community gradio pypdf transformers accelerate bitsandbytes torch langchain-huggingface
-# 另外，請確保已安裝 sentence-transformers
-# pip install sentence-transformers
+# pip install --upgrade langchain-community gradio pypdf transformers accelerate torch
+# 使用 GPU 4-bit 量化時另外安裝 bitsandbytes；只用 CPU 的伺服器不需要。
 
 # --- 設定模型 ---
-# 針對 12GB VRAM，選擇 Llama 3.1 8B Instruct 並使用 4-bit 量化
-quantization_config = BitsAndBytesConfig(
-    load_in_4bit=True,
-    bnb_4bit_quant_type="nf4",
-    bnb_4bit_compute_dtype=torch.bfloat16,
-    bnb_4bit_use_double_quant=True,
-)
-
+# torch / transformers / langchain 與模型都在第一次需要時才載入，Gradio 啟動不必等待模型。
 # 選擇 Llama 3.1 8B Instruct 模型
 # 請注意，首次使用此模型可能需要您在 Hugging Face 網站上接受其使用條款。
 model_id = "meta-llama/Llama-3.1-8B-Instruct"
-tokenizer = AutoTokenizer.from_pretrained(model_id, trust_remote_code=True)
-model = AutoModelForCausalLM.from_pretrained(
-    model_id,
-    device_map="auto",
-    quantization_config=quantization_config,
-    trust_remote_code=True,
-)
-
-# 使用 HuggingFace Pipeline 建立摘要模型
-pipe = pipeline(
-    "text-generation",
-    model=model,
-    tokenizer=tokenizer,
-    max_new_tokens=2048,
-    do_sample=True,
-    temperature=0.7,
-    top_p=0.9,
-)
-llm = HuggingFacePipeline(pipeline=pipe)
+
+# 明確要求以繁體中文回應；各段摘要與最後的合併使用同一個 prompt
+SUMMARY_PROMPT = "您是一個專業的摘要專家。請根據提供的文件內容，以繁體中文為我生成一份精簡且準確的摘要。\n\n文件內容:\n{text}"
+
+_llm = None
+_llm_lock = threading.Lock()
+
+
+def get_llm():
+    """取得共用的 text-generation pipeline（每個 process 只載入一次；多個請求同時呼叫時只有一個會載入模型）"""
+    global _llm
+    with _llm_lock:
+        if _llm is None:
+            _llm = _load_llm()
+        return _llm
+
+
+def _load_llm():
+    # GPU 使用 4-bit 量化（bitsandbytes）；沒有 CUDA 或設定 HF_DEVICE=cpu 時以 CPU 執行（見 hf_pipeline.py）
+    return load_text_generation(
+        model_id,
+        max_new_tokens=2048,
+        do_sample=True,
+        temperature=0.7,
+        top_p=0.9,
+    )
 
 
 def summarize_pdf(pdf_file):
     """
-    接收一個 PDF 檔案物件，並使用 LangChain 和本地模型進行摘要。
+    接收一個 PDF 檔案物件，並使用本地模型以 map-reduce 方式進行摘要。
     
     Args:
     pdf_file: Gradio File 元件提供的檔案物件。
@@ -62,30 +61,14 @@ def summarize_pdf(pdf_file):
     try:
         pdf_file_path = pdf_file.name
         
+        from langchain_community.document_loaders import PyPDFLoader
+
         loader = PyPDFLoader(pdf_file_path)
         docs = loader.load_and_split()
         
-        # --- 變更開始 ---
-        # 建立一個明確要求以繁體中文回應的提示模板
-        prompt_template = ChatPromptTemplate.from_messages(
-            [
-                SystemMessage(
-                    content="您是一個專業的摘要專家。請根據提供的文件內容，以繁體中文為我生成一份精簡且準確的摘要。"
-                ),
-                HumanMessage(
-                    content="文件內容:\n{text}"
-                ),
-            ]
-        )
-
-        # 使用 `stuff` 鏈，適合短文件，更高效。
-        # 現在我們將自定義的中文提示模板傳入，以確保回應是中文。
-        chain = load_summarize_chain(llm, chain_type="stuff", prompt=prompt_template)
-        # --- 變更結束 ---
-        
-        summary = chain.invoke({"input_documents": docs})
-        
-        return summary.get('output_text', '無法生成摘要。')
+        # 各段一次交給 pipeline 批次生成（HF_BATCH_SIZE），再合併成一份摘要；只有一段時直接摘要
+        summary = map_reduce_summarize(get_llm(), [doc.page_content for doc in docs], SUMMARY_PROMPT, SUMMARY_PROMPT)
+        return summary or '無法生成摘要。'
 
     except Exception as e:
         return f"發生錯誤: {e}"
@@ -105,6 +88,9 @@ def main():
         description="此應用程式使用強大的 Llama 3.1 8B 模型，為您離線摘要 PDF 檔案。",
     )
     
+    # 在背景預先載入模型，介面先啟動；第一個請求若模型還沒載入完成會在 get_llm() 等待
+    threading.Thread(target=get_llm, name="load-llm", daemon=True).start()
+    print(f"介面啟動耗時：{(time.perf_counter() - START_TIME) * 1000:.0f} ms（模型於背景載入中）")
     interface.launch()
 
 if __name__ == "__main__":
@@ -1,9 +1,11 @@
 import streamlit as st
-import ollama
-import fitz # PyMuPDF
-import io
 import pytesseract
-from PIL import Image
+from chunking import chunk_segments, get_context_length, input_token_budget
+from extractors import iter_pdf_ocr_segments, ocr_stats_text, render_segment, render_segments
+from metrics import RunMetrics, show_metrics_panel
+from ollama_backend import cached_chat
+from pdf_extract import parse_page_range
+from spool import spool_upload
 
 # --- 函數定義 ---
 
@@ -15,67 +17,65 @@ try:
 except Exception as e:
     st.warning(f"無法設定 Tesseract-OCR 路徑，請確認其已正確安裝並在系統 PATH 中。錯誤：{e}")
 
+# 使用的 Ollama 模型（讀取內容時依此模型的 context 長度限制輸入長度）
+OLLAMA_MODEL = 'gemma3:12b'
 
-def get_pdf_content_with_ocr(pdf_files):
+
+def iter_pdf_content_with_ocr(pdf_files, stats, metrics=None, pages=None):
     """
-    從多個 PDF 檔案中提取文字和圖片內容。
-    對於圖片，它會使用 Tesseract 進行 OCR 辨識，並將結果加入到文件中。
+    從多個 PDF 檔案中逐段產生文字和圖片內容。
+    對於圖片，它會使用 Tesseract 進行 OCR 辨識（依檔案內容快取，重複上傳不會再跑 Tesseract）。
+    每個檔案先寫入暫存檔再以路徑開啟，pages 為頁碼範圍時只處理這些頁面。
     """
-    full_text = ""
     for pdf_file in pdf_files:
         st.write(f"正在處理檔案：**{pdf_file.name}**...")
         try:
-            # 使用 PyMuPDF 從 Streamlit 的上傳檔案中讀取
-            pdf_document = fitz.open(stream=pdf_file.read(), filetype="pdf")
-            
-            for page_num in range(len(pdf_document)):
-                page = pdf_document.load_page(page_num)
-                
-                # 1. 提取頁面上的文字
-                page_text = page.get_text()
-                full_text += page_text + "\n"
-                
-                # 2. 提取頁面上的圖片並進行 OCR
-                image_list = page.get_images(full=True)
-                for img_index, img in enumerate(image_list):
-                    xref = img[0]
-                    base_image = pdf_document.extract_image(xref)
-                    image_bytes = base_image["image"]
-                    
-                    # 將圖片資料轉換為 PIL Image
-                    pil_image = Image.open(io.BytesIO(image_bytes))
-                    
-                    # 進行 OCR，指定繁體中文和英文語言
-                    ocr_text = pytesseract.image_to_string(pil_image, lang='chi_tra+eng')
-                    if ocr_text.strip():
-                        full_text += f"\n[圖片內容 OCR 辨識結果 (第 {page_num+1} 頁, 圖片 {img_index+1})]:\n{ocr_text}\n"
-                        
+            with spool_upload(pdf_file) as spooled:
+                segments = iter_pdf_ocr_segments(pdf_file.name, spooled, stats, metrics, pages)
+                # "extract" 包含 OCR 的時間，其中 Tesseract 辨識的部分另外計入 "ocr"
+                yield from metrics.timed_iter(segments, "extract") if metrics else segments
         except Exception as e:
             st.error(f"處理檔案 **{pdf_file.name}** 時發生錯誤：{e}")
-            
+
+def get_pdf_content_with_ocr(pdf_files, max_tokens=None, metrics=None, pages=None):
+    """
+    從多個 PDF 檔案中提取文字和圖片內容；指定 max_tokens 時讀到放得進一次請求的長度就停止
+    （在頁邊界切開），總結用不到的頁面不會被 OCR。
+    """
+    stats = {}
+    segments = iter_pdf_content_with_ocr(pdf_files, stats, metrics, pages)
+    if max_tokens is None:
+        full_text = "".join(render_segments(segments))
+    else:
+        full_text = next(chunk_segments(segments, max_tokens, render_segment), "")
+    st.caption(ocr_stats_text(stats))
+    if stats.get("plans"):
+        with st.expander("各頁是否進行 OCR 的原因"):
+            st.dataframe(stats["plans"], use_container_width=True)
     return full_text
 
 
-@st.cache_data
-def get_ollama_summary(text):
+def get_ollama_summary(text, metrics=None):
     """
     將提取的文字傳送給 Ollama 模型進行總結。
-    使用 st.cache_data 暫存結果，避免重複計算。
+    結果存在跨 process 共用的持久化快取中，避免重複計算。
     """
     if not text.strip():
         return "沒有可總結的文字。"
     
     # 提示詞已經是繁體中文，這會讓模型以繁體中文回應
-    # 限制輸入長度，避免 Ollama 模型過載
-    prompt = f"請以繁體中文回答。請幫我總結以下多個文件內容，並條列出重點，包含圖片中的文字：\n\n{text[:20000]}"
+    # 輸入長度已在讀取時依模型 context 長度限制
+    prompt = f"請以繁體中文回答。請幫我總結以下多個文件內容，並條列出重點，包含圖片中的文字：\n\n{text}"
     
     try:
         # 請確認您已啟動 Ollama 服務並下載 `gemma3:latest` 模型
-        response = ollama.chat(
-            model='gemma3:12b',
-            messages=[{'role': 'user', 'content': prompt}]
+        # 結果存入持久化快取，相同內容再次總結時不需要再呼叫 LLM
+        return cached_chat(
+            model=OLLAMA_MODEL,
+            messages=[{'role': 'user', 'content': prompt}],
+            options={'num_ctx': get_context_length(OLLAMA_MODEL)},  # 明確指定 context 長度，避免 Ollama 以預設值截斷
+            metrics=metrics,
         )
-        return response['message']['content']
     except Exception as e:
         st.error(f"與 Ollama 溝通時發生錯誤。請確認 Ollama 服務已啟動且模型 'gemma3:latest' 已下載。錯誤訊息：{e}")
         return "總結失敗，請檢查 Ollama 服務設定。"
@@ -92,22 +92,34 @@ pdf_files = st.file_uploader(
     "請上傳你的 PDF 檔案", type=["pdf"], accept_multiple_files=True
 )
 
+# 只處理指定的頁面，大型掃描手冊可以分段處理
+page_range_text = st.text_input("頁碼範圍（例如 1-50, 80-；空白表示全部頁面）")
+try:
+    pages = parse_page_range(page_range_text)
+except ValueError as e:
+    st.error(str(e))
+    st.stop()
+
 if pdf_files:
+    # 記錄這次執行各階段的耗時（讀取、OCR）與 Ollama 統計；上傳後第一次執行才會實際 OCR
+    metrics = RunMetrics(model=OLLAMA_MODEL, files=len(pdf_files))
+
     # 提取文字與圖片內容
     with st.spinner("正在讀取 PDF 內容並進行 OCR 辨識..."):
-        full_document_text = get_pdf_content_with_ocr(pdf_files)
+        # 只讀取放得進模型 context 的內容
+        full_document_text = get_pdf_content_with_ocr(pdf_files, max_tokens=input_token_budget(OLLAMA_MODEL), metrics=metrics, pages=pages)
         
     st.success("PDF 內容讀取與 OCR 辨識完成！")
     
     # 顯示提取出的文字 (方便除錯)
     with st.expander("點此查看所有提取出的文字內容"):
-        st.text_area("所有文件文字內容", value=full_document_text, height=300)
+        st.text_area("提取出的文字內容（總結使用的部分）", value=full_document_text, height=300)
     
     # 總結文字
     if st.button("開始總結", key="summarize_button"):
         if full_document_text.strip():
             with st.spinner("正在使用 Gemma 3 總結文件..."):
-                summary = get_ollama_summary(full_document_text)
+                summary = get_ollama_summary(full_document_text, metrics)
                 
             st.success("總結完成！")
             
@@ -115,3 +127,6 @@ if pdf_files:
             st.write(summary)
         else:
             st.warning("沒有可總結的文字，請確保 PDF 檔案內容可被提取或辨識。")
+
+    # 寫入 JSON log 並顯示可收合的效能指標面板
+    show_metrics_panel(metrics, metrics.log())
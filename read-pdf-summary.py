@@ -1,47 +1,61 @@
 import streamlit as st
-import ollama
-import fitz  # PyMuPDF
-from opencc import OpenCC
+from boilerplate import DEDUPE, clean_segments, dedupe_chunks, dedupe_stats_text
+from chunking import chunk_segments, get_context_length, input_token_budget
+from extractors import iter_file_segments, render_segment, render_segments
+from ollama_backend import cached_chat
+from spool import spool_upload
 import re
 import os 
 
 from dotenv import load_dotenv
-load_dotenv()
-LLM_MODEL = os.getenv("LLM_MODEL")
 
-print(LLM_MODEL)
+# 讀取 .env 只需要在每個 process 執行一次，rerun 時不會重新讀取
+@st.cache_resource
+def load_settings():
+    load_dotenv()
+    llm_model = os.getenv("LLM_MODEL")
+    print(llm_model)
+    return llm_model
+
+LLM_MODEL = load_settings()
 def remove_think_tags(text):
     return re.sub(r"<think>.*?</think>", "", text, flags=re.DOTALL).strip()
 # --- 函數定義 ---
-# 初始化轉換器（s2t 表示簡體轉繁體）
-cc = OpenCC('s2t')
+# 初始化轉換器（s2t 表示簡體轉繁體）；每個 process 只建立一次，rerun 時共用
+@st.cache_resource
+def get_converter():
+    from opencc import OpenCC
+    return OpenCC('s2t')
 
 def enforce_traditional(text):
-    return cc.convert(text)
+    return get_converter().convert(text)
 
 # 讀取 PDF 檔案文字（不進行 OCR）
-def get_pdf_text(pdf_files):
+def iter_pdf_text(pdf_files):
     """
-    從多個 PDF 檔案中提取文字。
+    從多個 PDF 檔案中逐頁產生文字（依檔案內容快取）。
     """
-    full_text = ""
     for pdf_file in pdf_files:
         st.write(f"正在處理檔案：{pdf_file.name}")
         try:
-            # 使用 PyMuPDF 從 Streamlit 的上傳檔案中讀取
-            pdf_document = fitz.open(stream=pdf_file.read(), filetype="pdf")
-            
-            for page_num in range(len(pdf_document)):
-                page = pdf_document.load_page(page_num)
-                
-                # 提取頁面文字
-                page_text = page.get_text()
-                full_text += page_text + "\n"
-                
+            # 先寫入暫存檔再以路徑開啟，讀完後刪除
+            with spool_upload(pdf_file) as spooled:
+                yield from iter_file_segments(pdf_file.name, spooled)
         except Exception as e:
             st.error(f"處理檔案 {pdf_file.name} 時發生錯誤：{e}")
-            
-    return full_text
+
+def get_pdf_text(pdf_files, max_tokens=None, dedupe_stats=None):
+    """
+    從多個 PDF 檔案中提取文字（已移除頁首頁尾與重複段落）；
+    指定 max_tokens 時讀到放得進一次請求的長度就停止（在頁邊界切開）。
+    """
+    segments = clean_segments(iter_pdf_text(pdf_files), dedupe_stats)
+    if max_tokens is None:
+        return "".join(render_segments(segments))
+    chunks = chunk_segments(segments, max_tokens, render_segment)
+    if DEDUPE:
+        chunks = dedupe_chunks(chunks, dedupe_stats)
+    return next(chunks, "")
 
 # 使用 Ollama 總結文字
 def get_ollama_summary(text):
@@ -86,11 +100,12 @@ def get_ollama_summary(text):
        - 忽略與操作流程無關的所有細節與背景資訊。
 
     ### 待處理文件內容 ###
-    {text[:100000]}
+    {text}
     """
 
     try:
-        response = ollama.chat(
+        # 結果存入持久化快取，相同內容再次總結時不需要再呼叫 LLM
+        return cached_chat(
             # model='qwen2:7b',  
             # model='qwen3:8b',
             model=LLM_MODEL,
@@ -98,9 +113,9 @@ def get_ollama_summary(text):
             messages=[
                 {'role': 'system', 'content': system_prompt},
                 {'role': 'user', 'content': user_prompt}
-            ]
+            ],
+            options={'num_ctx': get_context_length(LLM_MODEL)},  # 明確指定 context 長度，避免 Ollama 以預設值截斷
         )
-        return response['message']['content']
     except Exception as e:
         return f"與 Ollama 溝通時發生錯誤：{e}"
 
@@ -115,12 +130,18 @@ pdf_files = st.file_uploader(
 )
 
 if pdf_files and st.button("開始總結", key="summarize_button"):
+    dedupe_stats = {}
     with st.spinner("正在讀取 PDF 內容..."):
-        full_document_text = get_pdf_text(pdf_files)
+        # 只讀取放得進模型 context 的內容
+        full_document_text = get_pdf_text(
+            pdf_files, max_tokens=input_token_budget(LLM_MODEL, prompt_tokens=1024), dedupe_stats=dedupe_stats
+        )
+    if dedupe_stats:
+        st.caption(dedupe_stats_text(dedupe_stats))
         
     # 顯示提取出的文字（方便除錯）
     with st.expander("點此查看所有提取出的文字內容"):
-        st.text_area("所有文件文字內容", value=full_document_text, height=500)
+        st.text_area("提取出的文字內容（總結使用的部分）", value=full_document_text, height=500)
         
     if full_document_text.strip():
         with st.spinner("正在使用 LLM 總結文件..."):
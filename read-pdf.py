@@ -1,54 +1,55 @@
 import os
+import threading
+import time
 import gradio as gr
-from langchain_community.document_loaders import PyPDFLoader
-from langchain.chains.summarize import load_summarize_chain
-from langchain_huggingface import HuggingFacePipeline
-from transformers import pipeline, AutoModelForCausalLM, AutoTokenizer, BitsAndBytesConfig
-import torch
+
+from hf_pipeline import load_text_generation, map_reduce_summarize
+
+# 啟動時間量測的起點
+START_TIME = time.perf_counter()
 
 # --- 安裝必要的函式庫 ---
 # 為了避免版本衝突，建議重新安裝或更新。
-# pip install --upgrade langchain langchain-community gradio pypdf transformers accelerate bitsandbytes torch langchain-huggingface
-# 另外，請確保已安裝 sentence-transformers，以便某些 LangChain 功能能正常運作。
-# pip install sentence-transformers
+# pip install --upgrade langchain-community gradio pypdf transformers accelerate torch
+# 使用 GPU 4-bit 量化時另外安裝 bitsandbytes；只用 CPU 的伺服器不需要。
 
 # --- 設定模型 ---
-# 使用 4-bit 量化設定來減少 VRAM 使用量，以適應 RTX 3050 Ti
-quantization_config = BitsAndBytesConfig(
-    load_in_4bit=True,
-    bnb_4bit_quant_type="nf4",
-    bnb_4bit_compute_dtype=torch.bfloat16,
-    bnb_4bit_use_double_quant=True,
-)
-
+# torch / transformers / langchain 與模型都在第一次需要時才載入，Gradio 啟動不必等待模型。
 # 載入 tokenizer 和模型
 # 已更換為更適合 4GB VRAM 的模型：microsoft/Phi-3-mini-4k-instruct
 model_id = "microsoft/Phi-3-mini-4k-instruct"
-tokenizer = AutoTokenizer.from_pretrained(model_id, trust_remote_code=True)
-model = AutoModelForCausalLM.from_pretrained(
-    model_id,
-    device_map="auto",
-    quantization_config=quantization_config,
-    trust_remote_code=True,
-)
-
-# 使用 HuggingFace Pipeline 建立摘要模型
-pipe = pipeline(
-    "text-generation",
-    model=model,
-    tokenizer=tokenizer,
-    max_new_tokens=1024,
-    do_sample=True,
-    temperature=0.7,
-    top_p=0.9,
-    # 這裡可以根據需要調整
-)
-llm = HuggingFacePipeline(pipeline=pipe)
+
+# 與 LangChain map_reduce 摘要鏈預設相同的 prompt
+MAP_PROMPT = 'Write a concise summary of the following:\n\n\n"{text}"\n\n\nCONCISE SUMMARY:'
+COMBINE_PROMPT = MAP_PROMPT
+
+_llm = None
+_llm_lock = threading.Lock()
+
+
+def get_llm():
+    """取得共用的 text-generation pipeline（每個 process 只載入一次；多個請求同時呼叫時只有一個會載入模型）"""
+    global _llm
+    with _llm_lock:
+        if _llm is None:
+            _llm = _load_llm()
+        return _llm
+
+
+def _load_llm():
+    # GPU 使用 4-bit 量化（bitsandbytes）；沒有 CUDA 或設定 HF_DEVICE=cpu 時以 CPU 執行（見 hf_pipeline.py）
+    return load_text_generation(
+        model_id,
+        max_new_tokens=1024,
+        do_sample=True,
+        temperature=0.7,
+        top_p=0.9,
+    )
 
 
 def summarize_pdf(pdf_file, custom_prompt=""):
     """
-    接收一個 PDF 檔案物件，並使用 LangChain 和本地模型進行摘要。
+    接收一個 PDF 檔案物件，並使用本地模型以 map-reduce 方式進行摘要。
     
     Args:
         pdf_file: Gradio File 元件提供的檔案物件。
@@ -65,18 +66,15 @@ def summarize_pdf(pdf_file, custom_prompt=""):
         # 從檔案物件中取得路徑
         pdf_file_path = pdf_file.name
         
+        from langchain_community.document_loaders import PyPDFLoader
+
         # 載入 PDF 文件
         loader = PyPDFLoader(pdf_file_path)
         docs = loader.load_and_split()
         
-        # 載入摘要鏈
-        chain = load_summarize_chain(llm, chain_type="map_reduce")
-        
-        # 執行摘要，已更新為 `invoke` 方法
-        summary = chain.invoke({"input_documents": docs})
-        
-        # `invoke` 返回一個字典，摘要結果在 'output_text' 鍵中
-        return summary.get('output_text', '無法生成摘要。')
+        # map 階段把所有段落一次交給 pipeline 批次生成（HF_BATCH_SIZE），再合併成一份摘要
+        summary = map_reduce_summarize(get_llm(), [doc.page_content for doc in docs], MAP_PROMPT, COMBINE_PROMPT)
+        return summary or '無法生成摘要。'
 
     except Exception as e:
         return f"發生錯誤: {e}"
@@ -99,6 +97,10 @@ def main():
         description="此應用程式讓您能夠離線摘要您的 PDF 檔案。",
     )
     
+    # 在背景預先載入模型，介面先啟動；第一個請求若模型還沒載入完成會在 get_llm() 等待
+    threading.Thread(target=get_llm, name="load-llm", daemon=True).start()
+    print(f"介面啟動耗時：{(time.perf_counter() - START_TIME) * 1000:.0f} ms（模型於背景載入中）")
+
     # 在本機運行 Gradio 應用程式
     interface.launch()
 
@@ -0,0 +1,294 @@
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter
+from contextlib import closing
+
+from boilerplate import clean_segments
+from chunking import chunk_text
+from disk_cache import CACHE_DIR, content_sha256
+from extractors import iter_file_segments
+from summarizer import render_clean_segment
+
+# ==== 本地檢索索引（SQLite） ====
+# 問答模式只把與問題相關的幾個段落送給模型，而不是整份文件。
+# 上傳過的文件依內容 SHA-256 切成小段落存入索引，之後的問題不需要重新擷取：
+#   BM25        postings 表以 (詞, 段落) 為 key，查詢只讀取問題中各詞的 posting；
+#               出現在過半段落的詞（幾乎沒有鑑別度）不讀取，查詢耗時不隨文件庫成長而線性增加。
+#   向量檢索    設定 EMBED_MODEL 時以 Ollama 計算 embedding，與 BM25 結果以 RRF 合併排序。
+# 切段方式或 tokenizer 改變時請調升 INDEX_VERSION，文件下次上傳時會重新建立索引。
+
+INDEX_VERSION = "2"
+RETRIEVAL_CHUNK_TOKENS = int(os.getenv("RETRIEVAL_CHUNK_TOKENS", "400"))
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "5"))
+# 未設定時只使用 BM25（例如 EMBED_MODEL=nomic-embed-text 或 bge-m3）
+EMBED_MODEL = os.getenv("EMBED_MODEL", "")
+EMBED_BATCH = int(os.getenv("EMBED_BATCH", "32"))
+BM25_K1 = 1.2
+BM25_B = 0.75
+# 出現在超過這個比例段落的詞不參與 BM25（IDF 接近 0，卻是最長的 posting）；
+# 段落數少於 MAX_DF_MIN_CHUNKS 時讀取全部 posting 也很快，不略過
+MAX_DF_RATIO = 0.5
+MAX_DF_MIN_CHUNKS = 100
+# Reciprocal Rank Fusion 的常數
+RRF_K = 60
+
+TERM = re.compile(r'[\u3400-\u9fff\uf900-\ufaff]+|[a-z0-9]+')
+UNIT_LABELS = {"page": "第 {} 頁", "slide": "投影片 {}", "sheet": "工作表 {}", "rows": "第 {} 列起"}
+
+
+def tokenize(text):
+    """英數字以單字、中文以相鄰兩字（bigram）作為檢索用的詞"""
+    terms = []
+    for match in TERM.finditer(text.lower()):
+        run = match.group()
+        if run.isascii() or len(run) == 1:
+            terms.append(run)
+        else:
+            terms.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return terms
+
+
+def passage_label(passage):
+    """段落出處，例如「manual.pdf 第 3 頁」、「report.xlsx 工作表 Sheet1 第 10002 列起」"""
+    if passage["unit"] == "rows" and ":" in str(passage["number"]):
+        # 試算表的後續批次為「工作表名稱:起始列」（工作表名稱不能包含冒號）
+        sheet, _, row = str(passage["number"]).rpartition(":")
+        return f"{passage['name']} {UNIT_LABELS['sheet'].format(sheet)} {UNIT_LABELS['rows'].format(row)}"
+    label = UNIT_LABELS.get(passage["unit"])
+    return f"{passage['name']} {label.format(passage['number'])}" if label else passage["name"]
+
+
+# ==== Embedding ====
+def embed_texts(texts, model=EMBED_MODEL):
+    """以 Ollama 計算 embedding，回傳已正規化的 float32 矩陣（每列一段文字）"""
+    import numpy as np
+    from ollama_pool import get_ollama_pool
+
+    pool = get_ollama_pool()
+    vectors = []
+    for start in range(0, len(texts), EMBED_BATCH):
+        response = pool.embed(model=model, input=texts[start:start + EMBED_BATCH])
+        vectors.extend(response["embeddings"])
+    matrix = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+
+class RetrievalIndex:
+    """以 SQLite 保存的段落索引；多個 process 可共用同一個資料庫檔案"""
+
+    def __init__(self, path):
+        self.path = path
+        self._vectors = None  # (索引狀態, 段落 id 陣列, embedding 矩陣)，在同一個 process 內重複使用
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(
+                """CREATE TABLE IF NOT EXISTS documents (
+                       doc_id TEXT PRIMARY KEY,
+                       name TEXT NOT NULL,
+                       version TEXT NOT NULL,
+                       embed_model TEXT NOT NULL,
+                       chunks INTEGER NOT NULL,
+                       length INTEGER NOT NULL,
+                       added_at REAL NOT NULL
+                   );
+                   CREATE TABLE IF NOT EXISTS chunks (
+                       chunk_id INTEGER PRIMARY KEY,
+                       doc_id TEXT NOT NULL,
+                       unit TEXT NOT NULL,
+                       number TEXT,
+                       text TEXT NOT NULL,
+                       length INTEGER NOT NULL,
+                       embedding BLOB
+                   );
+                   CREATE INDEX IF NOT EXISTS idx_chunks_doc ON chunks(doc_id);
+                   CREATE TABLE IF NOT EXISTS postings (
+                       term TEXT NOT NULL,
+                       chunk_id INTEGER NOT NULL,
+                       tf INTEGER NOT NULL,
+                       PRIMARY KEY (term, chunk_id)
+                   ) WITHOUT ROWID;
+                   CREATE INDEX IF NOT EXISTS idx_postings_chunk ON postings(chunk_id);
+                   CREATE TABLE IF NOT EXISTS terms (
+                       term TEXT PRIMARY KEY,
+                       df INTEGER NOT NULL
+                   ) WITHOUT ROWID;"""
+            )
+
+    def _connect(self):
+        # 與 DiskCache 相同：每次操作開新連線，可在多執行緒間共用
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA busy_timeout=30000")
+        return closing(conn)
+
+    # ---- 建立索引 ----
+    def add_document(self, name, data):
+        """
+        將檔案（bytes 或 SpooledFile）切段加入索引，回傳 doc_id（內容 SHA-256）。
+        相同內容且相同索引設定的文件已存在時直接回傳，不重新擷取。
+        """
+        doc_id = content_sha256(data)
+        version = f"{INDEX_VERSION}:{RETRIEVAL_CHUNK_TOKENS}"
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT version, embed_model FROM documents WHERE doc_id = ?", (doc_id,)
+            ).fetchone()
+        if row == (version, EMBED_MODEL):
+            return doc_id
+
+        # 擷取與 embedding 在交易外進行，不佔住資料庫的寫入鎖
+        rows = []
+        for segment in clean_segments(iter_file_segments(name, data)):
+            for text in chunk_text(render_clean_segment(segment), RETRIEVAL_CHUNK_TOKENS):
+                if text.strip():
+                    rows.append((segment.unit, str(segment.number), text.strip(), tokenize(text)))
+        embeddings = [None] * len(rows)
+        if EMBED_MODEL and rows:
+            embeddings = [vector.tobytes() for vector in embed_texts([row[2] for row in rows])]
+
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._delete(conn, doc_id)
+                for (unit, number, text, terms), embedding in zip(rows, embeddings):
+                    cursor = conn.execute(
+                        "INSERT INTO chunks (doc_id, unit, number, text, length, embedding) VALUES (?, ?, ?, ?, ?, ?)",
+                        (doc_id, unit, number, text, len(terms), embedding),
+                    )
+                    counts = Counter(terms)
+                    conn.executemany(
+                        "INSERT INTO postings (term, chunk_id, tf) VALUES (?, ?, ?)",
+                        [(term, cursor.lastrowid, tf) for term, tf in counts.items()],
+                    )
+                    conn.executemany(
+                        "INSERT INTO terms (term, df) VALUES (?, 1) ON CONFLICT(term) DO UPDATE SET df = df + 1",
+                        [(term,) for term in counts],
+                    )
+                conn.execute(
+                    "INSERT INTO documents (doc_id, name, version, embed_model, chunks, length, added_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (doc_id, name, version, EMBED_MODEL, len(rows), sum(len(row[3]) for row in rows), time.time()),
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return doc_id
+
+    def _delete(self, conn, doc_id):
+        """移除文件的舊索引（版本變更後重新建立時使用）"""
+        chunk_ids = [row[0] for row in conn.execute("SELECT chunk_id FROM chunks WHERE doc_id = ?", (doc_id,))]
+        for chunk_id in chunk_ids:
+            terms = [row[0] for row in conn.execute("SELECT term FROM postings WHERE chunk_id = ?", (chunk_id,))]
+            conn.executemany("UPDATE terms SET df = df - 1 WHERE term = ?", [(term,) for term in terms])
+        conn.execute("DELETE FROM terms WHERE df <= 0")
+        conn.executemany("DELETE FROM postings WHERE chunk_id = ?", [(chunk_id,) for chunk_id in chunk_ids])
+        conn.execute("DELETE FROM chunks WHERE doc_id = ?", (doc_id,))
+        conn.execute("DELETE FROM documents WHERE doc_id = ?", (doc_id,))
+
+    def stats(self):
+        """索引中的文件數與段落數"""
+        with self._connect() as conn:
+            documents, chunks = conn.execute("SELECT COUNT(*), COALESCE(SUM(chunks), 0) FROM documents").fetchone()
+        return {"documents": documents, "chunks": chunks}
+
+    # ---- 查詢 ----
+    def _bm25(self, conn, question, doc_ids, limit):
+        total, length = conn.execute("SELECT COALESCE(SUM(chunks), 0), COALESCE(SUM(length), 0) FROM documents").fetchone()
+        if not total:
+            return []
+        avg_length = length / total
+        scores = {}
+        for term in set(tokenize(question)):
+            row = conn.execute("SELECT df FROM terms WHERE term = ?", (term,)).fetchone()
+            if row is None or (total >= MAX_DF_MIN_CHUNKS and row[0] > MAX_DF_RATIO * total):
+                continue
+            df = row[0]
+            idf = math.log(1 + (total - df + 0.5) / (df + 0.5))
+            postings = conn.execute(
+                "SELECT p.chunk_id, p.tf, c.length, c.doc_id FROM postings p JOIN chunks c USING (chunk_id) WHERE p.term = ?",
+                (term,),
+            )
+            for chunk_id, tf, chunk_length, doc_id in postings:
+                if doc_ids is not None and doc_id not in doc_ids:
+                    continue
+                norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * chunk_length / avg_length)
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (BM25_K1 + 1) / norm
+        return sorted(scores, key=scores.get, reverse=True)[:limit]
+
+    def _load_vectors(self, conn):
+        """讀出目前 embedding 模型的所有段落向量；索引有變動時才重新讀取"""
+        import numpy as np
+
+        state = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(chunks), 0), MAX(added_at) FROM documents WHERE embed_model = ?",
+            (EMBED_MODEL,),
+        ).fetchone()
+        with self._lock:
+            if self._vectors is None or self._vectors[0] != state:
+                rows = conn.execute(
+                    "SELECT c.chunk_id, c.doc_id, c.embedding FROM chunks c JOIN documents d USING (doc_id) "
+                    "WHERE d.embed_model = ? AND c.embedding IS NOT NULL",
+                    (EMBED_MODEL,),
+                ).fetchall()
+                ids = [(chunk_id, doc_id) for chunk_id, doc_id, _ in rows]
+                matrix = np.frombuffer(b"".join(row[2] for row in rows), dtype=np.float32).reshape(len(rows), -1)
+                self._vectors = (state, ids, matrix)
+            return self._vectors[1], self._vectors[2]
+
+    def _dense(self, conn, question, doc_ids, limit):
+        import numpy as np
+
+        ids, matrix = self._load_vectors(conn)
+        if not ids:
+            return []
+        scores = matrix @ embed_texts([question])[0]
+        if doc_ids is not None:
+            mask = np.fromiter((doc_id in doc_ids for _, doc_id in ids), dtype=bool, count=len(ids))
+            scores = np.where(mask, scores, -np.inf)
+        top = np.argsort(-scores)[:limit]
+        return [ids[i][0] for i in top if np.isfinite(scores[i])]
+
+    def search(self, question, k=RETRIEVAL_TOP_K, doc_ids=None):
+        """
+        回傳與問題最相關的 k 個段落 [{name, unit, number, text, score}]。
+        doc_ids 指定時只在這些文件中搜尋。
+        """
+        doc_ids = set(doc_ids) if doc_ids is not None else None
+        candidates = k * 4
+        with self._connect() as conn:
+            rankings = [self._bm25(conn, question, doc_ids, candidates)]
+            if EMBED_MODEL:
+                rankings.append(self._dense(conn, question, doc_ids, candidates))
+            fused = {}
+            for ranking in rankings:
+                for rank, chunk_id in enumerate(ranking):
+                    fused[chunk_id] = fused.get(chunk_id, 0.0) + 1 / (RRF_K + rank + 1)
+            top = sorted(fused, key=fused.get, reverse=True)[:k]
+            passages = []
+            for chunk_id in top:
+                name, unit, number, text = conn.execute(
+                    "SELECT d.name, c.unit, c.number, c.text FROM chunks c JOIN documents d USING (doc_id) "
+                    "WHERE c.chunk_id = ?",
+                    (chunk_id,),
+                ).fetchone()
+                passages.append({"name": name, "unit": unit, "number": number, "text": text,
+                                 "score": round(fused[chunk_id], 4)})
+        return passages
+
+
+_index = None
+
+
+def get_index():
+    """取得共用的檢索索引（每個 process 建立一次）"""
+    global _index
+    if _index is None:
+        _index = RetrievalIndex(os.path.join(CACHE_DIR, "index.sqlite3"))
+    return _index
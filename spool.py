@@ -0,0 +1,102 @@
+import hashlib
+import io
+import mmap
+import os
+import tempfile
+from contextlib import contextmanager
+
+from disk_cache import CACHE_DIR
+
+# ==== 上傳檔案落地 ====
+# 上傳檔案先分塊寫入暫存檔（同時計算 SHA-256），之後以路徑交給擷取器：
+#   - 不需要 getvalue() 複製出整份檔案的 bytes，PyMuPDF 以路徑開啟時也不會再複製一份到記憶體
+#   - 擷取器（PyMuPDF、openpyxl、pandas、python-docx、python-pptx）依需要從檔案讀取，
+#     每個上傳檔案的記憶體用量不隨檔案大小增加
+#   - 快取 key 直接使用寫入時算好的 SHA-256，不必再讀一次檔案
+# 擷取器同時接受 bytes（benchmark）與 SpooledFile，以 as_file() / read_text() 取得內容。
+# 注意：Streamlit 本身仍會把上傳內容保留在記憶體中（上限為 server.maxUploadSize）。
+
+SPOOL_DIR = os.getenv("SPOOL_DIR", os.path.join(CACHE_DIR, "spool"))
+SPOOL_CHUNK_BYTES = 1024 * 1024
+
+
+class SpooledFile:
+    """磁碟上的檔案與它的內容 SHA-256"""
+
+    def __init__(self, path, size, sha256):
+        self.path = path
+        self.size = size
+        self.sha256 = sha256
+
+    @contextmanager
+    def mmap(self):
+        """以唯讀記憶體映射開啟，內容由作業系統依需要載入，不計入 process 的私有記憶體"""
+        with open(self.path, "rb") as f:
+            if self.size == 0:
+                yield b""
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                yield mapped
+
+
+def _copy_and_hash(src, dst):
+    """分塊複製 src 到 dst（dst 為 None 時只計算），回傳 (大小, SHA-256)"""
+    digest = hashlib.sha256()
+    size = 0
+    while True:
+        block = src.read(SPOOL_CHUNK_BYTES)
+        if not block:
+            return size, digest.hexdigest()
+        digest.update(block)
+        size += len(block)
+        if dst is not None:
+            dst.write(block)
+
+
+def open_local_file(path):
+    """已在磁碟上的檔案（批次處理）不需要複製，直接分塊計算 SHA-256"""
+    with open(path, "rb") as f:
+        size, sha256 = _copy_and_hash(f, None)
+    return SpooledFile(path, size, sha256)
+
+
+@contextmanager
+def spool_upload(upload):
+    """將上傳檔案（file-like）分塊寫入 SPOOL_DIR 下的暫存檔，產生 SpooledFile；離開 with 區塊時刪除"""
+    os.makedirs(SPOOL_DIR, exist_ok=True)
+    suffix = os.path.splitext(getattr(upload, "name", ""))[1]
+    fd, path = tempfile.mkstemp(suffix=suffix, dir=SPOOL_DIR)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            upload.seek(0)
+            size, sha256 = _copy_and_hash(upload, f)
+        upload.seek(0)
+        yield SpooledFile(path, size, sha256)
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def upload_sha256(upload):
+    """計算上傳檔案的 SHA-256，分塊讀取而不複製出整份 bytes"""
+    upload.seek(0)
+    _, sha256 = _copy_and_hash(upload, None)
+    upload.seek(0)
+    return sha256
+
+
+def as_file(data):
+    """擷取器使用：SpooledFile 回傳路徑，bytes 包成 BytesIO"""
+    if isinstance(data, SpooledFile):
+        return data.path
+    return io.BytesIO(data)
+
+
+def read_text(data):
+    """擷取器使用：以 UTF-8 解碼完整內容；SpooledFile 從記憶體映射直接解碼，不先讀出一份 bytes"""
+    if isinstance(data, SpooledFile):
+        with data.mmap() as mapped:
+            return str(mapped, "utf-8", errors="ignore")
+    return data.decode("utf-8", errors="ignore")
@@ -0,0 +1,143 @@
+import re
+import time
+
+# ==== 串流輸出的增量處理 ====
+# 串流時每個 token 只處理新增的部分：
+#   ThinkTagFilter     以狀態機濾掉 <think>/<thinking> 區段
+#   IncrementalConverter 只轉換已完整的文字（簡轉繁）
+#   StreamRenderer     串起上述兩者，並依時間或字數節流 UI 更新
+# 串流結束後仍應對完整結果做一次 remove_think_tags / enforce_traditional，確保最終輸出一致。
+
+THINK_TAG = re.compile(r'<\s*(/?)\s*think(?:ing)?\s*>', re.IGNORECASE)
+THINK_TAG_FORMS = ("<think>", "</think>", "<thinking>", "</thinking>")
+# 可能是標籤開頭、需要等待後續 token 的最大長度
+MAX_PENDING_TAG = 32
+
+
+def _could_be_tag_prefix(text):
+    """判斷 text（以 < 開頭）是否可能是尚未收完的思考標籤"""
+    if len(text) > MAX_PENDING_TAG or '>' in text:
+        return False
+    compact = re.sub(r'\s', '', text).lower()
+    return any(tag.startswith(compact) for tag in THINK_TAG_FORMS)
+
+
+class ThinkTagFilter:
+    """逐段接收串流內容，輸出不含思考區段的文字"""
+
+    def __init__(self):
+        self.pending = ""
+        self.in_think = False
+
+    def feed(self, text):
+        """送入新內容，回傳可以顯示的新文字"""
+        self.pending += text
+        output = []
+        while self.pending:
+            pos = self.pending.find('<')
+            if pos == -1:
+                if not self.in_think:
+                    output.append(self.pending)
+                self.pending = ""
+                break
+            if pos > 0:
+                if not self.in_think:
+                    output.append(self.pending[:pos])
+                self.pending = self.pending[pos:]
+
+            match = THINK_TAG.match(self.pending)
+            if match:
+                # 開始標籤進入思考區段，結束標籤（包含沒有對應開始標籤的）離開
+                self.in_think = not match.group(1)
+                self.pending = self.pending[match.end():]
+            elif _could_be_tag_prefix(self.pending):
+                break
+            else:
+                if not self.in_think:
+                    output.append('<')
+                self.pending = self.pending[1:]
+        return "".join(output)
+
+    def flush(self):
+        """串流結束時輸出剩下的內容"""
+        text = "" if self.in_think else self.pending
+        self.pending = ""
+        return text
+
+
+class IncrementalConverter:
+    """只轉換到最後一個斷句點為止的文字，避免詞組被 token 邊界切開而轉換錯誤"""
+
+    BOUNDARY = re.compile(r'[\s。，、；：！？,.;:!?）)」』】]')
+    MAX_PENDING = 200
+
+    def __init__(self, convert):
+        self.convert = convert
+        self.pending = ""
+
+    def feed(self, text):
+        self.pending += text
+        last = None
+        for last in self.BOUNDARY.finditer(self.pending):
+            pass
+        if last is None:
+            # 長時間沒有斷句點時直接轉換，讓暫存長度維持在上限內
+            if len(self.pending) < self.MAX_PENDING:
+                return ""
+            ready, self.pending = self.pending, ""
+            return self.convert(ready)
+        ready, self.pending = self.pending[:last.end()], self.pending[last.end():]
+        return self.convert(ready)
+
+    def flush(self):
+        text, self.pending = self.pending, ""
+        return self.convert(text) if text else ""
+
+
+class StreamRenderer:
+    """
+    串流顯示器：每個 token 的處理成本固定，render(全文) 只在間隔 min_interval 秒
+    或新增 min_chars 字之後才呼叫。
+    """
+
+    def __init__(self, render, convert=None, min_interval=0.25, min_chars=200):
+        self.render = render
+        self.think_filter = ThinkTagFilter()
+        self.converter = IncrementalConverter(convert) if convert else None
+        self.min_interval = min_interval
+        self.min_chars = min_chars
+        self.pieces = []
+        self.unrendered_chars = 0
+        self.last_render = 0.0
+
+    def _append(self, text):
+        if self.converter:
+            text = self.converter.feed(text)
+        if text:
+            self.pieces.append(text)
+            self.unrendered_chars += len(text)
+
+    def feed(self, token):
+        """送入一個串流 token"""
+        self._append(self.think_filter.feed(token))
+        now = time.monotonic()
+        if self.unrendered_chars and (
+            self.unrendered_chars >= self.min_chars or now - self.last_render >= self.min_interval
+        ):
+            self._render(now)
+
+    def _render(self, now):
+        self.render("".join(self.pieces))
+        self.unrendered_chars = 0
+        self.last_render = now
+
+    def finish(self):
+        """串流結束：輸出所有暫存內容並做最後一次顯示，回傳顯示的全文"""
+        self._append(self.think_filter.flush())
+        if self.converter:
+            tail = self.converter.flush()
+            if tail:
+                self.pieces.append(tail)
+        text = "".join(self.pieces)
+        self.render(text)
+        return text
@@ -0,0 +1,451 @@
+import json
+import os
+import re
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import chain
+
+from boilerplate import DEDUPE, DEDUPE_VERSION, clean_segments, dedupe_chunks
+from chunking import OUTPUT_TOKENS, chunk_segments, estimate_tokens, get_context_length, input_token_budget
+from extractors import EXTRACTOR_VERSION, render_segment
+from ollama_backend import cached_chat, keep_alive_for
+
+# ==== 文件總結流程 ====
+# Streamlit 介面（read-file-summary.py）與批次命令列（batch_summary.py）共用的
+# 文字預處理、prompt、token 預算與 Ollama map-reduce 總結。
+
+
+# ==== 工具函式 ====
+def remove_think_tags(text):
+    """移除各種思考標籤和不必要的內容"""
+    # 移除思考標籤
+    text = re.sub(r'<think>.*?</think>', '', text, flags=re.DOTALL)
+    text = re.sub(r'<thinking>.*?</thinking>', '', text, flags=re.DOTALL)
+    # 移除單獨的開始或結束標籤
+    text = re.sub(r'</?think>', '', text, flags=re.IGNORECASE)
+    text = re.sub(r'</?thinking>', '', text, flags=re.IGNORECASE)
+
+    # 移除破損的標籤（如 </think> 沒有對應的 <think>）
+    text = re.sub(r'</?\s*think\s*>', '', text, flags=re.IGNORECASE)
+    text = re.sub(r'</?\s*thinking\s*>', '', text, flags=re.IGNORECASE)
+    # 移除多餘空白
+    text = re.sub(r'\n\s*\n', '\n\n', text)
+    return text.strip()
+
+
+# 簡體轉繁體轉換器（每個 process 只建立一次）
+_converter = None
+
+
+def enforce_traditional(text):
+    global _converter
+    if _converter is None:
+        from opencc import OpenCC
+        _converter = OpenCC('s2t')
+    return _converter.convert(text)
+
+
+# ==== 文字預處理 ====
+def preprocess_text(text):
+    """預處理文字，壓縮多餘空白與空行，但保留換行作為切段的邊界"""
+    text = re.sub(r'[^\S\n]+', ' ', text)
+    text = re.sub(r' ?\n[\s]*', '\n', text)
+    return text.strip()
+
+
+def render_clean_segment(segment):
+    """將單一段落轉成預處理過的文字，每段以換行結尾"""
+    text = preprocess_text(render_segment(segment))
+    return text + "\n" if text else ""
+
+
+def chunk_document(segments, max_tokens, metrics=None, dedupe_stats=None):
+    """
+    邊讀取邊切出不超過 max_tokens 的段落（在頁 / 工作表 / 投影片 / 句號處切開）。
+    切點落在頁的邊界，文件局部修改後，其餘段落通常維持不變而能命中 LLM 結果快取。
+    切段前先移除頁首頁尾與近似重複的段落，切段後再移除重複的區塊；dedupe_stats 為 dict 時累計移除結果。
+    metrics 為 RunMetrics 時把預處理耗時計入 "preprocess"。
+    """
+    render = metrics.timed(render_clean_segment, "preprocess") if metrics else render_clean_segment
+    chunks = chunk_segments(clean_segments(segments, dedupe_stats), max_tokens, render)
+    return dedupe_chunks(chunks, dedupe_stats) if DEDUPE else chunks
+
+
+# ==== Prompt 設定 ====
+# 修改任何 prompt 範本時請調升版本號，讓快取中的舊結果失效
+PROMPT_VERSION = "1"
+SYSTEM_PROMPT = """你是文件摘要專家，請用繁體中文輸出系統操作流程重點。不要使用任何思考過程標籤，直接給出最終答案。"""
+EMPTY_SUMMARY = "沒有可總結的文字。"
+QA_SYSTEM_PROMPT = """你是公司ERP系統的操作助理，只能根據提供的文件段落，用繁體中文回答問題。不要使用任何思考過程標籤，直接給出最終答案。"""
+NO_ANSWER = "在已索引的文件中找不到與問題相關的內容。"
+
+
+def build_summary_prompt(text):
+    """組合完整摘要的 user prompt"""
+    return f"""
+請閱讀我提供的文件（公司ERP系統操作手冊），並依據以下所有規則，將內容整理成一份簡潔、有條理的系統操作流程摘要。
+
+### 輸出規則 ###
+1. **核心目標：**
+   - 僅專注於「系統操作流程」。
+
+2. **格式要求：**
+   - 採用「條列式」呈現。
+   - 每頁摘要 10 到 15 個關鍵重點。
+
+3. **內容要求：**
+   - 保留關鍵專有名詞與重要數字。
+   - 避免重複內容。
+   - 忽略與操作流程無關的所有細節與背景資訊。
+
+內容：
+{text}
+"""
+
+
+def build_map_prompt(chunk):
+    """組合單一段落（map 階段）的 user prompt；不含段落序號，文件改版後未變動的段落才能命中快取"""
+    return f"""
+以下是公司ERP系統操作手冊其中一段的內容。
+請只擷取這一段中的「系統操作流程」，以條列式列出操作步驟、畫面/功能名稱、關鍵專有名詞與重要數字。
+不要加入前言或結論，若這一段沒有任何操作流程，請只回覆「無」。
+
+內容：
+{chunk}
+"""
+
+
+def build_reduce_prompt(partial_summaries):
+    """組合合併各段摘要（reduce 階段）的 user prompt"""
+    joined = "\n\n".join(
+        f"--- 第 {i+1} 段摘要 ---\n{summary}" for i, summary in enumerate(partial_summaries)
+    )
+    return f"""
+以下是同一份文件（公司ERP系統操作手冊）依序分段整理出的操作流程摘要。
+請將它們合併成一份完整、有條理的系統操作流程摘要。
+
+### 輸出規則 ###
+1. **核心目標：**
+   - 僅專注於「系統操作流程」，並依文件原本的順序排列。
+
+2. **格式要求：**
+   - 採用「條列式」呈現，依功能或流程分小節。
+
+3. **內容要求：**
+   - 保留關鍵專有名詞與重要數字。
+   - 合併各段重複的內容。
+   - 忽略標示為「無」的段落。
+
+各段摘要：
+{joined}
+"""
+
+
+def build_qa_prompt(question, passages):
+    """組合問答的 user prompt；passages 為 (出處, 內容) 的 list"""
+    joined = "\n\n".join(f"--- 段落 {i+1}（{label}）---\n{text}" for i, (label, text) in enumerate(passages))
+    return f"""
+以下是從公司ERP系統操作手冊中檢索出、與問題最相關的段落。
+請只根據這些段落回答問題：以條列式列出操作步驟，並在每個步驟後標註出處（例如「段落 2」）。
+若段落中沒有足夠的資訊，請直接回答「文件中沒有相關說明」，不要自行推測。
+
+相關段落：
+{joined}
+
+問題：{question}
+"""
+
+
+def build_combine_prompt(file_summaries):
+    """組合合併多個檔案摘要的 user prompt；file_summaries 為 (檔名, 摘要) 的 list"""
+    joined = "\n\n".join(f"--- 檔案：{name} ---\n{summary}" for name, summary in file_summaries)
+    return f"""
+以下是多份文件（公司ERP系統操作手冊）各自整理出的操作流程摘要。
+請將它們合併成一份完整、有條理的系統操作流程摘要。
+
+### 輸出規則 ###
+1. **核心目標：**
+   - 僅專注於「系統操作流程」。
+
+2. **格式要求：**
+   - 採用「條列式」呈現，依功能或流程分小節，並標註內容出自哪個檔案。
+
+3. **內容要求：**
+   - 保留關鍵專有名詞與重要數字。
+   - 合併各檔案重複的內容。
+
+各檔案摘要：
+{joined}
+"""
+
+
+# ==== 模型分層 ====
+# map 階段只從單一段落擷取操作步驟，可交給小而快的模型；reduce / combine、單次完整摘要與問答
+# 產生最終輸出，交給大模型。各函式接收的 model（LLM_MODEL）為未設定分層時的預設值：
+#   LLM_MAP_MODEL / LLM_REDUCE_MODEL        各層使用的模型
+#   LLM_MAP_OPTIONS / LLM_REDUCE_OPTIONS    各層額外的 Ollama options（JSON），覆寫預設值，
+#                                           例如 LLM_MAP_OPTIONS='{"temperature": 0.1, "num_predict": 512}'
+#   LLM_MAP_MAX_TOKENS                      map 請求的輸入超過這個 token 數時改用 reduce 模型；
+#                                           0 表示超過 map 模型的 context 長度時才改用
+# 兩個模型要同時常駐，Ollama 伺服器需設定 OLLAMA_MAX_LOADED_MODELS >= 2，否則會來回載入。
+MAP_TIER = "map"
+REDUCE_TIER = "reduce"
+_tier_settings = None
+
+
+def tier_settings():
+    """
+    讀取模型分層設定，回傳 {"map": (模型, options), "reduce": (模型, options), "map_max_tokens": 上限}。
+    第一次使用時才讀取環境變數（各程式在 import 之後才執行 load_dotenv）。
+    """
+    global _tier_settings
+    if _tier_settings is None:
+        _tier_settings = {
+            MAP_TIER: (os.getenv("LLM_MAP_MODEL", ""), json.loads(os.getenv("LLM_MAP_OPTIONS") or "{}")),
+            REDUCE_TIER: (os.getenv("LLM_REDUCE_MODEL", ""), json.loads(os.getenv("LLM_REDUCE_OPTIONS") or "{}")),
+            "map_max_tokens": int(os.getenv("LLM_MAP_MAX_TOKENS", "0")),
+        }
+    return _tier_settings
+
+
+def tier_model(model, tier):
+    """該層使用的模型，未設定時為 model"""
+    return tier_settings()[tier][0] or model
+
+
+def tier_models(model):
+    """實際會用到的模型（預先載入、顯示狀態用），不重複"""
+    return list(dict.fromkeys(tier_model(model, tier) for tier in (MAP_TIER, REDUCE_TIER)))
+
+
+def tier_signature(model):
+    """會影響輸出的分層設定，作為逐檔摘要快取 key 的一部分"""
+    settings = tier_settings()
+    return json.dumps(
+        [[tier_model(model, tier), settings[tier][1]] for tier in (MAP_TIER, REDUCE_TIER)]
+        + [settings["map_max_tokens"]],
+        sort_keys=True, ensure_ascii=False,
+    )
+
+
+def route_model(model, stage, prompt_tokens=0):
+    """
+    依階段與輸入大小選擇模型層，回傳 (tier, 模型, options)：
+    map 階段使用 map 模型，輸入超過 LLM_MAP_MAX_TOKENS（或 map 模型的 context）時改用 reduce 模型；
+    其他階段一律使用 reduce 模型。
+    """
+    settings = tier_settings()
+    tier = REDUCE_TIER
+    if stage == "map":
+        # 未設定上限時以 map 模型實際的 context 判斷（不乘安全係數，依 map_token_budget 切出的段落都放得進）
+        limit = settings["map_max_tokens"] or (
+            get_context_length(tier_model(model, MAP_TIER)) - estimate_tokens(SYSTEM_PROMPT) - OUTPUT_TOKENS
+        )
+        if prompt_tokens <= limit:
+            tier = MAP_TIER
+    name, options = settings[tier]
+    return tier, name or model, options
+
+
+# ==== Token 預算 ====
+# 依負責該階段的模型計算：map 段落放得進 map 模型，合併結果放得進 reduce 模型
+def summary_token_budget(model):
+    """單次完整摘要可放入的文件 token 數"""
+    return input_token_budget(
+        tier_model(model, REDUCE_TIER), estimate_tokens(SYSTEM_PROMPT + build_summary_prompt(""))
+    )
+
+
+def map_token_budget(model, chunk_tokens=0):
+    """map 階段每段的 token 數；chunk_tokens 為 0 時依 map 模型的 context 長度自動計算"""
+    if chunk_tokens:
+        return chunk_tokens
+    return input_token_budget(tier_model(model, MAP_TIER), estimate_tokens(SYSTEM_PROMPT + build_map_prompt("")))
+
+
+def reduce_token_budget(model):
+    """reduce 階段一次可合併的摘要 token 數"""
+    return input_token_budget(
+        tier_model(model, REDUCE_TIER), estimate_tokens(SYSTEM_PROMPT + build_reduce_prompt([]))
+    )
+
+
+# ==== Ollama 調用 ====
+def chat_with_ollama(model, user_prompt, on_token=None, metrics=None, stage="summary", system_prompt=SYSTEM_PROMPT,
+                     cancel=None, status=None):
+    """
+    呼叫 Ollama（結果有持久化快取）；有 on_token 時使用串流，每收到一段新內容就呼叫 on_token(新內容)。
+    實際使用的模型與 options 由 route_model 依 stage 與輸入長度決定。
+    metrics 為 RunMetrics 時以 stage 為名記錄這次請求的統計（含模型層）；cancel 拋出例外時中止生成。
+    status 為 dict 時，超過時間上限只回傳部分內容的請求會在 status["stopped"] 記錄原因。
+    """
+    messages = [
+        {'role': 'system', 'content': system_prompt},
+        {'role': 'user', 'content': user_prompt}
+    ]
+    tier, model, tier_options = route_model(model, stage, estimate_tokens(user_prompt))
+    options = {
+        'temperature': 0.3,  # 降低隨機性提升速度
+        'num_ctx': get_context_length(model),  # 明確指定 context 長度，避免 Ollama 以預設值截斷
+        **tier_options,
+    }
+
+    # 相同內容再次總結時直接使用快取結果（新版本的文件只需重新總結有變動的段落）
+    return cached_chat(
+        model, messages, options,
+        prompt_version=PROMPT_VERSION,
+        on_token=on_token,
+        keep_alive=keep_alive_for(model),
+        metrics=metrics,
+        stage=stage,
+        tier=tier,
+        cancel=cancel,
+        status=status,
+    )
+
+
+# ==== 分段平行總結（map-reduce） ====
+# 單一段落或中間合併失敗、或超過時間上限只回傳部分內容時，以標記文字代替而不中斷整體流程；
+# 這時整份摘要不完整，各函式一併回傳 complete 旗標，呼叫端不應把結果當成完整摘要保存。
+def summarize_chunk(model, chunk, index, metrics=None, cancel=None):
+    """map 階段：總結單一段落，回傳（摘要, 是否完整）；失敗時回傳標記"""
+    status = {}
+    try:
+        prompt = build_map_prompt(chunk)
+        summary = chat_with_ollama(model, prompt, metrics=metrics, stage="map", cancel=cancel, status=status)
+        return remove_think_tags(summary), not status
+    except Exception as e:
+        return f"[第 {index} 段摘要失敗：{e}]", False
+
+
+def map_summaries(model, chunks, max_workers, chunk_progress=None, metrics=None, cancel=None):
+    """
+    邊讀取段落邊以最多 max_workers 個同時進行的請求總結，回傳（依原順序排列的結果, 是否全部完整）。
+    等待中的段落最多保留 2 * max_workers 個，記憶體用量不隨文件長度增加。
+    """
+    results = []
+    pending = {}
+    done = 0
+    complete = True
+
+    def collect(return_when):
+        nonlocal done, complete
+        finished, _ = wait(pending, return_when=return_when)
+        for future in finished:
+            results[pending.pop(future)], ok = future.result()
+            complete = complete and ok
+            done += 1
+            # 在呼叫端的執行緒回報進度，Streamlit 元件只能在 script thread 更新
+            if chunk_progress:
+                chunk_progress(done, len(results))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for i, chunk in enumerate(chunks):
+            results.append(None)
+            pending[executor.submit(summarize_chunk, model, chunk, i + 1, metrics, cancel)] = i
+            if len(pending) >= 2 * max_workers:
+                collect(FIRST_COMPLETED)
+        if pending:
+            collect(ALL_COMPLETED)
+    return results, complete
+
+
+def reduce_group(model, partial_summaries, metrics=None, cancel=None):
+    """中間 reduce：把一組段落摘要合併成一份，回傳（摘要, 是否完整）；失敗時回傳標記"""
+    status = {}
+    try:
+        prompt = build_reduce_prompt(partial_summaries)
+        summary = chat_with_ollama(model, prompt, metrics=metrics, stage="reduce", cancel=cancel, status=status)
+        return remove_think_tags(summary), not status
+    except Exception as e:
+        return f"[合併摘要失敗：{e}]", False
+
+
+def map_reduce_summary(model, chunks, max_workers, chunk_progress=None, on_token=None, metrics=None, cancel=None):
+    """
+    將逐段產生的段落平行總結（map），再把各段摘要合併成最終摘要（reduce）。
+    各段摘要合併後若仍超過 reduce 的 token 預算，會再分組 reduce，確保整份文件都被涵蓋。
+    只有一段時直接做完整摘要。回傳（摘要, 是否完整）：任一段或任一次合併失敗、或超過時間上限只有部分內容時
+    為 False，呼叫端不應快取。最後一次請求失敗時拋出例外，由呼叫端決定如何呈現。
+    """
+    chunks = iter(chunks)
+    first = next(chunks, None)
+    if not first or not first.strip():
+        return EMPTY_SUMMARY, True
+    second = next(chunks, None)
+    status = {}
+    if second is None:
+        summary = chat_with_ollama(model, build_summary_prompt(first), on_token, metrics, cancel=cancel, status=status)
+        return summary, not status
+
+    partials, mapped = map_summaries(model, chain([first, second], chunks), max_workers, chunk_progress, metrics, cancel)
+    partials, reduced = reduce_to_budget(model, partials, max_workers, metrics, cancel)
+    summary = chat_with_ollama(
+        model, build_reduce_prompt(partials), on_token, metrics, stage="reduce", cancel=cancel, status=status
+    )
+    return summary, mapped and reduced and not status
+
+
+def reduce_to_budget(model, partials, max_workers, metrics=None, cancel=None):
+    """
+    摘要總長超過 reduce 的 token 預算時，分組合併成中間摘要，直到放得進一次請求。
+    回傳（摘要, 是否每次合併都完整）。
+    """
+    budget = reduce_token_budget(model)
+    complete = True
+    partial_tokens = [estimate_tokens(summary) for summary in partials]
+    while sum(partial_tokens) > budget and len(partials) > 1:
+        groups, group, group_tokens = [], [], 0
+        for summary, tokens in zip(partials, partial_tokens):
+            if group and group_tokens + tokens > budget:
+                groups.append(group)
+                group, group_tokens = [], 0
+            group.append(summary)
+            group_tokens += tokens
+        groups.append(group)
+        if len(groups) == len(partials):
+            break
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            reduced = list(executor.map(lambda group: reduce_group(model, group, metrics, cancel), groups))
+        partials = [summary for summary, _ in reduced]
+        complete = complete and all(ok for _, ok in reduced)
+        partial_tokens = [estimate_tokens(summary) for summary in partials]
+    return partials, complete
+
+
+# ==== 逐檔總結 ====
+def file_summary_key(model, sha256, chunk_tokens):
+    """單一檔案摘要的快取 key：檔案內容、模型（含分層設定）、prompt 與擷取 / 切段設定相同時可直接重用"""
+    return (
+        f"file_summary:{PROMPT_VERSION}:{EXTRACTOR_VERSION}:{DEDUPE}:{DEDUPE_VERSION}:{tier_signature(model)}:"
+        f"{chunk_tokens}:{sha256}"
+    )
+
+
+def combine_file_summaries(model, file_summaries, max_workers, on_token=None, metrics=None, cancel=None):
+    """
+    將各檔案的摘要合併成一份；只有一個檔案時直接回傳它的摘要。
+    各檔案摘要已各自快取，增減一個檔案只需要重新做這一次合併。
+    """
+    if not file_summaries:
+        return EMPTY_SUMMARY
+    if len(file_summaries) == 1:
+        return file_summaries[0][1]
+    budget = reduce_token_budget(model)
+    if sum(estimate_tokens(summary) for _, summary in file_summaries) > budget:
+        # 檔案很多時先分組合併（會失去檔名標註，但確保所有檔案都被涵蓋）
+        partials, _ = reduce_to_budget(model, [summary for _, summary in file_summaries], max_workers, metrics, cancel)
+        return chat_with_ollama(model, build_reduce_prompt(partials), on_token, metrics, stage="combine", cancel=cancel)
+    return chat_with_ollama(
+        model, build_combine_prompt(file_summaries), on_token, metrics, stage="combine", cancel=cancel
+    )
+
+
+# ==== 問答 ====
+def answer_question(model, question, passages, on_token=None, metrics=None, cancel=None):
+    """只把檢索到的段落送給模型回答問題；passages 為 (出處, 內容) 的 list，沒有段落時不呼叫模型"""
+    if not passages:
+        return NO_ANSWER
+    return chat_with_ollama(
+        model, build_qa_prompt(question, passages), on_token, metrics, stage="qa", system_prompt=QA_SYSTEM_PROMPT,
+        cancel=cancel,
+    )